@@ -13,22 +13,76 @@ Contributed by:
 Source for wiring and pin readings:
 https://cdn.sparkfun.com/assets/learn_tutorials/1/4/3/GeigerCounterType5_connect_with_microcomputer.pdf
 """
-import threading
+import importlib
 import math
+import threading
 import time
-import RPi.GPIO as GPIO
+from typing import TYPE_CHECKING
+
+from PiPocketGeiger.backends import (
+    GPIOBackend,
+    RPiGPIOBackend,
+    GPIOZeroBackend,
+    SimulatedBackend,
+)
+# The constants stay importable from the package.
+from PiPocketGeiger.calibration import Calibration, K_ALPHA  # noqa: F401
+from PiPocketGeiger.core import (  # noqa: F401
+    StatisticsCore,
+    HISTORY_LENGTH,
+    HISTORY_UNIT,
+    PROCESS_PERIOD,
+    MAX_CPM_TIME,
+)
+from PiPocketGeiger.diagnostics import Histogram, TimedLock
+from PiPocketGeiger.events import EventBuffer
+from PiPocketGeiger.scheduler import AdaptiveScheduler, PeriodicScheduler
+from PiPocketGeiger.status import EdgeCounter, Status
+from PiPocketGeiger.windows import SlidingWindow
+
+if TYPE_CHECKING:
+    # Imported on first use at runtime, see __getattr__().
+    from PiPocketGeiger.alarm import ChangePointDetector
+    from PiPocketGeiger.chardev import CharDevBackend
+    from PiPocketGeiger.dispatch import CallbackDispatcher
+    from PiPocketGeiger.gating import NoiseGate
+    from PiPocketGeiger.persistence import HistoryStore
+
+__all__ = [
+    "RadiationWatch",
+    "GPIOBackend",
+    "RPiGPIOBackend",
+    "GPIOZeroBackend",
+    "SimulatedBackend",
+    "CharDevBackend",
+    "EventBuffer",
+    "CallbackDispatcher",
+    "SlidingWindow",
+    "ChangePointDetector",
+    "HistoryStore",
+    "Status",
+    "NoiseGate",
+    "Calibration",
+    "StatisticsCore",
+]
+
+# Classes imported on first use, to keep the package import fast.
+_LAZY_CLASSES = {
+    "CharDevBackend": "PiPocketGeiger.chardev",
+    "CallbackDispatcher": "PiPocketGeiger.dispatch",
+    "ChangePointDetector": "PiPocketGeiger.alarm",
+    "HistoryStore": "PiPocketGeiger.persistence",
+    "NoiseGate": "PiPocketGeiger.gating",
+}
+
 
-__all__ = ["RadiationWatch"]
+def __getattr__(name):
+    if name not in _LAZY_CLASSES:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+    value = getattr(importlib.import_module(_LAZY_CLASSES[name]), name)
+    globals()[name] = value
+    return value
 
-# Number of cells of the history array.
-HISTORY_LENGTH = 200
-# Duration of each history array cell (seconds).
-HISTORY_UNIT = 6
-# Process period for the statistics (milliseconds).
-PROCESS_PERIOD = 160
-MAX_CPM_TIME = HISTORY_LENGTH * HISTORY_UNIT * 1000
-# Magic calibration number from the Arduino lib.
-K_ALPHA = 53.032
 
 # Bounce delay during which we ignore further edges after an edge.
 # In ms.
@@ -36,6 +90,12 @@ K_ALPHA = 53.032
 # We disable it, as we have no bouncing issues.
 BOUNCE_DELAY = None
 
+# Mean number of edges by processing period above which the adaptive mode
+# processes every period: each edge coming while sleeping costs a wakeup
+# besides the one of its period, which only pays off when most periods
+# have no edge (a Poisson mean below ln 2, about 260 CPM).
+ADAPTIVE_MAX_EDGES = math.log(2)
+
 
 def millis():
     """Return current time in milliseconds.
@@ -43,7 +103,14 @@ def millis():
     return int(round(time.time() * 1000))
 
 
-class RadiationWatch:
+def monotonic_millis():
+    """Return the monotonic clock in milliseconds.
+    Unlike millis(), it is not affected by system clock updates (NTP, etc.).
+    """
+    return int(round(time.monotonic() * 1000))
+
+
+class RadiationWatch(StatisticsCore):
     """Driver object for the Pocket Geiger Type 5 connected on Raspberry Pi GPIOs.
 
     Usage:
@@ -54,34 +121,72 @@ class RadiationWatch:
     ```
     """
 
-    def __init__(self, radiation_pin, noise_pin, numbering=GPIO.BCM):
+    def __init__(self, radiation_pin, noise_pin, numbering=None, backend=None,
+                 event_capacity=None, dispatcher=None, windows=None, detector=None,
+                 history_store=None, noise_gate=None, calibration=None, diagnostics=False,
+                 adaptive=False):
         """Initialize the Radiation Watch library, specifying the pin numbers
         for the radiation and noise pin.
         You can also specify the pin numbering mode (BCM numbering by
-        default)."""
-        GPIO.setmode(numbering)
+        default), or the GPIO backend to use (RPiGPIOBackend by default).
+        If event_capacity is given, the timestamps of the last event_capacity
+        radiation and noise events are recorded (see radiation_events()).
+        If a CallbackDispatcher is given, the registered callbacks are called
+        from its worker threads instead of the GPIO edge thread.
+        windows are the sliding windows to maintain besides the default
+        history, as a dictionary of name -> duration in seconds
+        (DEFAULT_WINDOWS by default). See status().
+        If a ChangePointDetector is given, it is fed with each processing
+        period (see register_alarm_callback()).
+        If a HistoryStore is given, the counts history is saved to it
+        periodically, and resumed from it on setup().
+        If a NoiseGate is given, only the pulses close to noise edges are
+        discarded, instead of whole processing periods with noise.
+        calibration is the Calibration converting the counts to a dose
+        (K_ALPHA, without dead-time correction, by default).
+        If diagnostics is true, the timings of the edge callbacks, of the
+        processing periods and of the mutex are recorded (see diagnostics()).
+        If adaptive is true, the processing thread sleeps while no edge
+        comes, up to the next history shift, and accounts for the periods
+        slept through when it wakes up: the readings are the same, but
+        only updated on each edge and each history shift while idle.
+        Above ADAPTIVE_MAX_EDGES edges by period, every period is processed."""
+        super().__init__(windows, detector, noise_gate, calibration)
+        if backend is None:
+            backend = RPiGPIOBackend(numbering)
+        self.backend = backend
         self.radiation_pin = radiation_pin
         self.noise_pin = noise_pin
         self.mutex = threading.Lock()
         self.radiation_callback = None
         self.noise_callback = None
-
-    def status(self):
-        """Return current readings, as a dictionary with:
-            duration -- the duration of the measurements, in seconds;
-            cpm -- the radiation count by minute;
-            uSvh -- the radiation dose, expressed in microSieverts per hour (uSv/h);
-            uSvhError -- the incertitude for the radiation dose."""
-        minutes = min(self.duration, MAX_CPM_TIME) / 1000 / 60.0
-        cpm = self.count / minutes if minutes > 0 else 0
-        return dict(
-            duration=round(self.duration / 1000.0, 2),
-            cpm=round(cpm, 2),
-            uSvh=round(cpm / K_ALPHA, 3),
-            uSvhError=round(math.sqrt(self.count) / minutes / K_ALPHA, 3)
-            if minutes > 0
-            else 0,
-        )
+        self.history_store = history_store
+        self.dispatcher = dispatcher
+        # Pulse listeners to feed, see add_pulse_listener().
+        self._pulse_listeners = (noise_gate,) if noise_gate is not None else ()
+        self.radiation_buffer = EventBuffer(event_capacity) if event_capacity else None
+        self.noise_buffer = EventBuffer(event_capacity) if event_capacity else None
+        self.adaptive = adaptive
+        if adaptive:
+            self.scheduler = AdaptiveScheduler(
+                PROCESS_PERIOD / 1000.0, self._process_tick, self._skip_tick, self._idle_ticks,
+                name="RadiationWatch",
+            )
+        else:
+            self.scheduler = PeriodicScheduler(
+                PROCESS_PERIOD / 1000.0, self._process_statistics, name="RadiationWatch"
+            )
+        # Timing histograms, only when asked for: they cost a few clock reads by edge.
+        self._histograms = None
+        if diagnostics:
+            self._histograms = dict(
+                radiationCallback=Histogram(),
+                noiseCallback=Histogram(),
+                tickLateness=Histogram(),
+                lockHold=Histogram(),
+            )
+            self.mutex = TimedLock(self.mutex, self._histograms["lockHold"])
+            self.scheduler.histogram = self._histograms["tickLateness"]
 
     def register_radiation_callback(self, callback):
         """Register a function that will be called on radiation occurrence. """
@@ -97,95 +202,333 @@ class RadiationWatch:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
-    def setup(self):
+    async def __aenter__(self):
+        return self.setup()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def pulses(self, maxsize=1024, overflow="drop-oldest", noise=False):
+        """Asynchronously iterate over the radiation pulses (and the noise
+        ones if noise is true), as Pulse(kind, timestamp, count) tuples.
+
+        Edges are handed over to the event loop in batches. If the loop lags
+        behind by more than maxsize pulses, the oldest ones are dropped
+        ("drop-oldest" overflow policy) or the newest ones are summed up
+        in a single pulse ("coalesce" overflow policy).
+
+        Usage:
+        ```
+        async with RadiationWatch(24, 23) as radiationWatch:
+            async for pulse in radiationWatch.pulses():
+                print(pulse)
+        ```
+        """
+        from PiPocketGeiger.aio import PulseStream  # pylint: disable=import-outside-toplevel
+
+        stream = PulseStream(maxsize, overflow, noise)
+        self.add_pulse_listener(stream)
+        try:
+            async for pulse in stream:
+                yield pulse
+        finally:
+            self.remove_pulse_listener(stream)
+
+    def add_pulse_listener(self, listener):
+        """Add a listener of the pulses: an object whose push(kind, timestamp)
+        method is called from the GPIO edge thread for each radiation or noise
+        edge (kind being "radiation" or "noise", and timestamp the monotonic
+        clock in nanoseconds), and whose close() method is called when
+        the driver is closed. push() must be fast and must not block."""
+        with self.mutex:
+            self._pulse_listeners += (listener,)
+
+    def remove_pulse_listener(self, listener):
+        """Remove a listener added with add_pulse_listener()."""
+        with self.mutex:
+            self._pulse_listeners = tuple(
+                other for other in self._pulse_listeners if other is not listener
+            )
+
+    def status_stream(self, period):
+        """Asynchronously iterate over the readings (see status()),
+        every period seconds.
+
+        Usage:
+        ```
+        async with RadiationWatch(24, 23) as radiationWatch:
+            async for status in radiationWatch.status_stream(5):
+                print(status)
+        ```
+        """
+        from PiPocketGeiger.aio import status_stream  # pylint: disable=import-outside-toplevel
+
+        return status_stream(self, period)
+
+    def setup(self, scheduler=True):
         """Initialize the driver by setting up GPIO interrupts
-        and periodic statistics processing. """
+        and periodic statistics processing.
+        If scheduler is false, the statistics are not processed
+        periodically: the caller runs the processing periods itself
+        (as SensorManager does for all its sensors)."""
         # Initialize the statistics variables.
-        self.radiation_count = 0
-        self.noise_count = 0
-        self.count = 0
-        # Initialize count_history[].
-        self.count_history = [0] * HISTORY_LENGTH
-        self.history_index = 0
-        # Init measurement time.
-        self.previous_time = millis()
-        self.previous_history_time = millis()
-        self.duration = 0
-        # Init the GPIO context.
-        # Raw data of Radiation Pulse: Not-detected -> High, Detected -> Low.
-        GPIO.setup(self.radiation_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        # Raw data of Noise Pulse: Not-detected -> Low, Detected -> High.
-        GPIO.setup(self.noise_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        # Register local callbacks.
-        # As the signal from the radiation pin is high by default
-        # and low when a ray hit the sensor, we want to listen on the edges falls.
-        GPIO.add_event_detect(
-            self.radiation_pin,
-            GPIO.FALLING,
-            callback=self._on_radiation,
-            **{"bouncetime": BOUNCE_DELAY} if BOUNCE_DELAY else {},
-        )
-        # As the signal from the noise pin is low by default and high when noise occurs,
-        # we want to listen on the edges rises.
-        GPIO.add_event_detect(
-            self.noise_pin,
-            GPIO.RISING,
-            callback=self._on_noise,
-            **{"bouncetime": BOUNCE_DELAY} if BOUNCE_DELAY else {},
-        )
-        # Enable the timer for processing the statistics periodically.
-        self._enable_timer()
+        self._radiation_counter = EdgeCounter()
+        self._noise_counter = EdgeCounter()
+        # Total edges counted since the setup.
+        self.radiation_total = 0
+        self.noise_total = 0
+        self.reset(monotonic_millis(), time.monotonic_ns())
+        # Time of the setup, origin of the adaptive processing periods.
+        self._origin = self.previous_time
+        # Whether the last period had edges: only sleep after a quiet one.
+        self._busy = True
+        if self.history_store is not None:
+            self._load_history()
+            self._publish_status()
+        if self.radiation_buffer is not None:
+            self.radiation_buffer.clear()
+            self.noise_buffer.clear()
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+        # Init the GPIO context and register local callbacks.
+        on_radiation, on_noise = self._on_radiation, self._on_noise
+        if self._histograms is not None:
+            for histogram in self._histograms.values():
+                histogram.reset()
+            on_radiation = self._timed(on_radiation, self._histograms["radiationCallback"])
+            on_noise = self._timed(on_noise, self._histograms["noiseCallback"])
+        feed_edges = self.feed_edges
+        if self.adaptive and scheduler:
+            on_radiation = self._waking(on_radiation)
+            on_noise = self._waking(on_noise)
+            feed_edges = self._waking(feed_edges)
+        if self.backend.batched:
+            self.backend.start_batched(
+                self.radiation_pin, self.noise_pin, feed_edges, bouncetime=BOUNCE_DELAY
+            )
+        else:
+            self.backend.start(
+                self.radiation_pin,
+                self.noise_pin,
+                on_radiation,
+                on_noise,
+                bouncetime=BOUNCE_DELAY,
+            )
+        # Start processing the statistics periodically.
+        if scheduler and self.adaptive:
+            self.scheduler.start(self._origin / 1000.0)
+        elif scheduler:
+            self.scheduler.start()
         return self
 
     def close(self):
         """Properly close the resources associated with the driver
         (GPIOs and so on)."""
-        # Clean up only used channels.
-        GPIO.cleanup([self.radiation_pin, self.noise_pin])
+        self.backend.close()
+        self.scheduler.stop()
+        if self.history_store is not None:
+            self._save_history(monotonic_millis())
+            self.history_store.close()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        for listener in self._pulse_listeners:
+            listener.close()
+
+    def scheduler_stats(self):
+        """Return the statistics processing timing, as a dictionary with:
+            ticks -- the number of processing periods run;
+            missed -- the number of processing periods skipped;
+            late -- the number of processing periods run late;
+            lastLateness -- the lateness of the last period, in seconds;
+            maxLateness -- the maximum lateness observed, in seconds."""
+        return self.scheduler.stats()
+
+    def feed_edges(self, radiation_timestamps=(), noise_timestamps=()):
+        """Count a batch of radiation and noise edges, given as sequences of
+        timestamps (monotonic clock, in nanoseconds) in chronological order.
+        The edges are recorded and given to the pulse listeners with these
+        timestamps, and the callbacks are called once by edge.
+        Batches must be fed from a single thread (the batched backends one)."""
+        for timestamps, counter, buffer, kind, callback in (
+            (radiation_timestamps, self._radiation_counter, self.radiation_buffer,
+             "radiation", self.radiation_callback),
+            (noise_timestamps, self._noise_counter, self.noise_buffer,
+             "noise", self.noise_callback),
+        ):
+            if not timestamps:
+                continue
+            counter.add(len(timestamps))
+            if buffer is not None:
+                with self.mutex:
+                    buffer.extend(timestamps)
+            for listener in self._pulse_listeners:
+                for timestamp in timestamps:
+                    listener.push(kind, timestamp)
+            if callback:
+                for _ in timestamps:
+                    self._call(callback)
+
+    def diagnostics(self):
+        """Return the driver diagnostics, as a dictionary with:
+            vetoedTicks -- the number of processing periods with noise;
+            historyShifts -- the number of shifts of the history;
+            radiationCallback, noiseCallback -- the histograms of the
+            duration of the edge callbacks, in seconds;
+            tickLateness -- the histogram of the lateness of the
+            processing periods, in seconds;
+            lockHold -- the histogram of the time the mutex is held,
+            in seconds.
+        The histograms (see Histogram.to_dict()) are None unless the
+        diagnostics are enabled."""
+        diagnostics = dict(vetoedTicks=self.vetoed_ticks, historyShifts=self.history_shifts)
+        for name in ("radiationCallback", "noiseCallback", "tickLateness", "lockHold"):
+            diagnostics[name] = (
+                self._histograms[name].to_dict() if self._histograms is not None else None
+            )
+        return diagnostics
+
+    def radiation_events(self, last=None):
+        """Return the timestamps (monotonic clock, in nanoseconds) of the last
+        (by default all) recorded radiation events, as a list of zero-copy
+        memoryviews in chronological order. See EventBuffer.views()."""
+        return self._events(self.radiation_buffer, last)
+
+    def noise_events(self, last=None):
+        """Return the timestamps (monotonic clock, in nanoseconds) of the last
+        (by default all) recorded noise events, as a list of zero-copy
+        memoryviews in chronological order. See EventBuffer.views()."""
+        return self._events(self.noise_buffer, last)
+
+    def _events(self, buffer, last):
+        if buffer is None:
+            raise RuntimeError("Events are not recorded: set event_capacity")
         with self.mutex:
-            self.timer.cancel()
+            return buffer.views(last)
 
     def _on_radiation(self, _channel):
-        with self.mutex:
-            self.radiation_count += 1
+        self._radiation_counter.increment()
+        if self.radiation_buffer is None and not self._pulse_listeners:
+            if self.radiation_callback:
+                self._call(self.radiation_callback)
+            return
+        timestamp = time.monotonic_ns()
+        if self.radiation_buffer is not None:
+            with self.mutex:
+                self.radiation_buffer.append(timestamp)
+        for listener in self._pulse_listeners:
+            listener.push("radiation", timestamp)
         if self.radiation_callback:
-            self.radiation_callback()
+            self._call(self.radiation_callback)
 
     def _on_noise(self, _channel):
-        with self.mutex:
-            self.noise_count += 1
+        self._noise_counter.increment()
+        if self.noise_buffer is None and not self._pulse_listeners:
+            if self.noise_callback:
+                self._call(self.noise_callback)
+            return
+        timestamp = time.monotonic_ns()
+        if self.noise_buffer is not None:
+            with self.mutex:
+                self.noise_buffer.append(timestamp)
+        for listener in self._pulse_listeners:
+            listener.push("noise", timestamp)
         if self.noise_callback:
-            self.noise_callback()
+            self._call(self.noise_callback)
 
-    def _enable_timer(self):
-        self.timer = threading.Timer(PROCESS_PERIOD / 1000.0, self._process_statistics)
-        self.timer.start()
+    @staticmethod
+    def _timed(callback, histogram):
+        def timed_callback(channel):
+            start = time.perf_counter()
+            callback(channel)
+            histogram.record(time.perf_counter() - start)
 
-    def _process_statistics(self):
-        with self.mutex:
-            current_time = millis()
-            current_radiation_count = self.radiation_count
-            current_noise_count = self.noise_count
-            self.radiation_count = 0
-            self.noise_count = 0
-        if current_noise_count == 0:
-            # Store count log.
-            self.count_history[self.history_index] += current_radiation_count
-            # Add number of counts.
-            self.count += current_radiation_count
-            # Add ellapsed time to history duration.
-            self.duration += abs(current_time - self.previous_time)
-        # Shift an array for counting log for each HISTORY_UNIT seconds.
-        if current_time - self.previous_history_time >= HISTORY_UNIT * 1000:
-            self.previous_history_time += HISTORY_UNIT * 1000
-            self.history_index = (self.history_index + 1) % HISTORY_LENGTH
-            self.count -= self.count_history[self.history_index]
-            self.count_history[self.history_index] = 0
-        # Save time of current process period.
-        self.previous_time = millis()
-        # Enable the timer again.
-        if self.timer:
-            self._enable_timer()
+        return timed_callback
+
+    def _waking(self, callback):
+        wake = self.scheduler.wake
+
+        def waking_callback(*args):
+            callback(*args)
+            wake()
+
+        return waking_callback
+
+    def _load_history(self):
+        self.history_store.open(self.history_length, self.history_unit)
+        state = self.history_store.load(self.previous_time)
+        if state is None:
+            return
+        self.count_history = state["history"]
+        self.history_index = state["history_index"]
+        self.count = state["count"]
+        self.duration = state["duration"]
+        self.previous_history_time = state["previous_history_time"]
+
+    def _save_history(self, current_time):
+        self.history_store.save(
+            self.count_history,
+            self.history_index,
+            self.count,
+            self.duration,
+            current_time - self.previous_history_time,
+        )
+
+    def _call(self, callback, key=None):
+        if self.dispatcher is not None:
+            self.dispatcher.submit(callback, key)
+        else:
+            callback()
+
+    def _process_statistics(self, current_time=None):
+        """Process the edges counted since the last period, at current_time
+        (milliseconds, now by default)."""
+        now_ns = None
+        if current_time is None:
+            current_time, now_ns = monotonic_millis(), time.monotonic_ns()
+        # Lock-free: the edges keep being counted meanwhile.
+        radiation_total = self._radiation_counter.value()
+        noise_total = self._noise_counter.value()
+        current_radiation_count = radiation_total - self.radiation_total
+        current_noise_count = noise_total - self.noise_total
+        self.radiation_total = radiation_total
+        self.noise_total = noise_total
+        self._process_period(current_time, current_radiation_count, current_noise_count, now_ns)
+
+    def _process_period(self, current_time, radiation_count, noise_count, now_ns):
+        elapsed = current_time - self.previous_time
+        self.process(current_time, radiation_count, noise_count, now_ns)
+        if self.history_store is not None:
+            # Log the wall clock time the period ended at: the periods slept
+            # through in adaptive mode are only processed on the next wakeup.
+            wall_time = int(round(time.time() * 1000)) - (monotonic_millis() - current_time)
+            self.history_store.log_tick(radiation_count, noise_count, elapsed, wall_time)
+            if self.history_store.flush_due():
+                self._save_history(current_time)
+
+    def _process_tick(self, tick):
+        # Adaptive mode: the periods are processed at their deadlines.
+        totals = self.radiation_total + self.noise_total
+        self._process_statistics(self._origin + tick * PROCESS_PERIOD)
+        # Keep processing on time while edges come.
+        self._busy = self.radiation_total + self.noise_total != totals
+
+    def _skip_tick(self, tick):
+        # A period slept through, without any edge.
+        self._process_period(self._origin + tick * PROCESS_PERIOD, 0, 0, None)
+
+    def _idle_ticks(self):
+        # Only sleep once a whole period went by without any edge, and
+        # while the edges are rare enough for the wakeups they cost.
+        if (
+            self._busy
+            or self._radiation_counter.value() != self.radiation_total
+            or self._noise_counter.value() != self.noise_total
+            or self.count * PROCESS_PERIOD > ADAPTIVE_MAX_EDGES * self.duration
+        ):
+            return 1
+        # Sleep up to the next history shift, where the readings change.
+        until_shift = self.previous_history_time + self.history_unit * 1000 - self.previous_time
+        return max(1, -(-until_shift // PROCESS_PERIOD))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+Run the pipocketgeiger command with python -m PiPocketGeiger.
+
+Released under MIT License. See LICENSE file.
+"""
+from PiPocketGeiger.cli import main
+
+main()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Hand over pulse events from the GPIO edge thread to an asyncio event loop.
+
+Used by RadiationWatch.pulses(), see there for the usage.
+
+Released under MIT License. See LICENSE file.
+"""
+import asyncio
+import collections
+import threading
+
+__all__ = ["Pulse", "PulseStream", "status_stream", "DROP_OLDEST", "COALESCE"]
+
+# Overflow policies: when the stream is full, either drop the oldest pulse,
+DROP_OLDEST = "drop-oldest"
+# or count the new pulses in a single pulse delivered once the loop catches up.
+COALESCE = "coalesce"
+
+Pulse = collections.namedtuple("Pulse", ["kind", "timestamp", "count"])
+Pulse.__doc__ = """A radiation or noise pulse.
+    kind -- "radiation" or "noise";
+    timestamp -- the monotonic clock at the (last) edge, in nanoseconds;
+    count -- the number of edges in this pulse (more than one when coalesced)."""
+
+
+class PulseStream:
+    """Async iterator over the pulses pushed from any thread.
+
+    Pushed pulses are buffered, and the consumer takes them all at once:
+    the event loop is only woken up when the consumer waits for pulses, so
+    a burst of edges does not schedule one loop callback per edge.
+    At most maxsize pulses are buffered: beyond that the overflow policy
+    applies (DROP_OLDEST or COALESCE).
+    """
+
+    def __init__(self, maxsize=1024, overflow=DROP_OLDEST, noise=False, loop=None):
+        """Create a stream handing pulses to loop (by default the running one).
+        Noise pulses are only included if noise is true."""
+        if overflow not in (DROP_OLDEST, COALESCE):
+            raise ValueError("Unknown overflow policy: {0}".format(overflow))
+        if maxsize <= 0:
+            raise ValueError("The pulse stream size must be positive")
+        self.loop = asyncio.get_running_loop() if loop is None else loop
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.noise = noise
+        # Number of pulses dropped, and of edges coalesced.
+        self.dropped = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        # Coalesced edges per kind, as [count, last timestamp].
+        self._overflowing = {}
+        self._wakeup_scheduled = False
+        self._closed = False
+        # Whether the consumer waits for a wakeup.
+        self._waiting = False
+        # Loop side.
+        self._ready = collections.deque()
+        self._waiter = None
+
+    def push(self, kind, timestamp):
+        """Push a pulse of kind at timestamp. Thread-safe."""
+        if kind == "noise" and not self.noise:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            if len(self._pending) < self.maxsize:
+                self._pending.append(Pulse(kind, timestamp, 1))
+            elif self.overflow == DROP_OLDEST:
+                self._pending.popleft()
+                self._pending.append(Pulse(kind, timestamp, 1))
+                self.dropped += 1
+            else:
+                overflowing = self._overflowing.setdefault(kind, [0, 0])
+                overflowing[0] += 1
+                overflowing[1] = timestamp
+                self.coalesced += 1
+            if not self._waiting or self._wakeup_scheduled:
+                return
+            self._wakeup_scheduled = True
+        self._schedule_wakeup()
+
+    def close(self):
+        """End the iteration, once the buffered pulses have been consumed.
+        Thread-safe."""
+        with self._lock:
+            self._closed = True
+            if not self._waiting or self._wakeup_scheduled:
+                return
+            self._wakeup_scheduled = True
+        self._schedule_wakeup()
+
+    def _schedule_wakeup(self):
+        try:
+            self.loop.call_soon_threadsafe(self._wakeup)
+        except RuntimeError:
+            # The loop is closed: nobody is listening anymore.
+            pass
+
+    def _wakeup(self):
+        with self._lock:
+            self._wakeup_scheduled = False
+            self._waiting = False
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._ready:
+            # Take all the pulses pushed since the last batch.
+            with self._lock:
+                pending, self._pending = self._pending, collections.deque()
+                overflowing, self._overflowing = self._overflowing, {}
+                closed = self._closed
+                self._waiting = not pending and not overflowing and not closed
+            self._ready.extend(pending)
+            for kind, (count, timestamp) in overflowing.items():
+                self._ready.append(Pulse(kind, timestamp, count))
+            if self._ready:
+                break
+            if closed:
+                raise StopAsyncIteration
+            # Nothing yet: wait for the next push to wake us up.
+            self._waiter = self.loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        return self._ready.popleft()
+
+
+async def status_stream(radiation_watch, period):
+    """Yield radiation_watch.status() every period seconds, on absolute
+    deadlines of the loop clock."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while True:
+        deadline += period
+        await asyncio.sleep(max(0, deadline - loop.time()))
+        yield radiation_watch.status()
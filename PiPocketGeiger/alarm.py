@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Low-latency detection of radiation dose increases.
+
+Released under MIT License. See LICENSE file.
+"""
+import math
+
+__all__ = ["ChangePointDetector"]
+
+
+class ChangePointDetector:
+    """Detect an increase of the radiation count rate, with a CUSUM
+    (sequential Poisson likelihood-ratio test) over the processing periods.
+
+    The test compares the background rate, learned while there is no alarm,
+    to a rate ratio times higher. Each period adds its log-likelihood ratio
+        count * log(ratio) - (ratio - 1) * background_rate * elapsed
+    to the CUSUM statistic (floored at zero), and the alarm is raised when
+    the statistic exceeds log(ARL), ARL being the average number of periods
+    between false alarms given by false_alarms_per_day. This is the classic
+    (conservative) Lorden bound on the false alarm rate.
+
+    Each update is O(1). The detection time depends on the background rate
+    and on the increase: e.g. about a minute for a background of 10 CPM
+    tripling, with one false alarm per day.
+
+    Usage:
+    ```
+    def on_alarm(status):
+        print("Dose increase!", status)
+    detector = ChangePointDetector(ratio=2, false_alarms_per_day=0.1)
+    with RadiationWatch(24, 23, detector=detector) as radiationWatch:
+        radiationWatch.register_alarm_callback(on_alarm)
+    ```
+    """
+
+    def __init__(self, ratio=2.0, false_alarms_per_day=0.1, period=0.16,
+                 background_cpm=None, warmup=600, background_time=1200,
+                 min_background_cpm=0.5):
+        """Create a detector of count rate increases by ratio (or more),
+        raising false_alarms_per_day false alarms on average.
+        period is the expected duration between updates, in seconds.
+
+        The background rate is background_cpm if given, otherwise it is
+        learned during the first warmup seconds (without any alarm), then
+        tracked as an exponential moving average with a time constant of
+        background_time seconds (only while there is no alarm). It never
+        goes below min_background_cpm."""
+        if ratio <= 1:
+            raise ValueError("The detected ratio must be greater than 1")
+        if false_alarms_per_day <= 0 or period <= 0:
+            raise ValueError("The false alarm rate and period must be positive")
+        self.ratio = ratio
+        self.false_alarms_per_day = false_alarms_per_day
+        self.period = period
+        self.initial_background_cpm = background_cpm
+        self.warmup = warmup
+        self.background_time = background_time
+        self.min_background_rate = min_background_cpm / 60.0
+        self.log_ratio = math.log(ratio)
+        # Average number of periods between two false alarms.
+        average_run_length = 86400.0 / period / false_alarms_per_day
+        self.threshold = math.log(average_run_length)
+        self.reset()
+
+    def reset(self):
+        """Forget the learned background and the current alarm."""
+        self.statistic = 0.0
+        self.alarm = False
+        self.alarms = 0
+        self.learning_count = 0
+        self.learning_time = 0.0
+        if self.initial_background_cpm is None:
+            self.background_rate = None
+        else:
+            self.background_rate = max(self.min_background_rate,
+                                       self.initial_background_cpm / 60.0)
+
+    def update(self, count, elapsed):
+        """Add a period of count radiation counts over elapsed seconds.
+        Return True if this period raises the alarm."""
+        if elapsed <= 0:
+            return False
+        if self.background_rate is None:
+            # Warming up: learn the background.
+            self.learning_count += count
+            self.learning_time += elapsed
+            if self.learning_time >= self.warmup:
+                self.background_rate = max(self.min_background_rate,
+                                           self.learning_count / self.learning_time)
+            return False
+        expected = self.background_rate * elapsed
+        self.statistic = max(
+            0.0, self.statistic + count * self.log_ratio - (self.ratio - 1) * expected
+        )
+        if self.alarm:
+            # The alarm ends once the evidence for the increase vanished.
+            if self.statistic == 0.0:
+                self.alarm = False
+            return False
+        if self.statistic > self.threshold:
+            self.alarm = True
+            self.alarms += 1
+            return True
+        # Track the background, as long as there is no alarm.
+        self.background_rate = max(
+            self.min_background_rate,
+            self.background_rate + (count - expected) / self.background_time,
+        )
+        return False
+
+    def status(self):
+        """Return the detector state, as a dictionary with:
+            alarm -- whether the alarm is raised;
+            alarms -- the number of alarms raised;
+            statistic -- the CUSUM statistic;
+            threshold -- the CUSUM statistic raising the alarm;
+            backgroundCpm -- the background count rate, in counts by minute
+            (None while warming up)."""
+        return dict(
+            alarm=self.alarm,
+            alarms=self.alarms,
+            statistic=round(self.statistic, 3),
+            threshold=round(self.threshold, 3),
+            backgroundCpm=round(self.background_rate * 60, 2)
+            if self.background_rate is not None
+            else None,
+        )
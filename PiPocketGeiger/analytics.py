@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Statistical checks of the counts: exact Poisson intervals, dispersion,
+Allan deviation and inter-arrival goodness-of-fit, vectorized over many
+sensors at once.
+
+Requires NumPy (pip install PiPocketGeiger[analytics]). NumPy is only
+imported when a function of the module is called, like the GPIO libraries.
+
+Released under MIT License. See LICENSE file.
+"""
+import math
+import statistics
+
+from PiPocketGeiger.calibration import K_ALPHA
+from PiPocketGeiger.core import HISTORY_UNIT
+
+__all__ = [
+    "poisson_interval",
+    "dose_interval",
+    "chi2_survival",
+    "dispersion_index",
+    "allan_deviation",
+    "interarrival_fit",
+    "history_counts",
+    "analyze",
+]
+
+# Counts up to which the Poisson intervals are computed exactly. Above, the
+# Wilson-Hilferty approximation is used: its relative error is below 1e-5.
+EXACT_COUNTS = 1000
+# Convergence of the incomplete gamma function and its inverse.
+EPSILON = 1e-14
+MAX_ITERATIONS = 2000
+TINY = 1e-300
+
+
+def _numpy():
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    return numpy
+
+
+def _lgamma(values):
+    numpy = _numpy()
+    return numpy.frompyfunc(math.lgamma, 1, 1)(values).astype(float)
+
+
+def _gamma_p_q(a, x):
+    """Return the regularized lower and upper incomplete gamma functions
+    P(a, x) and Q(a, x), elementwise."""
+    numpy = _numpy()
+    a, x = numpy.broadcast_arrays(numpy.asarray(a, dtype=float), numpy.asarray(x, dtype=float))
+    p, q = numpy.zeros(a.shape), numpy.ones(a.shape)
+    positive = x > 0
+    log_prefix = numpy.full(a.shape, -numpy.inf)
+    log_prefix[positive] = (
+        a[positive] * numpy.log(x[positive]) - x[positive] - _lgamma(a[positive])
+    )
+    # Series of P below a + 1, continued fraction of Q above.
+    series = positive & (x < a + 1)
+    if series.any():
+        shape, value = a[series], x[series]
+        term = 1.0 / shape
+        total = term.copy()
+        denominator = shape.copy()
+        for _ in range(MAX_ITERATIONS):
+            denominator += 1
+            term *= value / denominator
+            total += term
+            if (numpy.abs(term) <= numpy.abs(total) * EPSILON).all():
+                break
+        p[series] = numpy.minimum(1.0, total * numpy.exp(log_prefix[series]))
+        q[series] = 1.0 - p[series]
+    fraction = positive & ~series
+    if fraction.any():
+        # Modified Lentz algorithm.
+        shape, value = a[fraction], x[fraction]
+        b = value + 1 - shape
+        c = numpy.full(shape.shape, 1 / TINY)
+        d = 1 / b
+        result = d.copy()
+        for index in range(1, MAX_ITERATIONS):
+            an = -index * (index - shape)
+            b += 2
+            d = an * d + b
+            d[numpy.abs(d) < TINY] = TINY
+            c = b + an / c
+            c[numpy.abs(c) < TINY] = TINY
+            d = 1 / d
+            delta = d * c
+            result *= delta
+            if (numpy.abs(delta - 1) <= EPSILON).all():
+                break
+        q[fraction] = result * numpy.exp(log_prefix[fraction])
+        p[fraction] = 1.0 - q[fraction]
+    return p, q
+
+
+def _gamma_quantile(a, probability, exact):
+    """Return x such that P(a, x) = probability, elementwise for a > 0:
+    by Newton iterations where exact, by Wilson-Hilferty elsewhere."""
+    numpy = _numpy()
+    a = numpy.asarray(a, dtype=float)
+    z = statistics.NormalDist().inv_cdf(probability)
+    x = a * (1 - 1 / (9 * a) + z / (3 * numpy.sqrt(a))) ** 3
+    # Small shapes: invert P(a, x) ~ x^a / gamma(a + 1) instead.
+    small = (x <= 0) | (a < 1)
+    if small.any():
+        x[small] = numpy.exp(
+            (math.log(probability) + _lgamma(a[small] + 1)) / a[small]
+        )
+    exact = exact & (a > 0)
+    if not exact.any():
+        return x
+    shape, value = a[exact], x[exact]
+    log_gamma = _lgamma(shape)
+    for _ in range(100):
+        p, _ = _gamma_p_q(shape, value)
+        density = numpy.exp((shape - 1) * numpy.log(value) - value - log_gamma)
+        step = (p - probability) / numpy.maximum(density, TINY)
+        # Stay positive: at most divide by ten at each step.
+        updated = numpy.maximum(value - step, value / 10)
+        done = numpy.abs(updated - value) <= value * 1e-12
+        value = updated
+        if done.all():
+            break
+    x[exact] = value
+    return x
+
+
+def poisson_interval(counts, confidence=0.95):
+    """Return the exact (Garwood) confidence interval of the mean of a
+    Poisson variable, given counts: arrays of the lower and upper bounds,
+    of the shape of counts.
+
+    Unlike count +/- sqrt(count), the interval is valid for small counts:
+    for 0 counts it is [0, 3.69] at 95%."""
+    numpy = _numpy()
+    counts = numpy.asarray(counts, dtype=float)
+    alpha = 1 - confidence
+    exact = counts <= EXACT_COUNTS
+    lower = numpy.zeros(counts.shape)
+    counted = counts > 0
+    if counted.any():
+        lower[counted] = _gamma_quantile(counts[counted], alpha / 2, exact[counted])
+    upper = _gamma_quantile(counts + 1, 1 - alpha / 2, exact)
+    return lower, upper
+
+
+def dose_interval(counts, durations, k_alpha=K_ALPHA, confidence=0.95):
+    """Return the confidence interval of the dose (uSv/h), given the counts
+    measured during durations (seconds): arrays of the lower and upper
+    bounds. Without dead-time correction."""
+    numpy = _numpy()
+    minutes = numpy.asarray(durations, dtype=float) / 60.0
+    lower, upper = poisson_interval(counts, confidence)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return (
+            numpy.where(minutes > 0, lower / minutes / k_alpha, 0.0),
+            numpy.where(minutes > 0, upper / minutes / k_alpha, numpy.inf),
+        )
+
+
+def chi2_survival(statistics_, dof):
+    """Return the probability for chi-square variables with dof degrees
+    of freedom to exceed the given statistics, elementwise."""
+    numpy = _numpy()
+    _, q = _gamma_p_q(numpy.asarray(dof, dtype=float) / 2,
+                      numpy.asarray(statistics_, dtype=float) / 2)
+    return q
+
+
+def dispersion_index(histories):
+    """Return the index of dispersion (variance / mean) of the counts of
+    each history (along the last axis), and the two-sided p-value of the
+    Poisson hypothesis (index of 1).
+
+    An index above 1 means counts more variable than Poisson (noise
+    leaking through, changing dose); below 1, more regular (dead time)."""
+    numpy = _numpy()
+    histories = numpy.asarray(histories, dtype=float)
+    buckets = histories.shape[-1]
+    mean = histories.mean(axis=-1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        index = numpy.where(mean > 0, histories.var(axis=-1, ddof=1) / mean, 1.0)
+    p, q = _gamma_p_q(numpy.full(mean.shape, (buckets - 1) / 2.0), (buckets - 1) * index / 2)
+    return index, numpy.minimum(1.0, 2 * numpy.minimum(p, q))
+
+
+def allan_deviation(histories, unit=HISTORY_UNIT):
+    """Return the Allan deviation of the count rate (counts by second) of
+    each history of buckets of unit seconds (along the last axis), for
+    averaging times of 1, 2, 4... buckets, as a tuple of:
+        taus -- the averaging times, in seconds;
+        deviations -- the Allan deviations, one row of taus by history;
+        poisson -- the deviations expected from Poisson counts alone.
+    Deviations above the Poisson ones at long averaging times show a drift."""
+    numpy = _numpy()
+    histories = numpy.asarray(histories, dtype=float)
+    rates = histories / unit
+    buckets = histories.shape[-1]
+    mean_rate = rates.mean(axis=-1)
+    taus, deviations, poisson = [], [], []
+    size = 1
+    while 2 * size <= buckets:
+        used = buckets // size * size
+        blocks = rates[..., :used].reshape(rates.shape[:-1] + (used // size, size)).mean(-1)
+        taus.append(size * unit)
+        deviations.append(numpy.sqrt(0.5 * (numpy.diff(blocks, axis=-1) ** 2).mean(-1)))
+        poisson.append(numpy.sqrt(mean_rate / (size * unit)))
+        size *= 2
+    if not taus:
+        empty = numpy.zeros(histories.shape[:-1] + (0,))
+        return numpy.zeros(0), empty, empty
+    return (
+        numpy.array(taus, dtype=float),
+        numpy.stack(deviations, axis=-1),
+        numpy.stack(poisson, axis=-1),
+    )
+
+
+def interarrival_fit(timestamps, bins=20):
+    """Test whether the intervals between pulses follow the exponential
+    distribution of a Poisson process, for each sequence of sorted
+    timestamps (nanoseconds) of the list timestamps.
+
+    The intervals are put into bins equally probable under the exponential
+    distribution of the measured rate, and compared with a chi-square test.
+    Return a dictionary of arrays, one value (or row) by sequence:
+        rate -- the pulse rate, by second;
+        intervals -- the number of intervals;
+        chi2, pValue -- the test statistic and its p-value;
+        observed -- the number of intervals in each bin, the first bin
+        being the shortest intervals (depleted by dead time)."""
+    numpy = _numpy()
+    sequences = [numpy.asarray(sequence, dtype=numpy.int64) for sequence in timestamps]
+    lengths = numpy.array([max(0, len(sequence) - 1) for sequence in sequences])
+    intervals = numpy.concatenate(
+        [numpy.diff(sequence) for sequence in sequences] or [numpy.zeros(0, numpy.int64)]
+    ).astype(float) / 1e9
+    owners = numpy.repeat(numpy.arange(len(sequences)), lengths)
+    totals = numpy.bincount(owners, weights=intervals, minlength=len(sequences))
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        rates = numpy.where(totals > 0, lengths / totals, 0.0)
+    # The bin of each interval, from its exponential cumulative probability.
+    probability = 1 - numpy.exp(-rates[owners] * intervals)
+    bin_index = numpy.minimum((probability * bins).astype(numpy.int64), bins - 1)
+    observed = numpy.bincount(
+        owners * bins + bin_index, minlength=len(sequences) * bins
+    ).reshape(len(sequences), bins)
+    expected = lengths / float(bins)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        chi2 = numpy.where(
+            expected > 0,
+            ((observed - expected[:, None]) ** 2).sum(axis=1) / expected,
+            0.0,
+        )
+    return dict(
+        rate=rates,
+        intervals=lengths,
+        chi2=chi2,
+        pValue=numpy.where(expected > 0, chi2_survival(chi2, bins - 2), 1.0),
+        observed=observed,
+    )
+
+
+def history_counts(radiation_watch):
+    """Return the counts of the complete buckets of the history of a
+    RadiationWatch (or StatisticsCore), oldest first, as a NumPy array.
+    Only the buckets completed since the setup are known complete."""
+    numpy = _numpy()
+    history = numpy.asarray(radiation_watch.count_history, dtype=numpy.int64)
+    # The bucket after the current one is the oldest.
+    ordered = numpy.roll(history, -(radiation_watch.history_index + 1))[:-1]
+    complete = min(radiation_watch.history_shifts, radiation_watch.history_length - 1)
+    return ordered[len(ordered) - complete:]
+
+
+def analyze(radiation_watch, confidence=0.95, bins=20):
+    """Return the statistical checks of a RadiationWatch (or StatisticsCore),
+    as a dictionary:
+        uSvhLower, uSvhUpper -- the exact confidence interval of the dose
+        (status()["uSvh"]), with the dead-time correction of the calibration;
+        dispersionIndex, dispersionPValue -- see dispersion_index(), over
+        the complete buckets of the history (None with less than 2);
+        allanTaus, allanDeviation, allanPoisson -- see allan_deviation();
+        interarrivalPValue -- see interarrival_fit(), if the radiation
+        events are recorded (None otherwise)."""
+    numpy = _numpy()
+    calibration = radiation_watch.calibration
+    # The counts of the published readings, averaged over max_cpm_time at
+    # most as in Status.from_counts(): the interval always contains uSvh.
+    status = radiation_watch.status()
+    minutes = min(status.duration_ms, radiation_watch.max_cpm_time) / 1000 / 60.0
+    result = dict(uSvhLower=None, uSvhUpper=None)
+    if minutes > 0:
+        lower, upper = poisson_interval([status.count], confidence)
+        result.update(
+            uSvhLower=round(calibration.correct(float(lower[0]) / minutes)[0]
+                            / calibration.k_alpha, 3),
+            uSvhUpper=round(calibration.correct(float(upper[0]) / minutes)[0]
+                            / calibration.k_alpha, 3),
+        )
+    counts = history_counts(radiation_watch)
+    if len(counts) >= 2:
+        index, p_value = dispersion_index(counts)
+        taus, deviations, poisson = allan_deviation(counts, radiation_watch.history_unit)
+        result.update(
+            dispersionIndex=round(float(index), 4),
+            dispersionPValue=float(p_value),
+            allanTaus=taus.tolist(),
+            allanDeviation=deviations.tolist(),
+            allanPoisson=poisson.tolist(),
+        )
+    else:
+        result.update(dispersionIndex=None, dispersionPValue=None, allanTaus=[],
+                      allanDeviation=[], allanPoisson=[])
+    interarrival = None
+    if getattr(radiation_watch, "radiation_buffer", None) is not None:
+        timestamps = numpy.concatenate(
+            [numpy.asarray(view) for view in radiation_watch.radiation_events()]
+            or [numpy.zeros(0, numpy.int64)]
+        )
+        interarrival = float(interarrival_fit([timestamps], bins)["pValue"][0])
+    result["interarrivalPValue"] = interarrival
+    return result
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Geiger click sound, mixed in-process and played on a single output stream.
+
+Released under MIT License. See LICENSE file.
+"""
+import array
+import collections
+import subprocess
+import sys
+import time
+import wave
+
+from PiPocketGeiger.scheduler import PeriodicScheduler
+
+__all__ = ["ClickPlayer", "AplaySink", "WaveSink", "NullSink", "load_click"]
+
+
+def load_click(path):
+    """Decode a 16 bits mono WAV file, returning its samples (as an
+    array of signed shorts) and its frame rate."""
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+            raise ValueError("The click must be a 16 bits mono WAV file")
+        samples = array.array("h", wav.readframes(wav.getnframes()))
+        framerate = wav.getframerate()
+    # WAV samples are little-endian.
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples, framerate
+
+
+class AplaySink:
+    """Play the audio on the sound card, with a single long-running aplay
+    process reading the samples on its standard input."""
+
+    def __init__(self, device=None, buffer_time=0.1):
+        """Play on the ALSA device (the default one if None), buffering
+        buffer_time seconds of audio at most."""
+        self.device = device
+        self.buffer_time = buffer_time
+        self.process = None
+        self.errors = 0
+
+    def open(self, framerate):
+        command = [
+            "aplay", "-q", "-t", "raw", "-f", "S16_LE", "-c", "1", "-r", str(framerate),
+            "--buffer-time={0}".format(int(self.buffer_time * 1e6)),
+        ]
+        if self.device:
+            command += ["-D", self.device]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, data):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except OSError:
+            # aplay died: keep mixing, silently.
+            self.errors += 1
+            self.process = None
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+
+class WaveSink:
+    """Write the audio to a WAV file, instead of playing it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.wav = None
+
+    def open(self, framerate):
+        self.wav = wave.open(self.path, "wb")
+        self.wav.setnchannels(1)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(framerate)
+
+    def write(self, data):
+        self.wav.writeframesraw(data)
+
+    def close(self):
+        if self.wav is not None:
+            self.wav.close()
+            self.wav = None
+
+
+class NullSink:
+    """Discard the audio, only counting the frames and the non-silent blocks."""
+
+    def __init__(self):
+        self.frames = 0
+        self.audible_blocks = 0
+
+    def open(self, framerate):
+        self.frames = 0
+        self.audible_blocks = 0
+
+    def write(self, data):
+        self.frames += len(data) // 2
+        if any(data):
+            self.audible_blocks += 1
+
+    def close(self):
+        pass
+
+
+class ClickPlayer:
+    """Play a click for each radiation pulse.
+
+    The click is decoded once. Every block of audio (block_time seconds)
+    the pulses received are mixed in a ring buffer, at their offset in the
+    block (so overlapping clicks add up), and the block is written to a
+    single open output stream: the clicks lag block_time behind the pulses.
+
+    Beyond max_rate clicks per second, the clicks are rate limited and
+    played an octave higher, so saturation can be heard.
+
+    The player gets the pulses as a pulse listener of RadiationWatch.
+
+    Usage:
+    ```
+    with RadiationWatch(24, 23) as radiationWatch:
+        player = ClickPlayer("click.wav")
+        player.start()
+        radiationWatch.add_pulse_listener(player)
+    ```
+    """
+
+    def __init__(self, click_path, sink=None, block_time=0.02, max_rate=50, volume=1.0):
+        """Create a player of the click_path WAV file on the sink (AplaySink
+        by default, or WaveSink or NullSink), by blocks of block_time seconds,
+        playing at most max_rate clicks per second."""
+        if block_time <= 0 or max_rate <= 0:
+            raise ValueError("The block time and the maximum rate must be positive")
+        samples, self.framerate = load_click(click_path)
+        self.click = array.array("h", (int(sample * volume) for sample in samples))
+        # An octave higher, for saturation.
+        self.saturated_click = self.click[::2]
+        self.sink = AplaySink() if sink is None else sink
+        self.block = max(1, int(block_time * self.framerate))
+        self.max_rate = max_rate
+        # Large enough for a click starting at the end of a block.
+        self._ring = array.array("i", bytes(4 * (self.block + len(self.click))))
+        self._position = 0
+        # Number of samples from the position with some clicks mixed in.
+        self._pending_samples = 0
+        self._silence = bytes(2 * self.block)
+        # Pulses timestamps pushed by the edge thread.
+        self._pulses = collections.deque(maxlen=4096)
+        self.scheduler = PeriodicScheduler(
+            self.block / self.framerate, self.process, name="ClickPlayer"
+        )
+        self.clicks = 0
+        self.dropped = 0
+        self.saturated_blocks = 0
+        self._block_start = time.monotonic_ns()
+        self._budget = 0.0
+
+    def start(self):
+        """Open the sink and start mixing."""
+        self.sink.open(self.framerate)
+        self._block_start = time.monotonic_ns()
+        self.scheduler.start()
+
+    def close(self):
+        """Stop mixing and close the sink."""
+        self.scheduler.stop()
+        self.sink.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def push(self, kind, timestamp):
+        # Called from the GPIO edge thread.
+        if kind == "radiation":
+            self._pulses.append(timestamp)
+
+    def stats(self):
+        """Return the player counters, as a dictionary with:
+            clicks -- the number of clicks played;
+            dropped -- the number of clicks dropped by the rate limit;
+            saturatedBlocks -- the number of blocks played saturated."""
+        return dict(
+            clicks=self.clicks, dropped=self.dropped, saturatedBlocks=self.saturated_blocks
+        )
+
+    def process(self):
+        """Mix the pulses received since the previous block, and write the
+        next block to the sink. Called every block by the scheduler."""
+        now = time.monotonic_ns()
+        pulses = self._pulses
+        timestamps = [pulses.popleft() for _ in range(len(pulses))]
+        start, self._block_start = self._block_start, now
+        # Token bucket allowing max_rate clicks per second, in bursts of
+        # a fifth of a second.
+        allowed_per_block = self.max_rate * self.block / self.framerate
+        self._budget = min(
+            self._budget + allowed_per_block, max(allowed_per_block, self.max_rate / 5.0, 1.0)
+        )
+        click = self.click
+        if len(timestamps) > self._budget:
+            allowed = int(self._budget)
+            self.dropped += len(timestamps) - allowed
+            self.saturated_blocks += 1
+            # Keep evenly spaced pulses.
+            timestamps = [
+                timestamps[index * len(timestamps) // allowed] for index in range(allowed)
+            ]
+            click = self.saturated_click
+        self._budget -= len(timestamps)
+        self.clicks += len(timestamps)
+        elapsed = max(now - start, 1)
+        for timestamp in timestamps:
+            offset = (timestamp - start) * self.block // elapsed
+            self._mix(click, min(max(offset, 0), self.block - 1))
+        self.sink.write(self._next_block())
+
+    def _mix(self, click, offset):
+        ring, size = self._ring, len(self._ring)
+        index = self._position + offset
+        for sample in click:
+            ring[index % size] += sample
+            index += 1
+        self._pending_samples = max(self._pending_samples, offset + len(click))
+
+    def _next_block(self):
+        block = self.block
+        if self._pending_samples <= 0:
+            self._position = (self._position + block) % len(self._ring)
+            return self._silence
+        ring, size, position = self._ring, len(self._ring), self._position
+        samples = array.array("h", bytes(2 * block))
+        for index in range(min(block, self._pending_samples)):
+            value = ring[(position + index) % size]
+            ring[(position + index) % size] = 0
+            samples[index] = -32768 if value < -32768 else 32767 if value > 32767 else value
+        self._pending_samples -= block
+        self._position = (position + block) % size
+        if sys.byteorder == "big":
+            samples.byteswap()
+        return samples.tobytes()
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+GPIO backends delivering the Pocket Geiger radiation and noise edges
+to RadiationWatch.
+
+The hardware libraries are only imported when a backend using them is
+created, so the package can be imported (and the statistics exercised
+with SimulatedBackend) on any machine.
+
+Released under MIT License. See LICENSE file.
+"""
+import math
+import random
+import threading
+import time
+
+__all__ = ["GPIOBackend", "RPiGPIOBackend", "GPIOZeroBackend", "SimulatedBackend"]
+
+
+class GPIOBackend:
+    """Base class of the edge sources used by RadiationWatch.
+
+    A backend calls on_radiation(pin) for each falling edge of the radiation
+    pin and on_noise(pin) for each rising edge of the noise pin, between
+    start() and close().
+
+    A batched backend delivers the edges in batches with their timestamps
+    instead, to on_edges(radiation_timestamps, noise_timestamps), from
+    start_batched()."""
+
+    # Whether the backend implements start_batched().
+    batched = False
+
+    def start(self, radiation_pin, noise_pin, on_radiation, on_noise, bouncetime=None):
+        """Configure the pins and start delivering edges to the callbacks.
+        bouncetime is the delay (in ms) during which further edges
+        are ignored after an edge, if any."""
+        raise NotImplementedError
+
+    def start_batched(self, radiation_pin, noise_pin, on_edges, bouncetime=None):
+        """Configure the pins and start delivering batches of edges, as
+        lists of timestamps (monotonic clock, in nanoseconds), to on_edges.
+        By default, each edge from start() is a batch of its own,
+        timestamped when the callback runs."""
+        self.start(
+            radiation_pin,
+            noise_pin,
+            lambda _pin: on_edges([time.monotonic_ns()], []),
+            lambda _pin: on_edges([], [time.monotonic_ns()]),
+            bouncetime,
+        )
+
+    def close(self):
+        """Stop delivering edges and release the pins."""
+        raise NotImplementedError
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """Backend using the RPi.GPIO API, as provided by the rpi-lgpio
+    package (or the legacy RPi.GPIO one)."""
+
+    def __init__(self, numbering=None):
+        """You can specify the pin numbering mode, as a RPi.GPIO constant
+        (BCM numbering by default)."""
+        import RPi.GPIO as GPIO  # pylint: disable=import-outside-toplevel
+
+        self.GPIO = GPIO
+        self.numbering = GPIO.BCM if numbering is None else numbering
+        self.pins = []
+
+    def start(self, radiation_pin, noise_pin, on_radiation, on_noise, bouncetime=None):
+        GPIO = self.GPIO
+        GPIO.setmode(self.numbering)
+        self.pins = [radiation_pin, noise_pin]
+        # Raw data of Radiation Pulse: Not-detected -> High, Detected -> Low.
+        GPIO.setup(radiation_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        # Raw data of Noise Pulse: Not-detected -> Low, Detected -> High.
+        GPIO.setup(noise_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        # As the signal from the radiation pin is high by default
+        # and low when a ray hit the sensor, we want to listen on the edges falls.
+        GPIO.add_event_detect(
+            radiation_pin,
+            GPIO.FALLING,
+            callback=on_radiation,
+            **{"bouncetime": bouncetime} if bouncetime else {},
+        )
+        # As the signal from the noise pin is low by default and high when noise occurs,
+        # we want to listen on the edges rises.
+        GPIO.add_event_detect(
+            noise_pin,
+            GPIO.RISING,
+            callback=on_noise,
+            **{"bouncetime": bouncetime} if bouncetime else {},
+        )
+
+    def close(self):
+        # Clean up only used channels.
+        if self.pins:
+            self.GPIO.cleanup(self.pins)
+            self.pins = []
+
+
+class GPIOZeroBackend(GPIOBackend):
+    """Backend using gpiozero, which picks whichever pin library is
+    available (lgpio, RPi.GPIO, pigpio, ...). Pins use BCM numbering,
+    or the gpiozero pin names ("GPIO24", "BOARD18", ...)."""
+
+    def __init__(self, pin_factory=None):
+        """You can specify the gpiozero pin factory to use
+        (gpiozero default one otherwise)."""
+        import gpiozero  # pylint: disable=import-outside-toplevel
+
+        self.gpiozero = gpiozero
+        self.pin_factory = pin_factory
+        self.devices = []
+
+    def start(self, radiation_pin, noise_pin, on_radiation, on_noise, bouncetime=None):
+        bounce_time = bouncetime / 1000.0 if bouncetime else None
+        # The radiation pin is active low and the noise pin active high:
+        # in both cases we want to listen on the device activation.
+        radiation = self.gpiozero.DigitalInputDevice(
+            radiation_pin, pull_up=True, bounce_time=bounce_time, pin_factory=self.pin_factory
+        )
+        noise = self.gpiozero.DigitalInputDevice(
+            noise_pin, pull_up=False, bounce_time=bounce_time, pin_factory=self.pin_factory
+        )
+        radiation.when_activated = lambda: on_radiation(radiation_pin)
+        noise.when_activated = lambda: on_noise(noise_pin)
+        self.devices = [radiation, noise]
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+        self.devices = []
+
+
+class SimulatedBackend(GPIOBackend):
+    """Backend generating radiation and noise edges as Poisson processes,
+    without any hardware.
+
+    The edges timeline only depends on the seed and the rates: two runs with
+    the same seed produce the same sequence of edges. Edges are delivered in
+    batches from a single thread, so rates of tens of thousands of counts per
+    second can be simulated.
+
+    If max_lag is given (in seconds), edges whose delivery is late by more
+    than max_lag are dropped instead of being delivered, as the GPIO
+    interrupts would be lost when the edge thread can not keep up.
+
+    Usage:
+    ```
+    backend = SimulatedBackend(radiation_cpm=120, noise_cpm=1, seed=42)
+    with RadiationWatch(24, 23, backend=backend) as radiationWatch:
+        time.sleep(60)
+        print(radiationWatch.status(), backend.stats())
+    ```
+    """
+
+    def __init__(self, radiation_cpm=10.0, noise_cpm=0.0, seed=None, max_lag=None,
+                 resolution=0.001):
+        """Create a simulated backend generating radiation_cpm radiation edges
+        and noise_cpm noise edges per minute on average.
+        resolution is the minimal delay between two delivery batches (seconds)."""
+        if radiation_cpm < 0 or noise_cpm < 0:
+            raise ValueError("The simulated rates must not be negative")
+        self.radiation_cpm = radiation_cpm
+        self.noise_cpm = noise_cpm
+        self.seed = seed
+        self.max_lag = max_lag
+        self.resolution = resolution
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.radiation_edges = 0
+        self.noise_edges = 0
+        self.dropped_edges = 0
+
+    def start(self, radiation_pin, noise_pin, on_radiation, on_noise, bouncetime=None):
+        if self._thread is not None and self._thread.is_alive():
+            raise RuntimeError("The simulated backend is already running")
+        self.radiation_edges = 0
+        self.noise_edges = 0
+        self.dropped_edges = 0
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(radiation_pin, noise_pin, on_radiation, on_noise, bouncetime),
+            name="SimulatedBackend",
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def stats(self):
+        """Return the simulated edges counters, as a dictionary with:
+            radiationEdges -- the number of radiation edges delivered;
+            noiseEdges -- the number of noise edges delivered;
+            droppedEdges -- the number of edges dropped for being late."""
+        return dict(
+            radiationEdges=self.radiation_edges,
+            noiseEdges=self.noise_edges,
+            droppedEdges=self.dropped_edges,
+        )
+
+    @staticmethod
+    def _intervals(cpm, seed):
+        """Yield the seeded inter-arrival times (seconds) of a Poisson process."""
+        if cpm <= 0:
+            while True:
+                yield math.inf
+        generator = random.Random(seed)
+        rate = cpm / 60.0
+        while True:
+            yield generator.expovariate(rate)
+
+    def _run(self, radiation_pin, noise_pin, on_radiation, on_noise, bouncetime):
+        noise_seed = None if self.seed is None else "{0}-noise".format(self.seed)
+        radiation_intervals = self._intervals(self.radiation_cpm, self.seed)
+        noise_intervals = self._intervals(self.noise_cpm, noise_seed)
+        dead_time = bouncetime / 1000.0 if bouncetime else 0
+        origin = time.monotonic()
+        next_radiation = origin + next(radiation_intervals)
+        next_noise = origin + next(noise_intervals)
+        last_radiation = last_noise = -math.inf
+        while True:
+            next_edge = min(next_radiation, next_noise)
+            # Without any edge to come, just wait to be closed.
+            timeout = (
+                max(self.resolution, next_edge - time.monotonic())
+                if next_edge != math.inf
+                else None
+            )
+            if self._stop_event.wait(timeout):
+                return
+            now = time.monotonic()
+            # Deliver all the edges due, in time order.
+            while min(next_radiation, next_noise) <= now:
+                if next_radiation <= next_noise:
+                    edge_time, is_radiation = next_radiation, True
+                    next_radiation += next(radiation_intervals)
+                else:
+                    edge_time, is_radiation = next_noise, False
+                    next_noise += next(noise_intervals)
+                # Ignore the edges happening during the bounce delay.
+                if is_radiation:
+                    bouncing = edge_time - last_radiation < dead_time
+                    last_radiation = edge_time if not bouncing else last_radiation
+                else:
+                    bouncing = edge_time - last_noise < dead_time
+                    last_noise = edge_time if not bouncing else last_noise
+                if bouncing:
+                    continue
+                if self.max_lag is not None and time.monotonic() - edge_time > self.max_lag:
+                    self.dropped_edges += 1
+                elif is_radiation:
+                    self.radiation_edges += 1
+                    on_radiation(radiation_pin)
+                else:
+                    self.noise_edges += 1
+                    on_noise(noise_pin)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Calibration of the dose computation: conversion factor and dead-time
+correction, per device.
+
+Released under MIT License. See LICENSE file.
+"""
+import json
+import math
+import time
+
+__all__ = [
+    "Calibration",
+    "load_profiles",
+    "measure_software_dead_time",
+    "NON_PARALYZABLE",
+    "PARALYZABLE",
+    "K_ALPHA",
+]
+
+# Magic calibration number from the Arduino lib.
+K_ALPHA = 53.032
+
+# Dead-time models. Non-paralyzable: the counter is blind for dead_time after
+# each counted pulse. Paralyzable: every pulse, even uncounted, extends it.
+NON_PARALYZABLE = "non-paralyzable"
+PARALYZABLE = "paralyzable"
+# Fraction of the time the counter may be dead before we consider it saturated.
+MAX_DEAD_FRACTION = 0.99
+
+
+class Calibration:
+    """Convert the measured count rate to a dose.
+
+    The dose is the true count rate divided by k_alpha (in CPM per uSv/h).
+    At high rates the detector, and the software handling the edges, miss
+    the pulses coming while they are busy with the previous one: the true
+    count rate is recovered from the measured one with a dead-time model.
+    The dead time is the sum of the detector one (dead_time) and of the
+    software one (software_dead_time, see measure_software_dead_time()).
+
+    Usage:
+    ```
+    calibration = Calibration(k_alpha=53.032, dead_time=50e-6, model=PARALYZABLE)
+    with RadiationWatch(24, 23, calibration=calibration) as radiationWatch:
+        print(radiationWatch.status())
+    ```
+    """
+
+    def __init__(self, k_alpha=K_ALPHA, dead_time=0.0, software_dead_time=0.0,
+                 model=NON_PARALYZABLE, name=None):
+        """Create a calibration with k_alpha CPM per uSv/h, dead times
+        in seconds, and the dead-time model (NON_PARALYZABLE or PARALYZABLE)."""
+        if model not in (NON_PARALYZABLE, PARALYZABLE):
+            raise ValueError("Unknown dead-time model: {0}".format(model))
+        if k_alpha <= 0 or dead_time < 0 or software_dead_time < 0:
+            raise ValueError("Invalid calibration values")
+        self.k_alpha = k_alpha
+        self.dead_time = dead_time
+        self.software_dead_time = software_dead_time
+        self.model = model
+        self.name = name
+
+    @property
+    def total_dead_time(self):
+        return self.dead_time + self.software_dead_time
+
+    def correct(self, cpm, cpm_error=0.0):
+        """Return the true count rate (and its incertitude) corresponding
+        to the measured cpm (and its incertitude). Saturated rates are
+        clamped to the rate of a counter dead MAX_DEAD_FRACTION of the time."""
+        tau = self.total_dead_time / 60.0
+        if tau <= 0 or cpm <= 0:
+            return cpm, cpm_error
+        measured = cpm * tau
+        if self.model == NON_PARALYZABLE:
+            # m = n / (1 + n tau)  =>  n = m / (1 - m tau)
+            dead = min(measured, MAX_DEAD_FRACTION)
+            true = dead / (1 - dead)
+            derivative = 1 / (1 - dead) ** 2
+        else:
+            # m = n exp(-n tau): solve on the lower branch (n tau < 1).
+            true = _solve_paralyzable(min(measured, MAX_DEAD_FRACTION / math.e))
+            derivative = 1 / (math.exp(-true) * max(1 - true, 1 - MAX_DEAD_FRACTION))
+        return true / tau, cpm_error * derivative
+
+    def to_dict(self):
+        """Return the calibration as a profile dictionary (see load_profiles())."""
+        return dict(
+            k_alpha=self.k_alpha,
+            dead_time=self.dead_time,
+            software_dead_time=self.software_dead_time,
+            model=self.model,
+        )
+
+    def __repr__(self):
+        return "Calibration({0})".format(
+            ", ".join("{0}={1!r}".format(k, v) for k, v in self.to_dict().items())
+        )
+
+
+def _solve_paralyzable(measured):
+    """Solve x exp(-x) = measured for x in [0, 1], with Newton's method
+    (monotonous convergence from below, as the function is concave)."""
+    x = measured
+    for _ in range(100):
+        step = (measured - x * math.exp(-x)) / ((1 - x) * math.exp(-x))
+        x += step
+        if abs(step) < 1e-12:
+            break
+    return min(x, 1.0)
+
+
+def load_profiles(path):
+    """Load calibration profiles from a JSON file mapping the device names
+    to their calibration, for instance:
+        {"roof": {"k_alpha": 53.032, "dead_time": 5e-05, "model": "paralyzable"}}
+    Return a dictionary of name -> Calibration."""
+    with open(path, encoding="utf-8") as profiles_file:
+        profiles = json.load(profiles_file)
+    return {name: Calibration(name=name, **profile) for name, profile in profiles.items()}
+
+
+def measure_software_dead_time(edges=100000, **watch_options):
+    """Measure the time RadiationWatch takes to handle an edge, in seconds,
+    with the given RadiationWatch options (dispatcher, event_capacity...).
+
+    This is a lower bound of the software dead time: it does not include
+    the time the GPIO library takes to deliver the edge."""
+    # pylint: disable=import-outside-toplevel,protected-access
+    from PiPocketGeiger import RadiationWatch, SimulatedBackend
+
+    with RadiationWatch(0, 0, backend=SimulatedBackend(radiation_cpm=0),
+                        **watch_options) as radiation_watch:
+        on_radiation = radiation_watch._on_radiation
+        start = time.perf_counter()
+        for _ in range(edges):
+            on_radiation(0)
+        return (time.perf_counter() - start) / edges
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+GPIO backend reading the edges in batches from the Linux GPIO character
+device (/dev/gpiochipN), with the kernel timestamps.
+
+Released under MIT License. See LICENSE file.
+"""
+import os
+import select
+import struct
+import threading
+
+from PiPocketGeiger.backends import GPIOBackend
+
+__all__ = ["CharDevBackend", "LineEventReader", "LINE_EVENT", "RISING_EDGE", "FALLING_EDGE"]
+
+# struct gpio_v2_line_event: timestamp (ns), event id, line offset,
+# sequence number in the request and in the line, padding.
+LINE_EVENT = struct.Struct("<QIIII24x")
+# Event ids.
+RISING_EDGE = 1
+FALLING_EDGE = 2
+
+# struct gpio_v2_line_request, see linux/gpio.h (uAPI v2, Linux 5.10+).
+LINE_REQUEST_SIZE = 592
+GPIO_V2_GET_LINE_IOCTL = 0xC0000000 | (LINE_REQUEST_SIZE << 16) | (0xB4 << 8) | 0x07
+LINE_FLAG_INPUT = 1 << 2
+LINE_FLAG_EDGE_RISING = 1 << 4
+LINE_FLAG_EDGE_FALLING = 1 << 5
+LINE_FLAG_BIAS_PULL_UP = 1 << 8
+LINE_FLAG_BIAS_PULL_DOWN = 1 << 9
+LINE_ATTR_ID_FLAGS = 1
+LINE_ATTR_ID_DEBOUNCE = 3
+# Largest kernel event buffer, 16 events for each of the 64 lines a request can hold.
+MAX_EVENT_BUFFER_SIZE = 1024
+
+
+def line_request(radiation_offset, noise_offset, debounce_us=0, consumer=b"PiPocketGeiger",
+                 event_buffer_size=MAX_EVENT_BUFFER_SIZE):
+    """Return a gpio_v2_line_request for the radiation (falling edges,
+    pull-up) and noise (rising edges, pull-down) lines."""
+    request = bytearray(LINE_REQUEST_SIZE)
+    struct.pack_into("<2I", request, 0, radiation_offset, noise_offset)
+    struct.pack_into("<32s", request, 256, consumer)
+    # The config flags apply to the radiation line, an attribute to the noise one.
+    attributes = [(LINE_ATTR_ID_FLAGS, LINE_FLAG_INPUT | LINE_FLAG_EDGE_RISING
+                   | LINE_FLAG_BIAS_PULL_DOWN, 0b10)]
+    if debounce_us:
+        attributes.append((LINE_ATTR_ID_DEBOUNCE, debounce_us, 0b11))
+    struct.pack_into(
+        "<QI", request, 288,
+        LINE_FLAG_INPUT | LINE_FLAG_EDGE_FALLING | LINE_FLAG_BIAS_PULL_UP, len(attributes),
+    )
+    for index, (attribute_id, value, mask) in enumerate(attributes):
+        struct.pack_into("<I4xQQ", request, 320 + index * 24, attribute_id, value, mask)
+    struct.pack_into("<II", request, 560, 2, event_buffer_size)
+    return request
+
+
+class LineEventReader:
+    """Read gpio_v2_line_event records from a file descriptor in a
+    background thread, and deliver them in batches to
+    on_edges(radiation_timestamps, noise_timestamps).
+
+    Each read() takes up to batch events at once. The timestamps are the
+    kernel ones, on the monotonic clock, in nanoseconds. The file
+    descriptor is a line request one, or any stand-in producing the same
+    records (a pipe, a file): the reader stops at the end of file.
+
+    Usage:
+    ```
+    read_fd, write_fd = os.pipe()
+    reader = LineEventReader(read_fd, radiationWatch.feed_edges, 24, 23)
+    reader.start()
+    os.write(write_fd, LINE_EVENT.pack(time.monotonic_ns(), FALLING_EDGE, 24, 1, 1))
+    ```
+    """
+
+    def __init__(self, fd, on_edges, radiation_offset, noise_offset, batch=256):
+        """Create a reader of the events of the radiation_offset and
+        noise_offset lines from fd, reading up to batch events at once."""
+        self.fd = fd
+        self.on_edges = on_edges
+        self.radiation_offset = radiation_offset
+        self.noise_offset = noise_offset
+        self.batch = batch
+        self._thread = None
+        self._wakeup = None
+        self.events = 0
+        self.reads = 0
+        self.lost_events = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            raise RuntimeError("The line event reader is already running")
+        self.events = self.reads = self.lost_events = 0
+        self._wakeup = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="LineEventReader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """Stop reading, after the batch in progress."""
+        if self._thread is None:
+            return
+        os.write(self._wakeup[1], b"\0")
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        for fd in self._wakeup:
+            os.close(fd)
+        self._thread = None
+
+    def stats(self):
+        """Return the reader counters, as a dictionary with:
+            events -- the number of events read;
+            reads -- the number of read() calls returning events;
+            eventsPerRead -- the mean number of events by read();
+            lostEvents -- the events the kernel dropped (its buffer was full),
+            from the gaps in the sequence numbers."""
+        return dict(
+            events=self.events,
+            reads=self.reads,
+            eventsPerRead=round(self.events / self.reads, 2) if self.reads else 0,
+            lostEvents=self.lost_events,
+        )
+
+    def _run(self):
+        size = LINE_EVENT.size
+        pending = b""
+        last_seqno = None
+        while True:
+            readable, _, _ = select.select([self.fd, self._wakeup[0]], [], [])
+            if self._wakeup[0] in readable:
+                return
+            data = os.read(self.fd, size * self.batch)
+            if not data:
+                return
+            if pending:
+                data, pending = pending + data, b""
+            # A pipe can return a partial event: keep it for the next read.
+            end = len(data) - len(data) % size
+            if end < len(data):
+                pending = data[end:]
+                data = data[:end]
+            if not data:
+                continue
+            events = LINE_EVENT.iter_unpack(data)
+            radiation, noise = [], []
+            radiation_offset = self.radiation_offset
+            seqno = last_seqno
+            for timestamp, _, offset, seqno, _ in events:
+                if offset == radiation_offset:
+                    radiation.append(timestamp)
+                elif offset == self.noise_offset:
+                    noise.append(timestamp)
+            if last_seqno is not None:
+                self.lost_events += max(0, seqno - last_seqno - end // size)
+            last_seqno = seqno
+            self.events += end // size
+            self.reads += 1
+            self.on_edges(radiation, noise)
+
+
+class CharDevBackend(GPIOBackend):
+    """Backend reading the edges from the Linux GPIO character device,
+    without any library.
+
+    The kernel timestamps each edge in its interrupt handler and queues the
+    events (up to 1024); a single thread reads them in batches, and feeds
+    them to RadiationWatch.feed_edges(). There is no Python call per edge,
+    and the timestamps do not depend on the thread scheduling.
+    Pins are the line offsets of the chip (the BCM numbers on a Raspberry
+    Pi, on /dev/gpiochip0, or /dev/gpiochip4 on a Raspberry Pi 5).
+
+    Usage:
+    ```
+    with RadiationWatch(24, 23, backend=CharDevBackend("/dev/gpiochip0")) as radiationWatch:
+        print(radiationWatch.status())
+    ```
+    """
+
+    batched = True
+
+    def __init__(self, chip="/dev/gpiochip0", batch=256):
+        """Create a backend for the GPIO chip device, reading up to batch
+        events at once."""
+        self.chip = chip
+        self.batch = batch
+        self.reader = None
+        self._line_fd = None
+
+    def start(self, radiation_pin, noise_pin, on_radiation, on_noise, bouncetime=None):
+        def on_edges(radiation, noise):
+            for _ in radiation:
+                on_radiation(radiation_pin)
+            for _ in noise:
+                on_noise(noise_pin)
+
+        self.start_batched(radiation_pin, noise_pin, on_edges, bouncetime)
+
+    def start_batched(self, radiation_pin, noise_pin, on_edges, bouncetime=None):
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        request = line_request(
+            radiation_pin, noise_pin, debounce_us=int(bouncetime * 1000) if bouncetime else 0
+        )
+        chip_fd = os.open(self.chip, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            fcntl.ioctl(chip_fd, GPIO_V2_GET_LINE_IOCTL, request, True)
+        finally:
+            os.close(chip_fd)
+        self._line_fd = struct.unpack_from("<i", request, 588)[0]
+        self.reader = LineEventReader(
+            self._line_fd, on_edges, radiation_pin, noise_pin, batch=self.batch
+        )
+        self.reader.start()
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self._line_fd is not None:
+            os.close(self._line_fd)
+            self._line_fd = None
+
+    def stats(self):
+        """Return the reader counters, see LineEventReader.stats()."""
+        return self.reader.stats() if self.reader is not None else None
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+The pipocketgeiger command.
+
+    pipocketgeiger run --period 5
+    pipocketgeiger log /var/log/geiger --format bin
+    pipocketgeiger serve --metrics-port 9811 --socket /tmp/pipocketgeiger.sock
+    pipocketgeiger replay --radiation radiation.bin --every 375
+    pipocketgeiger bench --cpm 10 1000 600000
+    pipocketgeiger aggregate --port 9812 --period 60
+
+Each subcommand only imports what it uses (the GPIO library, NumPy...),
+so the command starts fast even on a Raspberry Pi Zero.
+
+Released under MIT License. See LICENSE file.
+"""
+import argparse
+import functools
+import json
+import signal
+import sys
+import threading
+import time
+
+from PiPocketGeiger.core import HISTORY_LENGTH, HISTORY_UNIT, PROCESS_PERIOD
+
+__all__ = ["main"]
+
+BACKENDS = ("rpi", "gpiozero", "chardev")
+
+
+def _print_json(record):
+    print(json.dumps(record), flush=True)
+
+
+def _stop_event():
+    """Return an event set on SIGTERM and SIGINT."""
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+    return stopped
+
+
+def _add_watch_arguments(parser):
+    parser.add_argument("--radiation-pin", type=int, default=24)
+    parser.add_argument("--noise-pin", type=int, default=23)
+    parser.add_argument("--backend", choices=BACKENDS, default="rpi",
+                        help="GPIO backend (default: rpi, the RPi.GPIO API)")
+    parser.add_argument("--chip", default="/dev/gpiochip0",
+                        help="GPIO chip of the chardev backend")
+    parser.add_argument("--simulate", type=float, metavar="CPM",
+                        help="simulate radiation at CPM instead of reading the GPIOs")
+    parser.add_argument("--calibration", metavar="PATH:NAME",
+                        help="calibration profile NAME of the JSON file PATH")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="sleep while no edge comes (see RadiationWatch adaptive)")
+
+
+def _radiation_watch(args):
+    # pylint: disable=import-outside-toplevel
+    from PiPocketGeiger import RadiationWatch
+
+    if args.simulate is not None:
+        from PiPocketGeiger.backends import SimulatedBackend
+
+        backend = SimulatedBackend(radiation_cpm=args.simulate)
+    elif args.backend == "gpiozero":
+        from PiPocketGeiger.backends import GPIOZeroBackend
+
+        backend = GPIOZeroBackend()
+    elif args.backend == "chardev":
+        from PiPocketGeiger.chardev import CharDevBackend
+
+        backend = CharDevBackend(args.chip)
+    else:
+        backend = None
+    calibration = None
+    if args.calibration:
+        from PiPocketGeiger.calibration import load_profiles
+
+        path, _, name = args.calibration.rpartition(":")
+        calibration = load_profiles(path)[name]
+    return RadiationWatch(args.radiation_pin, args.noise_pin, backend=backend,
+                          calibration=calibration, adaptive=args.adaptive)
+
+
+def _run(args):
+    stopped = _stop_event()
+    if args.socket:
+        # pylint: disable=import-outside-toplevel
+        from PiPocketGeiger.daemon import GeigerClient
+
+        source = GeigerClient(args.socket)
+        read = source.status
+    else:
+        source = _radiation_watch(args)
+        read = functools.partial(source.status, args.window)
+    with source:
+        printed = 0
+        while args.count is None or printed < args.count:
+            if printed or not args.socket:
+                if stopped.wait(args.period):
+                    break
+            _print_json(dict(time=round(time.time(), 3), **read()))
+            printed += 1
+
+
+def _log(args):
+    # pylint: disable=import-outside-toplevel
+    from PiPocketGeiger.logger import MeasurementLogger
+
+    stopped = _stop_event()
+    with _radiation_watch(args) as radiation_watch:
+        logger = MeasurementLogger(
+            radiation_watch, args.directory, period=args.period, format=args.format,
+            max_bytes=args.max_bytes, max_age=args.max_age,
+            compression=None if args.compression == "none" else args.compression,
+            flush_period=args.flush_period, fsync=args.fsync, keep=args.keep,
+        )
+        logger.start()
+        stopped.wait()
+        logger.stop()
+        _print_json(logger.stats())
+
+
+def _serve(args):
+    # pylint: disable=import-outside-toplevel
+    if args.metrics_port is None and args.socket is None:
+        raise SystemExit("Nothing to serve: give --metrics-port and/or --socket")
+    stopped = _stop_event()
+    with _radiation_watch(args) as radiation_watch:
+        services = []
+        if args.metrics_port is not None:
+            from PiPocketGeiger.metrics import MetricsExporter
+
+            labels = dict(label.split("=", 1) for label in args.label)
+            services.append(MetricsExporter(radiation_watch, host=args.host,
+                                            port=args.metrics_port, labels=labels))
+        if args.socket is not None:
+            from PiPocketGeiger.daemon import GeigerDaemon
+
+            services.append(GeigerDaemon(radiation_watch, args.socket,
+                                         status_period=args.status_period))
+        for service in services:
+            service.start()
+        stopped.wait()
+        for service in services:
+            service.stop()
+
+
+def _replay(args):
+    # pylint: disable=import-outside-toplevel
+    from PiPocketGeiger.replay import Recording, load_timestamps, replay
+
+    if args.tick_log:
+        recording = Recording.from_tick_log(args.tick_log)
+    elif args.radiation:
+        recording = Recording.from_timestamps(
+            load_timestamps(args.radiation),
+            load_timestamps(args.noise) if args.noise else None,
+            process_period=args.process_period,
+        )
+    else:
+        raise SystemExit("Nothing to replay: give --tick-log or --radiation")
+    calibration = None
+    if args.calibration:
+        from PiPocketGeiger.calibration import load_profiles
+
+        path, _, name = args.calibration.rpartition(":")
+        calibration = load_profiles(path)[name]
+    result = replay(recording, history_length=args.history_length,
+                    history_unit=args.history_unit, calibration=calibration, every=args.every)
+    for index in range(len(result)):
+        _print_json(dict(time=int(result.times[index]), **result.status(index)))
+
+
+def _bench(args):
+    # pylint: disable=import-outside-toplevel
+    from PiPocketGeiger import RadiationWatch
+    from PiPocketGeiger.backends import SimulatedBackend
+
+    for cpm in args.cpm:
+        backend = SimulatedBackend(radiation_cpm=cpm, noise_cpm=args.noise, seed=args.seed,
+                                   max_lag=args.max_lag)
+        with RadiationWatch(24, 23, backend=backend, adaptive=args.adaptive) as radiation_watch:
+            time.sleep(args.duration)
+            status = radiation_watch.status()
+            scheduler = radiation_watch.scheduler_stats()
+        _print_json(dict(simulatedCpm=cpm, status=status, edges=backend.stats(),
+                         scheduler=scheduler))
+
+
+def _aggregate(args):
+    # pylint: disable=import-outside-toplevel
+    from PiPocketGeiger.fleet import FleetAggregator
+
+    if args.port is None and args.socket is None:
+        raise SystemExit("Nowhere to listen: give --port or --socket")
+    stopped = _stop_event()
+    address = args.socket if args.socket is not None else (args.host, args.port)
+    aggregator = FleetAggregator(address, depth=args.depth)
+    aggregator.start()
+    while not stopped.wait(args.period):
+        _print_json(dict(time=round(time.time(), 3), top=aggregator.top(args.top),
+                         regions=aggregator.regions(args.cell),
+                         stale=aggregator.stale(args.max_age), **aggregator.stats()))
+    aggregator.stop()
+
+
+def parser():
+    """Return the argument parser of the pipocketgeiger command."""
+    main_parser = argparse.ArgumentParser(
+        prog="pipocketgeiger", description="Monitor radiation with a Pocket Geiger."
+    )
+    subparsers = main_parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    run = subparsers.add_parser("run", help="print the readings as JSON lines")
+    _add_watch_arguments(run)
+    run.add_argument("--period", type=float, default=5.0,
+                     help="period between two readings (seconds, default: 5)")
+    run.add_argument("--count", type=int, help="stop after COUNT readings")
+    # The daemon only publishes the readings over the whole history.
+    source = run.add_mutually_exclusive_group()
+    source.add_argument("--window", help="sliding window of the readings (1m, 10m, 1h, 24h)")
+    source.add_argument("--socket", help="read from the daemon on this Unix socket instead")
+    run.set_defaults(function=_run)
+
+    log = subparsers.add_parser("log", help="log the readings to segment files")
+    _add_watch_arguments(log)
+    log.add_argument("directory")
+    log.add_argument("--period", type=float, default=30.0,
+                     help="period between two readings (seconds, default: 30)")
+    log.add_argument("--format", choices=("csv", "bin"), default="csv")
+    log.add_argument("--compression", choices=("gzip", "zstd", "none"), default="gzip")
+    log.add_argument("--max-bytes", type=int, default=1024 * 1024)
+    log.add_argument("--max-age", type=float, default=86400)
+    log.add_argument("--flush-period", type=float, default=300)
+    log.add_argument("--fsync", action="store_true")
+    log.add_argument("--keep", type=int, help="number of segments to keep")
+    log.set_defaults(function=_log)
+
+    serve = subparsers.add_parser("serve", help="serve Prometheus metrics and/or the daemon")
+    _add_watch_arguments(serve)
+    serve.add_argument("--metrics-port", type=int, help="serve /metrics on this port")
+    serve.add_argument("--host", default="", help="address of the metrics server")
+    serve.add_argument("--label", action="append", default=[], metavar="NAME=VALUE",
+                       help="label of the metrics (repeatable)")
+    serve.add_argument("--socket", help="publish the pulses and readings on this Unix socket")
+    serve.add_argument("--status-period", type=float, default=1.0,
+                       help="period for publishing the readings on the socket (seconds)")
+    serve.set_defaults(function=_serve)
+
+    replay = subparsers.add_parser("replay", help="replay recorded pulses (needs NumPy)")
+    replay.add_argument("--radiation", help="radiation timestamps file (.npy or raw int64)")
+    replay.add_argument("--noise", help="noise timestamps file (.npy or raw int64)")
+    replay.add_argument("--tick-log", help="tick log of a HistoryStore")
+    replay.add_argument("--process-period", type=int, default=PROCESS_PERIOD,
+                        help="processing period (ms, default: %(default)s)")
+    replay.add_argument("--history-length", type=int, default=HISTORY_LENGTH)
+    replay.add_argument("--history-unit", type=float, default=HISTORY_UNIT,
+                        help="history bucket duration (seconds, default: %(default)s)")
+    replay.add_argument("--calibration", metavar="PATH:NAME",
+                        help="calibration profile NAME of the JSON file PATH")
+    replay.add_argument("--every", type=int, default=375,
+                        help="print the readings every EVERY periods (default: 1 minute)")
+    replay.set_defaults(function=_replay)
+
+    bench = subparsers.add_parser("bench", help="load-test with simulated edges")
+    bench.add_argument("--cpm", type=float, nargs="+", default=[10, 1000, 60000, 600000],
+                       help="simulated radiation rates (counts per minute)")
+    bench.add_argument("--noise", type=float, default=1.0, help="simulated noise rate (CPM)")
+    bench.add_argument("--duration", type=float, default=5.0,
+                       help="duration of each rate (seconds)")
+    bench.add_argument("--seed", type=int, default=42)
+    bench.add_argument("--max-lag", type=float, default=0.01,
+                       help="delay after which a late edge is dropped (seconds)")
+    bench.add_argument("--adaptive", action="store_true")
+    bench.set_defaults(function=_bench)
+
+    aggregate = subparsers.add_parser(
+        "aggregate", help="aggregate the readings of many nodes (needs NumPy)"
+    )
+    aggregate.add_argument("--port", type=int, help="listen on this TCP port")
+    aggregate.add_argument("--host", default="", help="address of the TCP server")
+    aggregate.add_argument("--socket", help="listen on this Unix socket instead")
+    aggregate.add_argument("--depth", type=int, default=60,
+                           help="readings kept by node (default: %(default)s)")
+    aggregate.add_argument("--period", type=float, default=60.0,
+                           help="period between two fleet summaries (seconds, default: 60)")
+    aggregate.add_argument("--top", type=int, default=10, help="hottest nodes to print")
+    aggregate.add_argument("--cell", type=float,
+                           help="roll up by cells of CELL degrees (default: by region)")
+    aggregate.add_argument("--max-age", type=float, default=300,
+                           help="delay after which a silent node is stale (seconds)")
+    aggregate.set_defaults(function=_aggregate)
+    return main_parser
+
+
+def main(argv=None):
+    """Run the pipocketgeiger command."""
+    args = parser().parse_args(argv)
+    try:
+        args.function(args)
+    except BrokenPipeError:
+        # The output was closed (e.g. piped to head): exit quietly.
+        sys.stderr.close()
+
+
+if __name__ == "__main__":
+    main()
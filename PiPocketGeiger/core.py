@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics processing, independent from the clock and the GPIOs.
+
+Released under MIT License. See LICENSE file.
+"""
+import functools
+
+from PiPocketGeiger.calibration import Calibration
+from PiPocketGeiger.status import Status
+from PiPocketGeiger.windows import SlidingWindow, DEFAULT_WINDOWS
+
+__all__ = [
+    "StatisticsCore",
+    "HISTORY_LENGTH",
+    "HISTORY_UNIT",
+    "PROCESS_PERIOD",
+    "MAX_CPM_TIME",
+]
+
+# Number of cells of the history array.
+HISTORY_LENGTH = 200
+# Duration of each history array cell (seconds).
+HISTORY_UNIT = 6
+# Process period for the statistics (milliseconds).
+PROCESS_PERIOD = 160
+MAX_CPM_TIME = HISTORY_LENGTH * HISTORY_UNIT * 1000
+
+
+class StatisticsCore:
+    """Readings computed from the counts of successive processing periods.
+
+    The core has no clock of its own: process() is given the time of each
+    period. RadiationWatch drives it with the monotonic clock and the GPIO
+    edges counts; the replay module drives it with recorded data.
+
+    Usage:
+    ```
+    core = StatisticsCore()
+    core.reset(0)
+    for period in range(1, 1000):
+        core.process(period * PROCESS_PERIOD, radiation_count=1, noise_count=0)
+    print(core.status())
+    ```
+    """
+
+    def __init__(self, windows=None, detector=None, noise_gate=None, calibration=None,
+                 history_length=HISTORY_LENGTH, history_unit=HISTORY_UNIT):
+        """Create a core with history_length buckets of history_unit seconds
+        of history. See RadiationWatch for the other options."""
+        if history_length <= 0 or history_unit <= 0:
+            raise ValueError("The history length and unit must be positive")
+        if not float(history_unit * 1000).is_integer():
+            raise ValueError("The history unit must be a whole number of milliseconds")
+        self.history_length = history_length
+        self.history_unit = history_unit
+        self.max_cpm_time = history_length * history_unit * 1000
+        self.alarm_callback = None
+        self.detector = detector
+        self.noise_gate = noise_gate
+        self.calibration = Calibration() if calibration is None else calibration
+        self.windows = {
+            name: SlidingWindow(duration)
+            for name, duration in (DEFAULT_WINDOWS if windows is None else windows).items()
+        }
+
+    def status(self, window=None):
+        """Return current readings, as a dictionary with:
+            duration -- the duration of the measurements, in seconds;
+            cpm -- the radiation count by minute;
+            uSvh -- the radiation dose, expressed in microSieverts per hour (uSv/h);
+            uSvhError -- the incertitude for the radiation dose.
+
+        The readings are an immutable Status snapshot, published at the end
+        of each processing period: all its values are consistent together.
+        By default the readings are averaged over the last 20 minutes.
+        Give a window name (e.g. "1m" or "24h", see DEFAULT_WINDOWS) to get
+        the readings over this sliding window instead, with duration the
+        measurement time in the window. Give "all" to get the readings
+        of all the windows, as a dictionary of name -> readings."""
+        if window is None:
+            return self._status
+        # Take the published snapshot once, to be consistent across windows.
+        window_totals = self._window_totals
+        if window == "all":
+            return {
+                name: Status.from_counts(count, duration, self.calibration)
+                for name, (count, duration) in window_totals.items()
+            }
+        count, duration = window_totals[window]
+        return Status.from_counts(count, duration, self.calibration)
+
+    def register_alarm_callback(self, callback):
+        """Register a function that will be called when the detector raises
+        an alarm, with the detector status as argument
+        (see ChangePointDetector.status())."""
+        if self.detector is None:
+            raise RuntimeError("No detector: set detector to get alarms")
+        self.alarm_callback = callback
+
+    def alarm_status(self):
+        """Return the state of the detector, see ChangePointDetector.status()."""
+        if self.detector is None:
+            raise RuntimeError("No detector: set detector to get alarms")
+        return self.detector.status()
+
+    def live_time(self):
+        """Return the measurement time kept, as a dictionary with:
+            realTime -- the time elapsed since the setup, in seconds;
+            liveTime -- the time kept in the measurements (time with noise
+            is discarded), in seconds;
+            liveFraction -- the fraction of the time kept."""
+        real_time, live_time = self.real_time, self.live_time_total
+        return dict(
+            realTime=round(real_time / 1000.0, 2),
+            liveTime=round(live_time / 1000.0, 2),
+            liveFraction=round(live_time / real_time, 4) if real_time > 0 else 0,
+        )
+
+    def reset(self, current_time, now_ns=None):
+        """Forget all the measurements, starting at current_time
+        (milliseconds). now_ns is the time in the noise gate clock
+        (nanoseconds), current_time in nanoseconds by default."""
+        self.count = 0
+        # Initialize count_history[].
+        self.count_history = [0] * self.history_length
+        self.history_index = 0
+        # Init measurement time.
+        self.previous_time = current_time
+        self.previous_history_time = current_time
+        self.duration = 0
+        # Time processed, and time kept (noise free) in the measurements.
+        self.real_time = 0
+        self.live_time_total = 0
+        # Periods with noise edges, and shifts of the history.
+        self.vetoed_ticks = 0
+        self.history_shifts = 0
+        if self.noise_gate is not None:
+            self.noise_gate.reset(current_time * 1000000 if now_ns is None else now_ns)
+        for sliding_window in self.windows.values():
+            sliding_window.reset(current_time)
+        if self.detector is not None:
+            self.detector.reset()
+        self._publish_status()
+
+    def process(self, current_time, radiation_count, noise_count, now_ns=None):
+        """Process a period ending at current_time (milliseconds), during
+        which radiation_count radiation and noise_count noise edges were
+        counted. now_ns is the time in the noise gate clock (nanoseconds),
+        current_time in nanoseconds by default."""
+        self.real_time += abs(current_time - self.previous_time)
+        if noise_count:
+            self.vetoed_ticks += 1
+        if self.noise_gate is not None:
+            # Only discard the pulses and the time around the noise edges.
+            self._add_counts(*self.noise_gate.process(
+                current_time * 1000000 if now_ns is None else now_ns
+            ))
+        elif noise_count == 0:
+            self._add_counts(radiation_count, abs(current_time - self.previous_time))
+        for sliding_window in self.windows.values():
+            sliding_window.advance(current_time)
+        # Shift an array for counting log for each HISTORY_UNIT seconds.
+        if current_time - self.previous_history_time >= self.history_unit * 1000:
+            self.previous_history_time += self.history_unit * 1000
+            self.history_shifts += 1
+            self.history_index = (self.history_index + 1) % self.history_length
+            self.count -= self.count_history[self.history_index]
+            self.count_history[self.history_index] = 0
+        # Save time of current process period.
+        self.previous_time = current_time
+        self._publish_status()
+
+    def _call(self, callback, key=None):  # pylint: disable=unused-argument
+        # Without dispatcher, there is nothing to coalesce by key: see
+        # CallbackDispatcher.submit().
+        callback()
+
+    def _publish_status(self):
+        # Replacing the references is atomic: readers get either the previous
+        # snapshots or the new ones, never a mix of both.
+        self._window_totals = {
+            name: (sliding_window.count, sliding_window.time)
+            for name, sliding_window in self.windows.items()
+        }
+        self._status = Status.from_counts(
+            self.count, self.duration, self.calibration, self.max_cpm_time
+        )
+
+    def _add_counts(self, count, elapsed):
+        """Add count radiation counts measured during elapsed ms."""
+        # Store count log.
+        self.count_history[self.history_index] += count
+        # Add number of counts.
+        self.count += count
+        # Add ellapsed time to history duration.
+        self.duration += elapsed
+        self.live_time_total += elapsed
+        for sliding_window in self.windows.values():
+            sliding_window.add(count, elapsed)
+        if (
+            self.detector is not None
+            and self.detector.update(count, elapsed / 1000.0)
+            and self.alarm_callback
+        ):
+            self._call(functools.partial(self.alarm_callback, self.detector.status()),
+                       key=self.alarm_callback)
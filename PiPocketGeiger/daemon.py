@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+Share one Pocket Geiger between processes: a daemon owns the GPIOs and
+publishes the pulses and readings on a Unix domain socket, to which any
+number of clients can subscribe.
+
+Run the daemon with:
+    python -m PiPocketGeiger.daemon --socket /tmp/pipocketgeiger.sock
+
+Then from any process:
+```
+with GeigerClient("/tmp/pipocketgeiger.sock") as geiger:
+    geiger.register_radiation_callback(onRadiation)
+    print(geiger.status())
+```
+
+Wire protocol: a stream of frames, each one made of a FRAME_HEADER (frame
+type, payload length) followed by the payload: PULSE_PAYLOAD for FRAME_PULSE
+frames, STATUS_PAYLOAD for FRAME_STATUS frames. The current readings are
+sent on connection, then periodically.
+
+Released under MIT License. See LICENSE file.
+"""
+import argparse
+import os
+import selectors
+import signal
+import socket
+import struct
+import threading
+
+from PiPocketGeiger.scheduler import PeriodicScheduler
+
+__all__ = ["GeigerDaemon", "GeigerClient", "DEFAULT_SOCKET_PATH"]
+
+DEFAULT_SOCKET_PATH = "/tmp/pipocketgeiger.sock"
+
+FRAME_HEADER = struct.Struct("<BH")
+FRAME_PULSE = 1
+FRAME_STATUS = 2
+# Pulse kind (0 radiation, 1 noise), monotonic timestamp (ns).
+PULSE_PAYLOAD = struct.Struct("<Bq")
+# Duration, cpm, uSvh, uSvhError, total radiation and noise pulses.
+STATUS_PAYLOAD = struct.Struct("<ddddQQ")
+
+PULSE_KINDS = ("radiation", "noise")
+
+
+def pulse_frame(kind, timestamp):
+    return FRAME_HEADER.pack(FRAME_PULSE, PULSE_PAYLOAD.size) + PULSE_PAYLOAD.pack(
+        PULSE_KINDS.index(kind), timestamp
+    )
+
+
+def status_frame(status, radiation_total, noise_total):
+    return FRAME_HEADER.pack(FRAME_STATUS, STATUS_PAYLOAD.size) + STATUS_PAYLOAD.pack(
+        status["duration"],
+        status["cpm"],
+        status["uSvh"],
+        status["uSvhError"],
+        radiation_total,
+        noise_total,
+    )
+
+
+def read_frames(buffer):
+    """Yield the frame type, payload start and payload end offsets of the
+    complete frames at the start of buffer (a bytearray), then remove these
+    frames from it. A partial frame is left for the next data."""
+    offset = 0
+    while len(buffer) - offset >= FRAME_HEADER.size:
+        frame_type, length = FRAME_HEADER.unpack_from(buffer, offset)
+        end = offset + FRAME_HEADER.size + length
+        if len(buffer) < end:
+            break
+        yield frame_type, offset + FRAME_HEADER.size, end
+        offset = end
+    del buffer[:offset]
+
+
+class SocketServer:
+    """Serve the connections of a listening socket from a background thread,
+    waiting for them with a selector.
+
+    Subclasses handle the connections: _on_connect() for each new one,
+    _on_event() when one is ready, _on_select() after each wait, and
+    _disconnect_all() when stopping. _wakeup() interrupts the wait.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._selector = None
+        self._server = None
+        self._path = None
+        self._wakeup_reader, self._wakeup_writer = None, None
+        self._stopping = False
+        self._thread = None
+
+    def _listen(self, address):
+        """Listen on a Unix socket (address is a path) or a TCP socket
+        (address is a (host, port) tuple), and start serving. Return the
+        address listened on (the port chosen by the system for port 0)."""
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.unlink(address)
+            self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._path = address
+        else:
+            self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen(socket.SOMAXCONN)
+        self._server.setblocking(False)
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._server, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._serve, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return address if self._path is not None else self._server.getsockname()
+
+    def _stop(self):
+        """Stop serving, and wait for the thread to terminate."""
+        self._stopping = True
+        self._wakeup()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_writer.send(b"\0")
+        except (AttributeError, BlockingIOError, OSError):
+            pass
+
+    def _drain_wakeups(self):
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _serve(self):
+        try:
+            while not self._stopping:
+                for key, events in self._selector.select():
+                    if key.fileobj is self._server:
+                        self._accept()
+                    elif key.fileobj is self._wakeup_reader:
+                        self._drain_wakeups()
+                    else:
+                        self._on_event(key, events)
+                self._on_select()
+        finally:
+            self._disconnect_all()
+            self._selector.close()
+            self._server.close()
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
+            if self._path is not None and os.path.exists(self._path):
+                os.unlink(self._path)
+
+    def _accept(self):
+        try:
+            connection, _ = self._server.accept()
+        except BlockingIOError:
+            return
+        connection.setblocking(False)
+        self._on_connect(connection)
+
+    def _on_connect(self, connection):
+        raise NotImplementedError
+
+    def _on_event(self, key, events):
+        raise NotImplementedError
+
+    def _on_select(self):
+        pass
+
+    def _disconnect_all(self):
+        raise NotImplementedError
+
+
+class _Subscriber:
+    def __init__(self, connection):
+        self.connection = connection
+        self.buffer = bytearray()
+        self.slow = False
+        self.writing = False
+
+
+class GeigerDaemon(SocketServer):
+    """Publish the pulses and readings of a RadiationWatch
+    on a Unix domain socket.
+
+    Each subscriber has its own output buffer. A subscriber not reading fast
+    enough, whose buffer grows over max_buffer bytes, is disconnected, so
+    it never holds up the others (nor the GPIO edge thread).
+
+    Usage:
+    ```
+    with RadiationWatch(24, 23) as radiationWatch:
+        daemon = GeigerDaemon(radiationWatch, "/tmp/pipocketgeiger.sock")
+        daemon.start()
+    ```
+    """
+
+    def __init__(self, radiation_watch, path=DEFAULT_SOCKET_PATH, status_period=1.0,
+                 max_buffer=64 * 1024):
+        """Create a daemon publishing on the socket at path, sending the
+        readings every status_period seconds."""
+        super().__init__("GeigerDaemon")
+        self.radiation_watch = radiation_watch
+        self.path = path
+        self.max_buffer = max_buffer
+        self.scheduler = PeriodicScheduler(status_period, self._publish_status,
+                                           name="GeigerDaemon-status")
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._wakeup_pending = False
+        self.disconnected_slow = 0
+
+    def start(self):
+        """Start publishing, from a background thread."""
+        self._listen(self.path)
+        self.radiation_watch.add_pulse_listener(self)
+        self.scheduler.start()
+
+    def stop(self):
+        """Stop publishing and disconnect all the subscribers."""
+        self.radiation_watch.remove_pulse_listener(self)
+        self.scheduler.stop()
+        self._stop()
+
+    def close(self):
+        # Called when the RadiationWatch is closed: nothing to publish anymore.
+        self.scheduler.stop()
+        self._stopping = True
+        self._wakeup()
+
+    def stats(self):
+        """Return the daemon counters, as a dictionary with:
+            subscribers -- the number of connected subscribers;
+            disconnectedSlow -- the number of subscribers disconnected
+            for being too slow."""
+        return dict(subscribers=len(self._subscribers),
+                    disconnectedSlow=self.disconnected_slow)
+
+    def push(self, kind, timestamp):
+        # Called from the GPIO edge thread.
+        self._publish(pulse_frame(kind, timestamp))
+
+    def _publish_status(self):
+        watch = self.radiation_watch
+        self._publish(status_frame(watch.status(), watch.radiation_total, watch.noise_total))
+
+    def _publish(self, frame):
+        with self._lock:
+            for subscriber in self._subscribers.values():
+                if subscriber.slow:
+                    continue
+                subscriber.buffer += frame
+                if len(subscriber.buffer) > self.max_buffer:
+                    subscriber.slow = True
+            if self._wakeup_pending or not self._subscribers:
+                return
+            self._wakeup_pending = True
+        self._wakeup()
+
+    def _on_event(self, key, events):
+        if events & selectors.EVENT_READ and not self._receive(key.fileobj):
+            self._disconnect(key.fileobj)
+        elif events & selectors.EVENT_WRITE:
+            self._flush(self._subscribers[key.fileobj])
+
+    def _on_select(self):
+        self._flush_all()
+
+    def _disconnect_all(self):
+        for connection in list(self._subscribers):
+            self._disconnect(connection)
+
+    def _on_connect(self, connection):
+        subscriber = _Subscriber(connection)
+        watch = self.radiation_watch
+        subscriber.buffer += status_frame(
+            watch.status(), watch.radiation_total, watch.noise_total
+        )
+        with self._lock:
+            self._subscribers[connection] = subscriber
+        self._selector.register(connection, selectors.EVENT_READ)
+
+    def _drain_wakeups(self):
+        with self._lock:
+            self._wakeup_pending = False
+        super()._drain_wakeups()
+
+    def _receive(self, connection):
+        """Return False when the subscriber hung up."""
+        try:
+            return bool(connection.recv(4096))
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def _flush_all(self):
+        for subscriber in list(self._subscribers.values()):
+            if subscriber.slow:
+                self.disconnected_slow += 1
+                self._disconnect(subscriber.connection)
+            elif subscriber.buffer and not subscriber.writing:
+                self._flush(subscriber)
+
+    def _flush(self, subscriber):
+        with self._lock:
+            data = bytes(subscriber.buffer)
+        try:
+            sent = subscriber.connection.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._disconnect(subscriber.connection)
+            return
+        with self._lock:
+            del subscriber.buffer[:sent]
+            pending = bool(subscriber.buffer)
+        # Wait for the socket to be writable again if we could not send it all.
+        if pending != subscriber.writing:
+            subscriber.writing = pending
+            self._selector.modify(
+                subscriber.connection,
+                selectors.EVENT_READ | (selectors.EVENT_WRITE if pending else 0),
+            )
+
+    def _disconnect(self, connection):
+        with self._lock:
+            self._subscribers.pop(connection, None)
+        try:
+            self._selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        connection.close()
+
+
+class GeigerClient:
+    """Subscribe to a GeigerDaemon, with the same API as RadiationWatch:
+    status() and the radiation / noise callbacks (called from the client
+    thread).
+
+    Usage:
+    ```
+    with GeigerClient("/tmp/pipocketgeiger.sock") as geiger:
+        geiger.register_radiation_callback(onRadiation)
+        while 1:
+            print(geiger.status())
+            time.sleep(5)
+    ```
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, timeout=5):
+        """Create a client of the daemon listening at path. timeout is the
+        delay to wait for the first readings on setup(), in seconds."""
+        self.path = path
+        self.timeout = timeout
+        self.radiation_callback = None
+        self.noise_callback = None
+        self.radiation_total = 0
+        self.noise_total = 0
+        self._status = None
+        self._status_received = threading.Event()
+        self._socket = None
+        self._thread = None
+
+    def __enter__(self):
+        return self.setup()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def setup(self):
+        """Connect to the daemon, and wait for the first readings."""
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(self.path)
+        self._thread = threading.Thread(target=self._run, name="GeigerClient")
+        self._thread.daemon = True
+        self._thread.start()
+        if not self._status_received.wait(self.timeout):
+            self.close()
+            raise TimeoutError("No readings received from the daemon")
+        return self
+
+    def close(self):
+        """Disconnect from the daemon."""
+        if self._socket is not None:
+            try:
+                self._socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._socket.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    @property
+    def connected(self):
+        """Whether the client is still connected to the daemon."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def status(self):
+        """Return the last readings published by the daemon,
+        see RadiationWatch.status()."""
+        return dict(self._status)
+
+    def register_radiation_callback(self, callback):
+        """Register a function that will be called on radiation occurrence. """
+        self.radiation_callback = callback
+
+    def register_noise_callback(self, callback):
+        """Register a function that will be called on noise occurrence. """
+        self.noise_callback = callback
+
+    def _run(self):
+        buffer = bytearray()
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            for frame_type, start, _ in read_frames(buffer):
+                self._on_frame(frame_type, buffer, start)
+
+    def _on_frame(self, frame_type, buffer, offset):
+        if frame_type == FRAME_PULSE:
+            kind, _timestamp = PULSE_PAYLOAD.unpack_from(buffer, offset)
+            callback = self.radiation_callback if kind == 0 else self.noise_callback
+            if callback:
+                callback()
+        elif frame_type == FRAME_STATUS:
+            duration, cpm, usvh, usvh_error, radiation_total, noise_total = (
+                STATUS_PAYLOAD.unpack_from(buffer, offset)
+            )
+            self._status = dict(duration=duration, cpm=cpm, uSvh=usvh, uSvhError=usvh_error)
+            self.radiation_total = radiation_total
+            self.noise_total = noise_total
+            self._status_received.set()
+        # Ignore unknown frames, for forward compatibility.
+
+
+def main(argv=None):
+    """Run the daemon until interrupted."""
+    # pylint: disable=import-outside-toplevel
+    from PiPocketGeiger import RadiationWatch, SimulatedBackend
+
+    parser = argparse.ArgumentParser(description="Share a Pocket Geiger between processes.")
+    parser.add_argument("--radiation-pin", type=int, default=24)
+    parser.add_argument("--noise-pin", type=int, default=23)
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket path")
+    parser.add_argument("--status-period", type=float, default=1.0,
+                        help="period for publishing the readings (seconds)")
+    parser.add_argument("--simulate", type=float, metavar="CPM",
+                        help="simulate radiation at CPM instead of reading the GPIOs")
+    args = parser.parse_args(argv)
+    backend = SimulatedBackend(radiation_cpm=args.simulate) if args.simulate else None
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopped.set())
+    with RadiationWatch(args.radiation_pin, args.noise_pin, backend=backend) as radiation_watch:
+        daemon = GeigerDaemon(radiation_watch, args.socket, status_period=args.status_period)
+        daemon.start()
+        try:
+            stopped.wait()
+        except KeyboardInterrupt:
+            pass
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-bucket histograms of the driver timings, to find out whether it
+keeps up with the load.
+
+Released under MIT License. See LICENSE file.
+"""
+import bisect
+import time
+
+__all__ = ["Histogram", "TimedLock", "TIMING_BOUNDS"]
+
+# Upper bounds of the timing histogram buckets (seconds), from 1 us to 1 s.
+# A last bucket counts the values above the last bound.
+TIMING_BOUNDS = tuple(
+    float("{0}e{1}".format(mantissa, exponent))
+    for exponent in range(-6, 0)
+    for mantissa in (1, 2, 5)
+) + (1.0,)
+
+
+class Histogram:
+    """Count values in fixed buckets.
+
+    Recording a value is a bisection and two additions, without any lock:
+    a histogram must only be recorded to from one thread at a time.
+
+    Usage:
+    ```
+    histogram = Histogram()
+    start = time.perf_counter()
+    process()
+    histogram.record(time.perf_counter() - start)
+    print(histogram.to_dict())
+    ```
+    """
+
+    def __init__(self, bounds=TIMING_BOUNDS):
+        """Create a histogram with buckets of the given upper bounds."""
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, value):
+        """Count a value in its bucket."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, fraction):
+        """Return the upper bound of the bucket of the given quantile
+        (the maximum for the last bucket), or 0 if nothing was recorded."""
+        if self.count == 0:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        """Return the histogram, as a dictionary with:
+            count -- the number of values recorded;
+            max -- the largest value;
+            p50, p99 -- the upper bounds of the median and 99th percentile;
+            bounds -- the upper bounds of the buckets;
+            counts -- the number of values of each bucket, and above the
+            last bound."""
+        return dict(
+            count=self.count,
+            max=self.max,
+            p50=self.quantile(0.5),
+            p99=self.quantile(0.99),
+            bounds=list(self.bounds),
+            counts=list(self.counts),
+        )
+
+
+class TimedLock:
+    """Lock recording in a Histogram how long it is held."""
+
+    def __init__(self, lock, histogram):
+        self._lock = lock
+        self.histogram = histogram
+        self._acquired_at = 0.0
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._acquired_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Recorded while still holding the lock: one writer at a time.
+        self.histogram.record(time.perf_counter() - self._acquired_at)
+        self._lock.release()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Deliver the user callbacks from a pool of worker threads, so that slow
+callbacks never hold up the GPIO edge thread.
+
+Released under MIT License. See LICENSE file.
+"""
+import collections
+import threading
+import traceback
+
+__all__ = ["CallbackDispatcher", "DROP", "COALESCE", "BLOCK"]
+
+# Overflow policies: when the queue is full, either drop the new call,
+DROP = "drop"
+# merge it with the other overflowing calls of the same callback (which is
+# queued in the next room freed in the queue; up to maxsize distinct
+# callbacks, the others being dropped),
+COALESCE = "coalesce"
+# or block the caller (the edge thread!) until the queue has room.
+BLOCK = "block"
+
+
+class CallbackDispatcher:
+    """Run submitted callbacks from a pool of worker threads,
+    through a bounded queue.
+
+    Usage:
+    ```
+    dispatcher = CallbackDispatcher(workers=2, maxsize=256, overflow=COALESCE)
+    with RadiationWatch(24, 23, dispatcher=dispatcher) as radiationWatch:
+        radiationWatch.register_radiation_callback(slow_callback)
+    ```
+    """
+
+    def __init__(self, workers=1, maxsize=1024, overflow=DROP, name=None):
+        """Create a dispatcher with workers threads and a queue of maxsize
+        calls. overflow is the policy to apply when the queue is full
+        (DROP, COALESCE or BLOCK)."""
+        if overflow not in (DROP, COALESCE, BLOCK):
+            raise ValueError("Unknown overflow policy: {0}".format(overflow))
+        if workers <= 0 or maxsize <= 0:
+            raise ValueError("The dispatcher workers and size must be positive")
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.name = name or "CallbackDispatcher"
+        lock = threading.Lock()
+        self._not_empty = threading.Condition(lock)
+        self._not_full = threading.Condition(lock)
+        self._queue = collections.deque()
+        # Overflowing callbacks waiting to be called once, by coalescing key.
+        self._overflowed = collections.OrderedDict()
+        self._threads = []
+        self._stopping = False
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    def start(self):
+        """Start the worker threads."""
+        if self._threads:
+            raise RuntimeError("The dispatcher is already running")
+        self._reset_stats()
+        self._stopping = False
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name="{0}-{1}".format(self.name, index)
+            )
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop the worker threads, once the queued calls are done."""
+        with self._not_empty:
+            self._stopping = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+        self._threads = []
+
+    def submit(self, callback, key=None):
+        """Queue a call to callback (without arguments). When coalescing,
+        the overflowing calls of the same key (the callback by default) are
+        merged, into a call to the last one submitted."""
+        key = callback if key is None else key
+        with self._not_full:
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == DROP:
+                    self.dropped += 1
+                    return
+                if self.overflow == COALESCE:
+                    if key in self._overflowed:
+                        self._overflowed[key] = callback
+                        self.coalesced += 1
+                    elif len(self._overflowed) >= self.maxsize:
+                        self.dropped += 1
+                    else:
+                        self._overflowed[key] = callback
+                        self._not_empty.notify()
+                    return
+                while len(self._queue) >= self.maxsize and not self._stopping:
+                    self._not_full.wait()
+            self._queue.append(callback)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            self._not_empty.notify()
+
+    def stats(self):
+        """Return the dispatch counters, as a dictionary with:
+            dispatched -- the number of callbacks called;
+            dropped -- the number of calls dropped because the queue was full
+            (and, when coalescing, the overflowing callbacks too many);
+            coalesced -- the number of calls merged because the queue was full;
+            errors -- the number of callbacks which raised an exception;
+            queueDepth -- the number of calls waiting in the queue;
+            maxQueueDepth -- the maximum number of calls waiting in the queue."""
+        return dict(
+            dispatched=self.dispatched,
+            dropped=self.dropped,
+            coalesced=self.coalesced,
+            errors=self.errors,
+            queueDepth=len(self._queue),
+            maxQueueDepth=self.max_depth,
+        )
+
+    def _next(self):
+        """Return the next callback to call, or None when stopped."""
+        with self._not_empty:
+            while True:
+                if self._queue:
+                    self.dispatched += 1
+                    callback = self._queue.popleft()
+                    if self._overflowed:
+                        # Give the room freed to the oldest overflowing call:
+                        # under sustained load, the queue is never empty.
+                        self._queue.append(self._overflowed.popitem(last=False)[1])
+                    else:
+                        self._not_full.notify()
+                    return callback
+                if self._overflowed:
+                    self.dispatched += 1
+                    return self._overflowed.popitem(last=False)[1]
+                if self._stopping:
+                    return None
+                self._not_empty.wait()
+
+    def _run(self):
+        while True:
+            callback = self._next()
+            if callback is None:
+                return
+            try:
+                callback()
+            except Exception:  # pylint: disable=broad-except
+                # Keep the worker alive, as the edge thread would stay alive.
+                with self._not_empty:
+                    self.errors += 1
+                traceback.print_exc()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-capacity ring buffer of pulse timestamps.
+
+Released under MIT License. See LICENSE file.
+"""
+from array import array
+
+__all__ = ["EventBuffer"]
+
+
+class EventBuffer:
+    """Keep the timestamps of the last capacity events, as monotonic
+    nanoseconds, in a preallocated array of 64-bit integers
+    (8 bytes per event whatever the number of events recorded).
+
+    The buffer is not thread-safe by itself: RadiationWatch appends
+    and takes snapshots under its mutex.
+
+    Usage:
+    ```
+    events = EventBuffer(4096)
+    events.append(time.monotonic_ns())
+    for view in events.views(last=100):
+        # Zero-copy views, in chronological order.
+        print(view.tolist())
+    ```
+    """
+
+    def __init__(self, capacity):
+        """Create a buffer keeping the last capacity timestamps."""
+        if capacity <= 0:
+            raise ValueError("The event buffer capacity must be positive")
+        self.capacity = capacity
+        self._timestamps = array("q", bytes(8 * capacity))
+        self._view = memoryview(self._timestamps)
+        # Number of events appended since the buffer creation (or clearing).
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, timestamp):
+        """Record an event timestamp, overwriting the oldest one
+        if the buffer is full."""
+        self._timestamps[self.total % self.capacity] = timestamp
+        self.total += 1
+
+    def extend(self, timestamps):
+        """Record a batch of event timestamps (a sequence of integers), with
+        at most two slice copies into the buffer."""
+        count = len(timestamps)
+        timestamps = memoryview(array("q", timestamps[-self.capacity:]))
+        # Only the last capacity timestamps are kept.
+        start = (self.total + count - len(timestamps)) % self.capacity
+        head = min(len(timestamps), self.capacity - start)
+        self._view[start:start + head] = timestamps[:head]
+        self._view[:len(timestamps) - head] = timestamps[head:]
+        self.total += count
+
+    def clear(self):
+        """Forget all the recorded events."""
+        self.total = 0
+
+    def views(self, last=None):
+        """Return the last (by default all) recorded timestamps, as a list of
+        one or two memoryviews over the buffer, in chronological order.
+
+        The views share memory with the buffer (no copy): they are only
+        valid until the events they cover get overwritten by newer ones.
+        They support the buffer protocol, e.g. for
+        numpy.frombuffer(view, dtype=numpy.int64)."""
+        size = len(self) if last is None else max(0, min(last, len(self)))
+        end = self.total % self.capacity
+        start = end - size
+        if start >= 0:
+            return [self._view[start:end]] if size else []
+        if end == 0:
+            return [self._view[start + self.capacity:]]
+        return [self._view[start + self.capacity:], self._view[:end]]
+
+    def to_array(self, last=None):
+        """Return a copy of the last (by default all) recorded timestamps,
+        as an array('q'), in chronological order."""
+        timestamps = array("q")
+        for view in self.views(last):
+            timestamps.frombytes(view.cast("B"))
+        return timestamps
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregate the readings of a fleet of Pocket Geigers: each node sends
+batches of readings to a FleetAggregator over a TCP or Unix socket (for
+instance with a FleetSink, through a SinkPipeline), and the aggregator
+answers fleet-wide queries: hottest nodes, regional rollups, stale nodes.
+
+Wire protocol: a stream of frames, each one made of a FRAME_HEADER (frame
+type, payload length) followed by the payload. A node first sends a
+FRAME_HELLO frame (HELLO_PAYLOAD, then its UTF-8 name and region), then
+FRAME_READINGS frames of READING_PAYLOAD records, each acknowledged by a
+FRAME_ACK frame once stored. A gateway can send the readings of several
+nodes on one connection, with a FRAME_HELLO frame before each node ones.
+
+The readings are kept in NumPy arrays (pip install PiPocketGeiger[fleet]):
+a ring of the last depth readings of each node, column by column, so the
+queries are vectorized over the whole fleet.
+
+Released under MIT License. See LICENSE file.
+"""
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from PiPocketGeiger.daemon import FRAME_HEADER, SocketServer, read_frames
+from PiPocketGeiger.sinks import UploadError
+
+__all__ = ["FleetAggregator", "FleetSink", "hello_frame", "readings_frame"]
+
+FRAME_HELLO = 1
+FRAME_READINGS = 2
+FRAME_ACK = 3
+# Latitude, longitude (NaN when unknown), name and region lengths.
+HELLO_PAYLOAD = struct.Struct("<ddBB")
+# Time (epoch seconds), duration, cpm, uSvh, uSvhError,
+# total radiation and noise pulses.
+READING_PAYLOAD = struct.Struct("<dddddQQ")
+# Number of readings stored.
+ACK_PAYLOAD = struct.Struct("<I")
+READING_FIELDS = ("time", "duration", "cpm", "uSvh", "uSvhError", "radiationTotal", "noiseTotal")
+MAX_READINGS_BY_FRAME = 0xFFFF // READING_PAYLOAD.size
+
+# Readings kept by node: an hour of readings taken every minute.
+DEFAULT_DEPTH = 60
+
+
+def _numpy():
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    return numpy
+
+
+def _reading_dtype():
+    numpy = _numpy()
+    return numpy.dtype([(field, "<f8") for field in READING_FIELDS[:5]]
+                       + [(field, "<u8") for field in READING_FIELDS[5:]])
+
+
+def hello_frame(name, latitude=None, longitude=None, region=""):
+    """Return the frame introducing the node name, located at latitude and
+    longitude (degrees), in the region (any label)."""
+    name, region = name.encode("utf-8"), (region or "").encode("utf-8")
+    if not 0 < len(name) < 256 or len(region) >= 256:
+        raise ValueError("The node name and region must be 1 to 255 bytes long")
+    payload = HELLO_PAYLOAD.pack(
+        float("nan") if latitude is None else latitude,
+        float("nan") if longitude is None else longitude,
+        len(name), len(region),
+    ) + name + region
+    return FRAME_HEADER.pack(FRAME_HELLO, len(payload)) + payload
+
+
+def readings_frame(readings):
+    """Return the frames of the readings (up to MAX_READINGS_BY_FRAME by
+    frame): dictionaries with the status() fields and the time (epoch
+    seconds), and optionally the radiationTotal and noiseTotal counters."""
+    frames = []
+    for start in range(0, len(readings), MAX_READINGS_BY_FRAME):
+        batch = readings[start:start + MAX_READINGS_BY_FRAME]
+        frames.append(FRAME_HEADER.pack(FRAME_READINGS, len(batch) * READING_PAYLOAD.size))
+        frames.extend(
+            READING_PAYLOAD.pack(*(reading.get(field, 0) for field in READING_FIELDS))
+            for reading in batch
+        )
+    return b"".join(frames)
+
+
+class _Connection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.input = bytearray()
+        self.output = bytearray()
+        self.node = None
+
+
+class FleetAggregator(SocketServer):
+    """Receive the readings of many nodes, on a Unix socket (address is a
+    path) or a TCP socket (address is a (host, port) tuple), and answer
+    fleet-wide queries.
+
+    Usage:
+    ```
+    aggregator = FleetAggregator(("0.0.0.0", 9812))
+    aggregator.start()
+    while 1:
+        time.sleep(60)
+        print(aggregator.top(10), aggregator.regions(cell=1.0), aggregator.stale(300))
+    ```
+    """
+
+    def __init__(self, address=None, depth=DEFAULT_DEPTH, capacity=1024):
+        """Create an aggregator keeping the last depth readings of each node,
+        with room for capacity nodes to start with (it grows as needed).
+        Without address, the readings can only be given to ingest()."""
+        super().__init__("FleetAggregator")
+        numpy = _numpy()
+        self.address = address
+        self.depth = depth
+        self._lock = threading.Lock()
+        self._names = []
+        self._rows = {}
+        self._regions = [""]
+        self._region_codes_by_label = {"": 0}
+        # Columns of the readings, one row by node.
+        self._times = numpy.full((0, depth), numpy.nan)
+        self._durations = numpy.zeros((0, depth))
+        self._cpm = numpy.zeros((0, depth))
+        self._usvh = numpy.zeros((0, depth))
+        self._usvh_errors = numpy.zeros((0, depth))
+        # Columns of the nodes.
+        self._heads = numpy.zeros(0, dtype=numpy.int64)
+        self._lengths = numpy.zeros(0, dtype=numpy.int64)
+        self._last_seen = numpy.zeros(0)
+        self._latitudes = numpy.zeros(0)
+        self._longitudes = numpy.zeros(0)
+        self._region_codes = numpy.zeros(0, dtype=numpy.int64)
+        self._radiation_totals = numpy.zeros(0, dtype=numpy.uint64)
+        self._noise_totals = numpy.zeros(0, dtype=numpy.uint64)
+        self._grow(capacity)
+        self._connections = {}
+        self.readings = 0
+        self.frames = 0
+        self.malformed_frames = 0
+
+    def _grow(self, capacity):
+        numpy = _numpy()
+        added = capacity - len(self._heads)
+        if added <= 0:
+            return
+
+        def extend(column, value):
+            padding = numpy.full((added,) + column.shape[1:], value, dtype=column.dtype)
+            return numpy.concatenate([column, padding])
+
+        self._times = extend(self._times, numpy.nan)
+        self._durations = extend(self._durations, 0)
+        self._cpm = extend(self._cpm, 0)
+        self._usvh = extend(self._usvh, 0)
+        self._usvh_errors = extend(self._usvh_errors, 0)
+        self._heads = extend(self._heads, 0)
+        self._lengths = extend(self._lengths, 0)
+        self._last_seen = extend(self._last_seen, numpy.nan)
+        self._latitudes = extend(self._latitudes, numpy.nan)
+        self._longitudes = extend(self._longitudes, numpy.nan)
+        self._region_codes = extend(self._region_codes, 0)
+        self._radiation_totals = extend(self._radiation_totals, 0)
+        self._noise_totals = extend(self._noise_totals, 0)
+
+    def register(self, name, latitude=None, longitude=None, region=""):
+        """Add the node name (or update its location), and return its row."""
+        numpy = _numpy()
+        with self._lock:
+            row = self._rows.get(name)
+            if row is None:
+                row = len(self._names)
+                if row >= len(self._heads):
+                    self._grow(max(1, 2 * len(self._heads)))
+                self._names.append(name)
+                self._rows[name] = row
+            code = self._region_codes_by_label.get(region or "")
+            if code is None:
+                code = self._region_codes_by_label[region] = len(self._regions)
+                self._regions.append(region)
+            self._latitudes[row] = numpy.nan if latitude is None else latitude
+            self._longitudes[row] = numpy.nan if longitude is None else longitude
+            self._region_codes[row] = code
+        return row
+
+    def ingest(self, name, readings):
+        """Store the readings of the node name: dictionaries (see
+        readings_frame()), or a NumPy array of READING_PAYLOAD records."""
+        numpy = _numpy()
+        if not isinstance(readings, numpy.ndarray):
+            readings = numpy.array(
+                [tuple(reading.get(field, 0) for field in READING_FIELDS)
+                 for reading in readings],
+                dtype=_reading_dtype(),
+            )
+        row = self._rows.get(name)
+        if row is None:
+            row = self.register(name)
+        self._store(row, readings)
+
+    def _store(self, row, readings):
+        numpy = _numpy()
+        count = len(readings)
+        if not count:
+            return
+        kept = readings[-self.depth:]
+        with self._lock:
+            positions = (self._heads[row] + numpy.arange(len(kept))) % self.depth
+            self._times[row, positions] = kept["time"]
+            self._durations[row, positions] = kept["duration"]
+            self._cpm[row, positions] = kept["cpm"]
+            self._usvh[row, positions] = kept["uSvh"]
+            self._usvh_errors[row, positions] = kept["uSvhError"]
+            self._heads[row] = (self._heads[row] + len(kept)) % self.depth
+            self._lengths[row] = min(self.depth, self._lengths[row] + len(kept))
+            self._last_seen[row] = time.time()
+            self._radiation_totals[row] = kept["radiationTotal"][-1]
+            self._noise_totals[row] = kept["noiseTotal"][-1]
+            self.readings += count
+
+    def __len__(self):
+        return len(self._names)
+
+    def _values(self, count, window, now):
+        """Return the uSvh of each of the count first nodes: the last one,
+        or the mean over the readings of the last window seconds (NaN when
+        there is none)."""
+        numpy = _numpy()
+        if window is None:
+            last = (self._heads[:count] - 1) % self.depth
+            values = self._usvh[numpy.arange(count), last]
+            return numpy.where(self._lengths[:count] > 0, values, numpy.nan)
+        recent = self._times[:count] >= (time.time() if now is None else now) - window
+        readings = recent.sum(axis=1)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(recent, self._usvh[:count], 0.0).sum(axis=1) / readings
+
+    def _node(self, row, value):
+        numpy = _numpy()
+        latitude, longitude = self._latitudes[row], self._longitudes[row]
+        return dict(
+            name=self._names[row],
+            uSvh=round(float(value), 3),
+            region=self._regions[self._region_codes[row]],
+            latitude=None if numpy.isnan(latitude) else float(latitude),
+            longitude=None if numpy.isnan(longitude) else float(longitude),
+        )
+
+    def top(self, n=10, window=None, now=None):
+        """Return the n hottest nodes, hottest first: by last uSvh, or by
+        mean uSvh over the last window seconds (before now, epoch seconds)."""
+        numpy = _numpy()
+        with self._lock:
+            values = self._values(len(self._names), window, now)
+            rows = numpy.flatnonzero(~numpy.isnan(values))
+            if len(rows) > n:
+                rows = rows[numpy.argpartition(-values[rows], n - 1)[:n]]
+            rows = rows[numpy.argsort(-values[rows], kind="stable")]
+            return [self._node(row, values[row]) for row in rows]
+
+    def regions(self, cell=None, window=None, now=None):
+        """Return the rollups of the nodes by region label, or without label
+        by cells of cell x cell degrees of latitude and longitude: for each
+        one, its label (or south-west corner), number of nodes (reporting)
+        and their mean and max uSvh, and its hottest node. See top() for
+        window. Nodes without readings (or location for cells) are left out."""
+        numpy = _numpy()
+        with self._lock:
+            count = len(self._names)
+            values = self._values(count, window, now)
+            valid = ~numpy.isnan(values)
+            if cell is None:
+                keys = self._region_codes[:count]
+            else:
+                latitudes = numpy.floor(self._latitudes[:count] / cell)
+                longitudes = numpy.floor(self._longitudes[:count] / cell)
+                valid &= ~numpy.isnan(latitudes) & ~numpy.isnan(longitudes)
+                # One integer key by cell: longitudes span less than 2^20 cells.
+                keys = numpy.zeros(count, dtype=numpy.int64)
+                keys[valid] = (latitudes[valid].astype(numpy.int64) << 20) + (
+                    longitudes[valid].astype(numpy.int64) + (1 << 19)
+                )
+            rows = numpy.flatnonzero(valid)
+            if not len(rows):
+                return []
+            # Sort by key then value: the last row of each key is its hottest.
+            rows = rows[numpy.lexsort((values[rows], keys[rows]))]
+            groups, starts, nodes = numpy.unique(
+                keys[rows], return_index=True, return_counts=True
+            )
+            sums = numpy.add.reduceat(values[rows], starts)
+            hottest = rows[starts + nodes - 1]
+            rollups = []
+            for index, key in enumerate(groups):
+                if cell is None:
+                    rollup = dict(region=self._regions[key])
+                else:
+                    rollup = dict(latitude=float((key >> 20) * cell),
+                                  longitude=float(((key & 0xFFFFF) - (1 << 19)) * cell))
+                rollup.update(
+                    nodes=int(nodes[index]),
+                    meanUSvh=round(float(sums[index] / nodes[index]), 3),
+                    maxUSvh=round(float(values[hottest[index]]), 3),
+                    hottest=self._names[hottest[index]],
+                )
+                rollups.append(rollup)
+            return rollups
+
+    def stale(self, max_age, now=None):
+        """Return the nodes not heard from in the last max_age seconds (before
+        now, epoch seconds), oldest first, as dictionaries with their name
+        and age (None when they never sent readings)."""
+        numpy = _numpy()
+        with self._lock:
+            count = len(self._names)
+            ages = (time.time() if now is None else now) - self._last_seen[:count]
+            never = numpy.isnan(ages)
+            rows = numpy.flatnonzero(never | (ages > max_age))
+            # Oldest first, the nodes never heard from before all the others.
+            rows = rows[numpy.argsort(numpy.where(never[rows], -numpy.inf, -ages[rows]),
+                                      kind="stable")]
+            return [
+                dict(name=self._names[row],
+                     age=None if never[row] else round(float(ages[row]), 3))
+                for row in rows
+            ]
+
+    def node(self, name):
+        """Return the readings kept of the node name, oldest first."""
+        numpy = _numpy()
+        with self._lock:
+            row = self._rows[name]
+            length = self._lengths[row]
+            positions = (self._heads[row] - length + numpy.arange(length)) % self.depth
+            return [
+                dict(time=float(self._times[row, position]),
+                     duration=float(self._durations[row, position]),
+                     cpm=float(self._cpm[row, position]),
+                     uSvh=float(self._usvh[row, position]),
+                     uSvhError=float(self._usvh_errors[row, position]))
+                for position in positions
+            ]
+
+    def totals(self, name):
+        """Return the last total radiation and noise pulses sent by the node."""
+        row = self._rows[name]
+        return dict(radiationTotal=int(self._radiation_totals[row]),
+                    noiseTotal=int(self._noise_totals[row]))
+
+    def stats(self):
+        """Return the aggregator counters, as a dictionary with:
+            nodes -- the number of nodes known;
+            connections -- the number of connected nodes (or gateways);
+            readings -- the number of readings received;
+            frames -- the number of frames received;
+            malformedFrames -- the number of invalid frames received (their
+            connection is closed)."""
+        return dict(nodes=len(self._names), connections=len(self._connections),
+                    readings=self.readings, frames=self.frames,
+                    malformedFrames=self.malformed_frames)
+
+    def start(self):
+        """Start receiving readings, from a background thread."""
+        self.address = self._listen(self.address)
+
+    def stop(self):
+        """Stop receiving readings and disconnect all the nodes."""
+        self._stop()
+
+    def _on_event(self, key, events):
+        if events & selectors.EVENT_READ and not self._receive(key.data):
+            self._disconnect(key.data)
+        elif events & selectors.EVENT_WRITE:
+            self._flush(key.data)
+
+    def _disconnect_all(self):
+        for connection in list(self._connections.values()):
+            self._disconnect(connection)
+
+    def _on_connect(self, connection):
+        state = _Connection(connection)
+        self._connections[connection] = state
+        self._selector.register(connection, selectors.EVENT_READ, state)
+
+    def _receive(self, state):
+        """Return False when the node hung up or sent an invalid frame."""
+        try:
+            data = state.connection.recv(1 << 16)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+        if not data:
+            return False
+        state.input += data
+        for frame_type, start, end in read_frames(state.input):
+            self.frames += 1
+            if not self._on_frame(state, frame_type, state.input[start:end]):
+                self.malformed_frames += 1
+                return False
+        if state.output:
+            self._flush(state)
+        return True
+
+    def _on_frame(self, state, frame_type, payload):
+        """Return False for an invalid frame."""
+        numpy = _numpy()
+        if frame_type == FRAME_HELLO:
+            if len(payload) < HELLO_PAYLOAD.size:
+                return False
+            latitude, longitude, name_length, region_length = HELLO_PAYLOAD.unpack_from(payload)
+            strings = payload[HELLO_PAYLOAD.size:]
+            if len(strings) != name_length + region_length or not name_length:
+                return False
+            try:
+                name = strings[:name_length].decode("utf-8")
+                region = strings[name_length:].decode("utf-8")
+            except UnicodeDecodeError:
+                return False
+            state.node = self.register(
+                name,
+                None if numpy.isnan(latitude) else latitude,
+                None if numpy.isnan(longitude) else longitude,
+                region,
+            )
+        elif frame_type == FRAME_READINGS:
+            if state.node is None or len(payload) % READING_PAYLOAD.size:
+                return False
+            readings = numpy.frombuffer(bytes(payload), dtype=_reading_dtype())
+            self._store(state.node, readings)
+            state.output += FRAME_HEADER.pack(FRAME_ACK, ACK_PAYLOAD.size)
+            state.output += ACK_PAYLOAD.pack(len(readings))
+        # Ignore unknown frames, for forward compatibility.
+        return True
+
+    def _flush(self, state):
+        try:
+            sent = state.connection.send(state.output)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            return
+        del state.output[:sent]
+        # Wait for the socket to be writable again if we could not send it all.
+        self._selector.modify(
+            state.connection,
+            selectors.EVENT_READ | (selectors.EVENT_WRITE if state.output else 0),
+            state,
+        )
+
+    def _disconnect(self, state):
+        self._connections.pop(state.connection, None)
+        try:
+            self._selector.unregister(state.connection)
+        except (KeyError, ValueError):
+            pass
+        state.connection.close()
+
+
+class FleetSink:
+    """Send batches of readings of a node to a FleetAggregator, over a
+    persistent connection, waiting for them to be stored. To use with a
+    SinkPipeline, for reliable reporting.
+
+    Usage:
+    ```
+    sink = FleetSink(("aggregator.local", 9812), "rooftop", latitude=35.68, longitude=139.69)
+    with RadiationWatch(24, 23) as radiationWatch:
+        pipeline = SinkPipeline(radiationWatch, Spool("/var/spool/geiger"), sink, period=60)
+        pipeline.start()
+    ```
+    """
+
+    def __init__(self, address, name, latitude=None, longitude=None, region="", timeout=30):
+        """Create a sink sending the readings of the node name to the
+        aggregator at address: a Unix socket path or a (host, port) tuple."""
+        self.address = address
+        self.hello = hello_frame(name, latitude, longitude, region)
+        self.timeout = timeout
+        self._socket = None
+
+    def _connect(self):
+        if isinstance(self.address, str):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(self.address)
+        else:
+            connection = socket.create_connection(self.address, timeout=self.timeout)
+        connection.sendall(self.hello)
+        return connection
+
+    def send(self, readings):
+        """Send a batch of readings (see readings_frame()), and wait for
+        their acknowledgement. Raise OSError on failure: UploadError when
+        the first readings were acknowledged, so they are not sent again."""
+        if self._socket is None:
+            self._socket = self._connect()
+        acknowledged = 0
+        try:
+            self._socket.sendall(readings_frame(readings))
+            buffer = bytearray()
+            while acknowledged < len(readings):
+                data = self._socket.recv(4096)
+                if not data:
+                    raise ConnectionResetError("The aggregator closed the connection")
+                buffer += data
+                for frame_type, start, _ in read_frames(buffer):
+                    if frame_type == FRAME_ACK:
+                        acknowledged += ACK_PAYLOAD.unpack_from(buffer, start)[0]
+        except OSError as error:
+            self.close()
+            if acknowledged:
+                raise UploadError(str(error), sent=acknowledged) from error
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
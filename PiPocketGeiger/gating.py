@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Veto the radiation pulses close to noise edges, instead of discarding
+whole processing periods.
+
+Released under MIT License. See LICENSE file.
+"""
+import collections
+
+__all__ = ["NoiseGate"]
+
+
+class NoiseGate:
+    """Discard only the radiation pulses within dead_window seconds of a
+    noise edge, and only the time covered by these dead windows.
+
+    By default RadiationWatch discards all the counts and all the time of
+    a processing period (160 ms) as soon as a single noise edge occurs in
+    it. With frequent vibrations (vehicles, machines...) this wastes most
+    of the measurement time. The gate uses the edges timestamps instead.
+
+    The gate gets the edges as a pulse listener of RadiationWatch. As a
+    noise edge vetoes the pulses up to dead_window seconds before it, the
+    pulses are only settled dead_window seconds after they happened.
+
+    Usage:
+    ```
+    with RadiationWatch(24, 23, noise_gate=NoiseGate(dead_window=0.05)) as radiationWatch:
+        print(radiationWatch.status(), radiationWatch.live_time())
+    ```
+    """
+
+    def __init__(self, dead_window=0.05):
+        """Create a gate vetoing the pulses within dead_window seconds
+        (before or after) of each noise edge."""
+        if dead_window <= 0:
+            raise ValueError("The dead window must be positive")
+        self.dead_window = dead_window
+        self._window = int(dead_window * 1e9)
+        # Edges pushed by the edge thread (deque appends and pops are thread-safe).
+        self._incoming_radiation = collections.deque()
+        self._incoming_noise = collections.deque()
+        self.reset(0)
+
+    def reset(self, now):
+        """Forget all the edges, and start settling from now
+        (monotonic clock, in ns)."""
+        self._incoming_radiation.clear()
+        self._incoming_noise.clear()
+        self._radiation = collections.deque()
+        self._noise = collections.deque()
+        self.settled = now
+        self.accepted = 0
+        self.vetoed = 0
+        self.vetoed_time = 0
+        # Live time settled but not returned yet: less than a millisecond, in ns.
+        self._live_remainder = 0
+
+    def push(self, kind, timestamp):
+        # Called from the GPIO edge thread.
+        if kind == "radiation":
+            self._incoming_radiation.append(timestamp)
+        else:
+            self._incoming_noise.append(timestamp)
+
+    def close(self):
+        pass
+
+    def process(self, now):
+        """Settle the pulses up to dead_window before now (monotonic clock,
+        in ns). Return the number of pulses accepted, and the live time
+        (not covered by any dead window) settled, in whole milliseconds:
+        the remainder is returned with the next calls."""
+        window = self._window
+        for incoming, settling in (
+            (self._incoming_radiation, self._radiation),
+            (self._incoming_noise, self._noise),
+        ):
+            while incoming:
+                settling.append(incoming.popleft())
+        start, until = self.settled, now - window
+        if until <= start:
+            return 0, 0
+        # Time covered by the dead windows, in [start, until).
+        vetoed_time = 0
+        covered = start
+        for noise in self._noise:
+            if noise - window >= until:
+                break
+            low, high = max(noise - window, covered), min(noise + window, until)
+            if high > low:
+                vetoed_time += high - low
+                covered = high
+        # Pulses in [start, until), vetoed if within a dead window.
+        accepted = 0
+        radiation, noise = self._radiation, self._noise
+        while radiation and radiation[0] < until:
+            timestamp = radiation.popleft()
+            while noise and noise[0] + window <= timestamp:
+                noise.popleft()
+            if noise and noise[0] - window < timestamp:
+                self.vetoed += 1
+            else:
+                accepted += 1
+        # Forget the noise edges which can't veto anything anymore.
+        while noise and noise[0] + window <= until:
+            noise.popleft()
+        self.settled = until
+        self.accepted += accepted
+        self.vetoed_time += vetoed_time
+        live_time, self._live_remainder = divmod(
+            until - start - vetoed_time + self._live_remainder, 1000000
+        )
+        return accepted, live_time
+
+    def stats(self):
+        """Return the gate counters, as a dictionary with:
+            accepted -- the number of radiation pulses accepted;
+            vetoed -- the number of radiation pulses vetoed;
+            vetoedTime -- the time covered by dead windows, in seconds."""
+        return dict(
+            accepted=self.accepted,
+            vetoed=self.vetoed,
+            vetoedTime=round(self.vetoed_time / 1e9, 3),
+        )
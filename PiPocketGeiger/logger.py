@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Log the readings to rotating, compressed segment files.
+
+Released under MIT License. See LICENSE file.
+"""
+import gzip
+import os
+import shutil
+import struct
+import threading
+import time
+
+from PiPocketGeiger.scheduler import PeriodicScheduler
+
+__all__ = ["MeasurementLogger", "read_measurements", "MEASUREMENT_RECORD", "CSV", "BINARY"]
+
+# Segment formats.
+CSV = "csv"
+BINARY = "bin"
+CSV_HEADER = b"time,duration,cpm,uSvh,uSvhError\n"
+# Binary segment header: magic, version.
+BINARY_HEADER = struct.Struct("<4sH")
+MAGIC = b"PGM1"
+VERSION = 1
+# Binary record: wall clock (ms), duration (s), cpm, uSv/h, uSv/h error.
+MEASUREMENT_RECORD = struct.Struct("<qdfff")
+# Size of the disk pages, to estimate the pages rewritten by each write.
+PAGE_SIZE = 4096
+
+
+def _zstd():
+    """Return a module with the zstd compress() and open() functions,
+    or None if zstd is not available."""
+    # pylint: disable=import-outside-toplevel
+    try:
+        from compression import zstd  # Python 3.14 and later.
+
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def _open_compressed(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".zst"):
+        zstd = _zstd()
+        if zstd is None:
+            raise RuntimeError("Reading zstd segments needs zstd (pip install zstandard)")
+        return zstd.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_measurements(path):
+    """Yield the (wall clock ms, duration, cpm, uSvh, uSvhError) records
+    of a binary segment, compressed or not."""
+    with _open_compressed(path) as segment:
+        data = segment.read()
+    magic, version = BINARY_HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a measurement segment: {0}".format(path))
+    data = memoryview(data)[BINARY_HEADER.size:]
+    # Ignore a truncated last record (power failure while writing).
+    end = len(data) - len(data) % MEASUREMENT_RECORD.size
+    yield from MEASUREMENT_RECORD.iter_unpack(data[:end])
+
+
+class MeasurementLogger:
+    """Log a reading every period seconds to segment files of a directory,
+    as CSV or as fixed-width binary records (MEASUREMENT_RECORD, 28 bytes).
+
+    The records are buffered in memory and only written every flush_period
+    seconds (and synced to the disk if fsync is true), to spare the SD card:
+    up to flush_period seconds of readings can be lost on a power failure.
+    A new segment is started once the current one reaches max_bytes, or
+    is max_age seconds old. The closed segments are compressed ("gzip",
+    "zstd" or None), and only the last keep closed ones are kept, besides
+    the current one (all by default).
+
+    Usage:
+    ```
+    with RadiationWatch(24, 23) as radiationWatch:
+        logger = MeasurementLogger(radiationWatch, "/var/log/geiger", period=30)
+        logger.start()
+        # ...
+        logger.stop()
+    ```
+    """
+
+    def __init__(self, radiation_watch, directory, period=30, format=CSV,
+                 max_bytes=1024 * 1024, max_age=86400, compression="gzip",
+                 flush_period=300, fsync=False, keep=None):
+        """Create a logger of the radiation_watch readings (None to only
+        log the readings given to log()) in directory."""
+        # pylint: disable=redefined-builtin
+        if format not in (CSV, BINARY):
+            raise ValueError("Unknown format: {0}".format(format))
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression: {0}".format(compression))
+        if compression == "zstd" and _zstd() is None:
+            raise RuntimeError("zstd compression needs zstd (pip install zstandard)")
+        self.radiation_watch = radiation_watch
+        self.directory = directory
+        self.format = format
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compression = compression
+        self.flush_period = flush_period
+        self.fsync = fsync
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._file = None
+        self._opened_at = None
+        self._last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(self._list_segments())
+        self.scheduler = PeriodicScheduler(period, self._sample, name="MeasurementLogger")
+        self.records = 0
+        self.payload_bytes = 0
+        self.bytes_written = 0
+        self.pages_written = 0
+        self.flushes = 0
+        self.syncs = 0
+        self.compressed_bytes = 0
+
+    def _list_segments(self):
+        for name in os.listdir(self.directory):
+            segment, _, extension = name.partition(".")
+            if (
+                segment.isdigit()
+                and extension.startswith(self.format)
+                and not extension.endswith(".tmp")
+            ):
+                yield int(segment), name
+
+    def _segment_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def start(self):
+        """Start logging the readings every period."""
+        self.scheduler.start()
+
+    def stop(self):
+        """Stop logging, and flush and close the current segment."""
+        self.scheduler.stop()
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def stats(self):
+        """Return the logger counters, as a dictionary with:
+            records -- the number of readings logged;
+            payloadBytes -- the size of the records;
+            bytesWritten -- the bytes written to the segments (with headers);
+            pagesWritten -- the disk pages rewritten by the writes;
+            writeAmplification -- the bytes of the pages rewritten by
+            payload byte, for the uncompressed segments;
+            flushes, syncs -- the number of writes, and of fsync calls;
+            segments -- the number of segments kept;
+            compressedBytes -- the size of the compressed segments."""
+        return dict(
+            records=self.records,
+            payloadBytes=self.payload_bytes,
+            bytesWritten=self.bytes_written,
+            pagesWritten=self.pages_written,
+            writeAmplification=round(
+                self.pages_written * PAGE_SIZE / self.payload_bytes, 2
+            ) if self.payload_bytes else 0,
+            flushes=self.flushes,
+            syncs=self.syncs,
+            segments=len(self.segments),
+            compressedBytes=self.compressed_bytes,
+        )
+
+    def log(self, status, timestamp=None):
+        """Log a reading (see RadiationWatch.status()), taken at timestamp
+        (wall clock, in seconds, now by default)."""
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.format == CSV:
+            record = "{0:.3f},{1},{2},{3},{4}\n".format(
+                timestamp, status["duration"], status["cpm"], status["uSvh"],
+                status["uSvhError"],
+            ).encode("ascii")
+        else:
+            record = MEASUREMENT_RECORD.pack(
+                int(round(timestamp * 1000)), status["duration"], status["cpm"],
+                status["uSvh"], status["uSvhError"],
+            )
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._buffer += record
+            self.records += 1
+            self.payload_bytes += len(record)
+            position = self._file.tell() + len(self._buffer)
+            if position >= self.max_bytes or time.monotonic() - self._opened_at >= self.max_age:
+                self._close_segment()
+            elif time.monotonic() - self._last_flush >= self.flush_period:
+                self._flush()
+
+    def flush(self):
+        """Write the buffered records now."""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Flush and close the current segment (it is not compressed:
+        logging resumes in it)."""
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+                self._file.close()
+                self._file = None
+
+    def _sample(self):
+        self.log(self.radiation_watch.status())
+
+    def _open_segment(self):
+        # Resume the last segment if it was not compressed.
+        last = self.segments[-1] if self.segments else None
+        if last is not None and last[1].endswith(self.format):
+            self._file = open(self._segment_path(last[1]), "ab")
+        else:
+            number = last[0] + 1 if last is not None else 0
+            name = "{0:010d}.{1}".format(number, self.format)
+            self.segments.append((number, name))
+            self._file = open(self._segment_path(name), "ab")
+        if self._file.tell() == 0:
+            self._buffer[:0] = (
+                CSV_HEADER if self.format == CSV else BINARY_HEADER.pack(MAGIC, VERSION)
+            )
+        self._opened_at = time.monotonic()
+
+    def _flush(self):
+        if self._buffer:
+            offset = self._file.tell()
+            self._file.write(self._buffer)
+            self._file.flush()
+            self.bytes_written += len(self._buffer)
+            self.pages_written += (
+                (offset + len(self._buffer) - 1) // PAGE_SIZE - offset // PAGE_SIZE + 1
+            )
+            self.flushes += 1
+            self._buffer = bytearray()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+                self.syncs += 1
+        self._last_flush = time.monotonic()
+
+    def _close_segment(self):
+        self._flush()
+        self._file.close()
+        self._file = None
+        number, name = self.segments[-1]
+        if self.compression is not None:
+            compressed = name + COMPRESSIONS[self.compression]
+            self._compress(self._segment_path(name), self._segment_path(compressed))
+            os.remove(self._segment_path(name))
+            self.segments[-1] = (number, compressed)
+            self.compressed_bytes += os.path.getsize(self._segment_path(compressed))
+        # Keep the last keep closed segments.
+        if self.keep is not None:
+            while len(self.segments) > self.keep:
+                os.remove(self._segment_path(self.segments.pop(0)[1]))
+        # The next segment is created on the next record.
+        self.segments.append((number + 1, "{0:010d}.{1}".format(number + 1, self.format)))
+
+    def _compress(self, path, compressed_path):
+        temporary_path = compressed_path + ".tmp"
+        with open(path, "rb") as source:
+            if self.compression == "gzip":
+                with gzip.open(temporary_path, "wb") as destination:
+                    shutil.copyfileobj(source, destination)
+            else:
+                with _zstd().open(temporary_path, "wb") as destination:
+                    shutil.copyfileobj(source, destination)
+        if self.fsync:
+            with open(temporary_path, "rb") as compressed:
+                os.fsync(compressed.fileno())
+        os.replace(temporary_path, compressed_path)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+Run several Pocket Geigers together, with fused readings and
+coincidence counting.
+
+Released under MIT License. See LICENSE file.
+"""
+import collections
+import functools
+import heapq
+import math
+import time
+
+from PiPocketGeiger import RadiationWatch, RPiGPIOBackend, PROCESS_PERIOD
+from PiPocketGeiger.scheduler import PeriodicScheduler
+
+__all__ = ["SensorManager", "CoincidenceCounter"]
+
+
+def _chi2_survival(statistic, dof):
+    """Return the probability for a chi-square variable with dof degrees
+    of freedom to exceed statistic (upper regularized gamma function)."""
+    if statistic <= 0:
+        return 1.0
+    a, x = dof / 2.0, statistic / 2.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # Series of the lower function.
+        term = total = 1.0 / a
+        denominator = a
+        while abs(term) > abs(total) * 1e-15:
+            denominator += 1
+            term *= x / denominator
+            total += term
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # Continued fraction of the upper function (modified Lentz).
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    fraction = d
+    for index in range(1, 1000):
+        an = -index * (index - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        fraction *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return fraction * math.exp(log_prefix)
+
+
+class _SensorPulses:
+    """Pulse listener keeping the radiation pulses of a sensor."""
+
+    def __init__(self):
+        self.timestamps = collections.deque()
+
+    def push(self, kind, timestamp):
+        # Called from the GPIO edge thread.
+        if kind == "radiation":
+            self.timestamps.append(timestamp)
+
+    def close(self):
+        pass
+
+
+class CoincidenceCounter:
+    """Count the radiation pulses detected by several sensors within
+    window seconds of each other.
+
+    The pulses are grouped in clusters: a cluster starts at a pulse, and
+    includes the pulses of the next window seconds. A cluster with pulses
+    from at least two sensors is a coincidence, counted once in total and
+    once for each pair of sensors in it. Independent sensors still have
+    accidental coincidences, 2 * window * rate1 * rate2 per second for a
+    pair: see expected_accidental().
+    """
+
+    def __init__(self, names, window=0.001):
+        """Create a counter of the coincidences between the named sensors."""
+        if window <= 0:
+            raise ValueError("The coincidence window must be positive")
+        self.window = window
+        self._window = int(window * 1e9)
+        self.listeners = {name: _SensorPulses() for name in names}
+        self.reset()
+
+    def reset(self):
+        for listener in self.listeners.values():
+            listener.timestamps.clear()
+        self._pending = {name: [] for name in self.listeners}
+        self.total = 0
+        self.pairs = collections.Counter()
+        self.pulses = collections.Counter()
+
+    def process(self, now):
+        """Count the coincidences of the clusters starting a window before
+        now (monotonic clock, in ns), at least."""
+        until = now - self._window
+        # Take the pulses pushed so far: popleft() and append() are atomic.
+        for name, listener in self.listeners.items():
+            timestamps, pending = listener.timestamps, self._pending[name]
+            for _ in range(len(timestamps)):
+                pending.append(timestamps.popleft())
+        events = list(heapq.merge(
+            *([(timestamp, name) for timestamp in pending]
+              for name, pending in self._pending.items())
+        ))
+        consumed = collections.Counter()
+        index = 0
+        while index < len(events) and events[index][0] < until:
+            end = events[index][0] + self._window
+            cluster = index
+            while cluster < len(events) and events[cluster][0] <= end:
+                cluster += 1
+            names = sorted({name for _, name in events[index:cluster]})
+            for _, name in events[index:cluster]:
+                consumed[name] += 1
+            if len(names) > 1:
+                self.total += 1
+                for first, name in enumerate(names):
+                    for second in names[first + 1:]:
+                        self.pairs[name, second] += 1
+            index = cluster
+        for name, count in consumed.items():
+            del self._pending[name][:count]
+            self.pulses[name] += count
+
+    def expected_accidental(self, elapsed):
+        """Return the number of accidental coincidences expected for each
+        pair of sensors, given the pulses counted over elapsed seconds.
+        The estimate only holds while the summed rate of all the sensors
+        is well below one pulse per window."""
+        if elapsed <= 0:
+            return {}
+        names = sorted(self.listeners)
+        return {
+            (first, second): round(
+                2 * self.window * self.pulses[first] * self.pulses[second] / elapsed, 3
+            )
+            for index, first in enumerate(names)
+            for second in names[index + 1:]
+        }
+
+
+class SensorManager:
+    """Run several Pocket Geigers with a single processing thread and a
+    single callbacks dispatch path.
+
+    Each sensor is a RadiationWatch, with its own GPIO backend, whose
+    processing periods are all run by the manager scheduler. The manager
+    gives the readings of each sensor, and fused readings: the summed
+    count rate, the mean dose, and whether the sensors disagree (their
+    counts are unlikely to come from the same dose, by a chi-square test).
+
+    Usage:
+    ```
+    manager = SensorManager(dispatcher=CallbackDispatcher(), coincidence_window=0.001)
+    manager.add_sensor("left", 24, 23)
+    manager.add_sensor("right", 17, 27)
+    with manager:
+        manager.register_radiation_callback(lambda name: print("Ray on", name))
+        time.sleep(60)
+        print(manager.status(), manager.fused_status(), manager.coincidences())
+    ```
+    """
+
+    def __init__(self, dispatcher=None, coincidence_window=None, disagreement_level=0.001):
+        """Create a manager calling the callbacks through the dispatcher
+        (from the GPIO edge threads if None), counting the coincidences
+        within coincidence_window seconds (no counting if None), and
+        flagging a disagreement when the chi-square p-value of the
+        sensors counts is below disagreement_level."""
+        self.dispatcher = dispatcher
+        self.coincidence_window = coincidence_window
+        self.disagreement_level = disagreement_level
+        self.sensors = collections.OrderedDict()
+        self.coincidence_counter = None
+        self.radiation_callback = None
+        self.noise_callback = None
+        self.scheduler = PeriodicScheduler(
+            PROCESS_PERIOD / 1000.0, self._process_statistics, name="SensorManager"
+        )
+        self._started_at = None
+
+    def add_sensor(self, name, radiation_pin, noise_pin, **options):
+        """Add a sensor, with the RadiationWatch options (backend,
+        calibration, windows...). Return its RadiationWatch."""
+        if name in self.sensors:
+            raise ValueError("Duplicate sensor name: {0}".format(name))
+        if options.get("dispatcher") is not None:
+            raise ValueError("The sensors use the manager dispatcher")
+        sensor = RadiationWatch(radiation_pin, noise_pin, **options)
+        # The RPi.GPIO pin numbering mode is global to the process.
+        if isinstance(sensor.backend, RPiGPIOBackend):
+            for other in self.sensors.values():
+                if (isinstance(other.backend, RPiGPIOBackend)
+                        and other.backend.numbering != sensor.backend.numbering):
+                    raise ValueError("The sensors must use the same pin numbering mode")
+        sensor.register_radiation_callback(functools.partial(self._on_radiation, name))
+        sensor.register_noise_callback(functools.partial(self._on_noise, name))
+        self.sensors[name] = sensor
+        return sensor
+
+    def register_radiation_callback(self, callback):
+        """Register a function that will be called on radiation occurrence,
+        with the sensor name as argument."""
+        self.radiation_callback = callback
+
+    def register_noise_callback(self, callback):
+        """Register a function that will be called on noise occurrence,
+        with the sensor name as argument."""
+        self.noise_callback = callback
+
+    def setup(self):
+        """Set up all the sensors, and start processing them periodically."""
+        if self.coincidence_window is not None:
+            self.coincidence_counter = CoincidenceCounter(self.sensors, self.coincidence_window)
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+        try:
+            for name, sensor in self.sensors.items():
+                if self.coincidence_counter is not None:
+                    sensor.add_pulse_listener(self.coincidence_counter.listeners[name])
+                sensor.setup(scheduler=False)
+        except Exception:
+            self.close()
+            raise
+        self._started_at = time.monotonic()
+        self.scheduler.start()
+        return self
+
+    def close(self):
+        """Close all the sensors."""
+        self.scheduler.stop()
+        for name, sensor in self.sensors.items():
+            if self.coincidence_counter is not None:
+                sensor.remove_pulse_listener(self.coincidence_counter.listeners.get(name))
+            # Only the sensors set up have resources to close.
+            if hasattr(sensor, "_radiation_counter"):
+                sensor.close()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+
+    def __enter__(self):
+        return self.setup()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def scheduler_stats(self):
+        """Return the statistics processing timing,
+        see RadiationWatch.scheduler_stats()."""
+        return self.scheduler.stats()
+
+    def status(self, window=None):
+        """Return the readings of each sensor (see RadiationWatch.status()),
+        as a dictionary of name -> readings."""
+        return {name: sensor.status(window) for name, sensor in self.sensors.items()}
+
+    def fused_status(self, window=None):
+        """Return the fused readings of the sensors, as a dictionary with:
+            cpm -- the summed radiation count by minute;
+            uSvh -- the mean radiation dose, in uSv/h;
+            uSvhError -- the incertitude for the mean dose;
+            pValue -- the probability for sensors measuring the same dose
+            to disagree as much as they do (chi-square test);
+            disagreement -- whether pValue is below the disagreement level;
+            outlier -- the sensor the furthest from the others.
+        The readings are over the history, or over the given window."""
+        statuses = self.status(window)
+        exposures = {}
+        for name, sensor in self.sensors.items():
+            if window is None:
+                count, duration = sensor.count, min(sensor.duration, sensor.max_cpm_time)
+            else:
+                count, duration = sensor.windows[window].count, sensor.windows[window].time
+            # Counts expected for a given dose are proportional to k_alpha.
+            exposures[name] = (count, duration * sensor.calibration.k_alpha)
+        size = len(statuses)
+        total = sum(count for count, _ in exposures.values())
+        exposure = sum(weight for _, weight in exposures.values())
+        statistic, outlier, deviation = 0.0, None, 0.0
+        if total > 0 and exposure > 0:
+            for name, (count, weight) in exposures.items():
+                expected = total * weight / exposure
+                if expected <= 0:
+                    continue
+                statistic += (count - expected) ** 2 / expected
+                if abs(count - expected) / math.sqrt(expected) > deviation:
+                    outlier, deviation = name, abs(count - expected) / math.sqrt(expected)
+        p_value = _chi2_survival(statistic, size - 1) if size > 1 else 1.0
+        return dict(
+            cpm=round(sum(status["cpm"] for status in statuses.values()), 2),
+            uSvh=round(sum(status["uSvh"] for status in statuses.values()) / size, 3)
+            if size else 0,
+            uSvhError=round(
+                math.sqrt(sum(status["uSvhError"] ** 2 for status in statuses.values())) / size,
+                3,
+            ) if size else 0,
+            pValue=round(p_value, 6),
+            disagreement=p_value < self.disagreement_level,
+            outlier=outlier,
+        )
+
+    def coincidences(self):
+        """Return the coincidence counters, as a dictionary with:
+            total -- the number of coincidences;
+            pairs -- the number of coincidences of each pair of sensors,
+            as a dictionary of "name1+name2" -> count;
+            expectedAccidental -- the number of accidental coincidences
+            expected for each pair of independent sensors."""
+        counter = self.coincidence_counter
+        if counter is None:
+            raise RuntimeError("Coincidences are not counted: set coincidence_window")
+        elapsed = time.monotonic() - self._started_at
+        return dict(
+            total=counter.total,
+            pairs={"+".join(pair): count for pair, count in sorted(counter.pairs.items())},
+            expectedAccidental={
+                "+".join(pair): count
+                for pair, count in counter.expected_accidental(elapsed).items()
+            },
+        )
+
+    def _on_radiation(self, name):
+        callback = self.radiation_callback
+        if callback:
+            # Coalesce the calls by callback and sensor.
+            self._call(functools.partial(callback, name), (callback, name))
+
+    def _on_noise(self, name):
+        callback = self.noise_callback
+        if callback:
+            self._call(functools.partial(callback, name), (callback, name))
+
+    def _call(self, callback, key):
+        if self.dispatcher is not None:
+            self.dispatcher.submit(callback, key)
+        else:
+            callback()
+
+    def _process_statistics(self):
+        for sensor in self.sensors.values():
+            sensor._process_statistics()  # pylint: disable=protected-access
+        if self.coincidence_counter is not None:
+            self.coincidence_counter.process(time.monotonic_ns())
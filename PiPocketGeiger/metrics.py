@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Expose the readings as Prometheus / OpenMetrics metrics over HTTP.
+
+Released under MIT License. See LICENSE file.
+"""
+import http.server
+import threading
+
+__all__ = ["MetricsExporter"]
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Exported metrics: name, type, help.
+METRICS = [
+    ("pipocketgeiger_cpm", "gauge", "Radiation count by minute."),
+    ("pipocketgeiger_dose_usvh", "gauge", "Radiation dose, in microSieverts per hour."),
+    ("pipocketgeiger_dose_error_usvh", "gauge",
+     "Incertitude for the radiation dose, in microSieverts per hour."),
+    ("pipocketgeiger_duration_seconds", "gauge", "Duration of the measurements."),
+    ("pipocketgeiger_radiation_pulses", "counter", "Radiation pulses counted."),
+    ("pipocketgeiger_noise_pulses", "counter", "Noise pulses counted."),
+    ("pipocketgeiger_ticks", "counter", "Statistics processing periods run."),
+    ("pipocketgeiger_missed_ticks", "counter", "Statistics processing periods skipped."),
+    ("pipocketgeiger_late_ticks", "counter", "Statistics processing periods run late."),
+    ("pipocketgeiger_tick_lateness_seconds", "gauge",
+     "Lateness of the last statistics processing period."),
+    ("pipocketgeiger_max_tick_lateness_seconds", "gauge",
+     "Maximum lateness of the statistics processing periods."),
+]
+
+
+class MetricsExporter:
+    """Serve the RadiationWatch readings and counters on /metrics,
+    in the OpenMetrics text format (or the Prometheus one, depending
+    on the scraper Accept header).
+
+    The metrics page is rendered at most once per statistics processing
+    period, whatever the number of scrapes: scrapes in between are served
+    the cached page, without touching the driver.
+
+    Usage:
+    ```
+    with RadiationWatch(24, 23) as radiationWatch:
+        exporter = MetricsExporter(radiationWatch, port=9811, labels={"sensor": "roof"})
+        exporter.start()
+    ```
+    """
+
+    def __init__(self, radiation_watch, host="", port=9811, labels=None):
+        self.radiation_watch = radiation_watch
+        self.host = host
+        self.port = port
+        self.labels = (
+            "{" + ",".join('{0}="{1}"'.format(k, _escape(v)) for k, v in labels.items()) + "}"
+            if labels
+            else ""
+        )
+        self._lock = threading.Lock()
+        # Cached pages by format, and the processing period they were rendered at.
+        self._pages = {}
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start serving, from a background thread."""
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = exporter.render(openmetrics)
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type",
+                    OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE,
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="MetricsExporter"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def render(self, openmetrics=True):
+        """Return the metrics page, as bytes, rendering it only if a
+        statistics processing period ran since the last rendering."""
+        # The time of the last period processed: unlike the scheduler ticks,
+        # it also moves when a SensorManager runs the processing.
+        processed = self.radiation_watch.previous_time
+        with self._lock:
+            cached = self._pages.get(openmetrics)
+            if cached is None or cached[0] != processed:
+                cached = (processed, self._render(openmetrics))
+                self._pages[openmetrics] = cached
+            return cached[1]
+
+    def _render(self, openmetrics):
+        watch = self.radiation_watch
+        status = watch.status()
+        scheduler = watch.scheduler_stats()
+        values = [
+            status["cpm"],
+            status["uSvh"],
+            status["uSvhError"],
+            status["duration"],
+            watch.radiation_total,
+            watch.noise_total,
+            scheduler["ticks"],
+            scheduler["missed"],
+            scheduler["late"],
+            scheduler["lastLateness"],
+            scheduler["maxLateness"],
+        ]
+        lines = []
+        for (name, kind, description), value in zip(METRICS, values):
+            sample = name + "_total" if kind == "counter" else name
+            family = name if openmetrics else sample
+            lines.append("# HELP {0} {1}".format(family, description))
+            lines.append("# TYPE {0} {1}".format(family, kind))
+            lines.append("{0}{1} {2}".format(sample, self.labels, value))
+        if openmetrics:
+            lines.append("# EOF")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
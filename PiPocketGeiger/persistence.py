@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Persist the counts history on disk, so a restart does not reset
+the measurements.
+
+Released under MIT License. See LICENSE file.
+"""
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+
+__all__ = ["HistoryStore", "read_tick_log", "TICK_RECORD"]
+
+# Ring file header: magic, version, history length, history unit (seconds),
+# saved at (wall clock, ms), elapsed time in the current bucket (ms),
+# history index, count, duration (ms), CRC32 of the history.
+HEADER = struct.Struct("<4sHHIqqIqqI")
+MAGIC = b"PGH1"
+VERSION = 1
+# Tick log record: wall clock (ms), radiation count, noise count, elapsed (ms).
+TICK_RECORD = struct.Struct("<qIHH")
+
+
+def wall_millis():
+    return int(round(time.time() * 1000))
+
+
+class HistoryStore:
+    """Mirror the counts history in a fixed-size memory-mapped ring file,
+    and optionally append the counts of each processing period to a
+    compact binary log (TICK_RECORD records, 16 bytes each).
+
+    Nothing is written on each period: the ring file and the log are only
+    written (and synced) every flush_period seconds, and when closing,
+    to spare the SD card. Up to flush_period seconds of measurements can
+    therefore be lost on a power failure.
+
+    Usage:
+    ```
+    store = HistoryStore("/var/lib/geiger/history.ring", "/var/lib/geiger/ticks.log")
+    with RadiationWatch(24, 23, history_store=store) as radiationWatch:
+        # Resumes from the saved history, if recent enough.
+        print(radiationWatch.status())
+    ```
+    """
+
+    def __init__(self, path, log_path=None, flush_period=60, fsync=True):
+        """Create a store with the ring file at path, and the tick log
+        at log_path (no log by default)."""
+        self.path = path
+        self.log_path = log_path
+        self.flush_period = flush_period
+        self.fsync = fsync
+        self._file = None
+        self._mmap = None
+        self._log = None
+        self._log_buffer = bytearray()
+        self._last_flush = None
+
+    def open(self, history_length, history_unit):
+        """Open (or create) the ring file for a history of history_length
+        buckets of history_unit seconds, and the tick log."""
+        size = HEADER.size + 8 * history_length
+        self.history_length = history_length
+        self.history_unit = history_unit
+        mode = "r+b" if os.path.exists(self.path) else "w+b"
+        self._file = open(self.path, mode)
+        if os.fstat(self._file.fileno()).st_size != size:
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        if self.log_path:
+            self._log = open(self.log_path, "ab")
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Flush and close the files."""
+        self._flush_log()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def load(self, current_time):
+        """Return the saved history, aged up to now, as a dictionary with the
+        history, history_index, count, duration (ms) and previous_history_time
+        (current_time being the monotonic clock now, in ms).
+        Return None if there is no valid history, or if it is stale (older
+        than the whole history)."""
+        (
+            magic, version, length, unit, saved_at, bucket_elapsed,
+            index, count, duration, crc,
+        ) = HEADER.unpack_from(self._mmap)
+        body = self._mmap[HEADER.size:]
+        if (
+            magic != MAGIC
+            or version != VERSION
+            or length != self.history_length
+            or unit != self.history_unit
+            or zlib.crc32(body) != crc
+        ):
+            return None
+        unit_ms = unit * 1000
+        gap = wall_millis() - saved_at + bucket_elapsed
+        if gap < 0 or gap >= length * unit_ms:
+            return None
+        history = array("q", body).tolist()
+        # Shift the history by the buckets elapsed since the save.
+        shifted = gap // unit_ms
+        for _ in range(shifted):
+            index = (index + 1) % length
+            count -= history[index]
+            history[index] = 0
+        return dict(
+            history=history,
+            history_index=index,
+            count=count,
+            duration=min(duration, (length - shifted) * unit_ms),
+            previous_history_time=current_time - gap % unit_ms,
+        )
+
+    def log_tick(self, radiation_count, noise_count, elapsed, wall_time=None):
+        """Buffer the counts of a processing period of elapsed ms, ended at
+        wall_time (wall clock ms, now by default)."""
+        if self._log is not None:
+            self._log_buffer += TICK_RECORD.pack(
+                wall_millis() if wall_time is None else wall_time,
+                radiation_count, min(noise_count, 0xFFFF), min(elapsed, 0xFFFF),
+            )
+
+    def flush_due(self):
+        """Whether the flush period elapsed since the last flush."""
+        return time.monotonic() - self._last_flush >= self.flush_period
+
+    def save(self, history, history_index, count, duration, bucket_elapsed):
+        """Write the history to the ring file and flush the tick log.
+        bucket_elapsed is the time elapsed in the current bucket (ms)."""
+        body = array("q", history).tobytes()
+        self._mmap[HEADER.size:] = body
+        self._mmap[:HEADER.size] = HEADER.pack(
+            MAGIC, VERSION, self.history_length, self.history_unit, wall_millis(),
+            bucket_elapsed, history_index, count, duration, zlib.crc32(body),
+        )
+        self._mmap.flush()
+        self._flush_log()
+        self._last_flush = time.monotonic()
+
+    def _flush_log(self):
+        if self._log is None or not self._log_buffer:
+            return
+        self._log.write(self._log_buffer)
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._log_buffer = bytearray()
+
+
+def read_tick_log(path):
+    """Yield the (wall clock ms, radiation count, noise count, elapsed ms)
+    records of a tick log."""
+    with open(path, "rb") as log:
+        data = log.read()
+    # Ignore a truncated last record (power failure while writing).
+    end = len(data) - len(data) % TICK_RECORD.size
+    yield from TICK_RECORD.iter_unpack(memoryview(data)[:end])
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+Replay recorded pulses through the statistics, on a virtual clock.
+
+Requires NumPy (pip install PiPocketGeiger[replay]). NumPy is only
+imported when a replay is created, like the GPIO libraries.
+
+Released under MIT License. See LICENSE file.
+"""
+import collections
+
+from PiPocketGeiger.core import StatisticsCore, PROCESS_PERIOD, HISTORY_LENGTH, HISTORY_UNIT
+from PiPocketGeiger.calibration import Calibration
+from PiPocketGeiger.persistence import TICK_RECORD
+from PiPocketGeiger.status import Status
+from PiPocketGeiger.windows import DEFAULT_WINDOWS, WINDOW_BUCKETS
+
+__all__ = [
+    "Recording",
+    "ReplayResult",
+    "replay",
+    "replay_core",
+    "load_timestamps",
+    "save_timestamps",
+]
+
+# Number of processing periods replayed at once.
+CHUNK = 1 << 20
+
+Ticks = collections.namedtuple("Ticks", ["times", "radiation", "noise"])
+Ticks.__doc__ = """Processing periods, as NumPy arrays.
+    times -- the end of each period, in milliseconds;
+    radiation -- the radiation edges counted in each period;
+    noise -- the noise edges counted in each period."""
+
+
+def _numpy():
+    import numpy  # pylint: disable=import-outside-toplevel
+
+    return numpy
+
+
+def load_timestamps(path):
+    """Load pulse timestamps (nanoseconds) from a .npy file, or from a raw
+    file of little-endian 64-bit integers (see save_timestamps())."""
+    numpy = _numpy()
+    if str(path).endswith(".npy"):
+        return numpy.load(path).astype(numpy.int64, copy=False)
+    return numpy.fromfile(path, dtype="<i8").astype(numpy.int64, copy=False)
+
+
+def save_timestamps(path, views, append=True):
+    """Write pulse timestamps (nanoseconds) to a raw file of little-endian
+    64-bit integers, e.g. the views of RadiationWatch.radiation_events()."""
+    numpy = _numpy()
+    with open(path, "ab" if append else "wb") as timestamps_file:
+        for view in views:
+            numpy.asarray(view, dtype="<i8").tofile(timestamps_file)
+
+
+class Recording:
+    """Recorded processing periods, to replay.
+
+    A recording starts at start (milliseconds, the driver setup) and is
+    read by chunks of Ticks, so it can be far larger than the memory.
+    Create it from pulse timestamps with from_timestamps(), or from the
+    tick log of a HistoryStore with from_tick_log().
+    """
+
+    def __init__(self, start, chunks, radiation=None, noise=None):
+        self.start = start
+        self._chunks = chunks
+        # Pulse timestamps (nanoseconds), if recorded.
+        self.radiation = radiation
+        self.noise = noise
+
+    def chunks(self, size=CHUNK):
+        """Yield the processing periods, by Ticks of size periods at most."""
+        return self._chunks(size)
+
+    @classmethod
+    def from_timestamps(cls, radiation, noise=None, start=None, end=None,
+                        process_period=PROCESS_PERIOD):
+        """Create a recording from sorted pulse timestamps (nanoseconds),
+        processed every process_period ms from start to end (milliseconds,
+        by default from the first to the last pulse), as RadiationWatch
+        would have processed them."""
+        numpy = _numpy()
+        radiation = numpy.asarray(radiation, dtype=numpy.int64)
+        noise = numpy.asarray(() if noise is None else noise, dtype=numpy.int64)
+        edges = [edges for edges in (radiation, noise) if len(edges)]
+        if start is None:
+            start = min(int(edges[0]) for edges in edges) // 1000000 if edges else 0
+        if end is None:
+            end = max(int(edges[-1]) for edges in edges) // 1000000 + 1 if edges else start
+        periods = max(0, -(-(end - start) // process_period))
+
+        def chunks(size):
+            for first in range(1, periods + 1, size):
+                times = start + process_period * numpy.arange(
+                    first, min(first + size, periods + 1), dtype=numpy.int64
+                )
+                # The edges counted at each period end, including it.
+                limits = numpy.concatenate(([times[0] - process_period], times)) * 1000000
+                yield Ticks(
+                    times,
+                    numpy.diff(numpy.searchsorted(radiation, limits, side="right")),
+                    numpy.diff(numpy.searchsorted(noise, limits, side="right")),
+                )
+
+        return cls(start, chunks, radiation, noise)
+
+    @classmethod
+    def from_tick_log(cls, path):
+        """Create a recording from a tick log (see HistoryStore): the counts
+        and durations of the periods processed live, replayed exactly."""
+        numpy = _numpy()
+        dtype = numpy.dtype(
+            [("wall", "<i8"), ("radiation", "<u4"), ("noise", "<u2"), ("elapsed", "<u2")]
+        )
+        assert dtype.itemsize == TICK_RECORD.size
+        records = numpy.memmap(path, dtype=dtype, mode="r") if _size(path) else None
+
+        def chunks(size):
+            if records is None:
+                return
+            time = 0
+            for first in range(0, len(records), size):
+                chunk = records[first:first + size]
+                times = time + numpy.cumsum(chunk["elapsed"], dtype=numpy.int64)
+                time = int(times[-1])
+                yield Ticks(
+                    times,
+                    chunk["radiation"].astype(numpy.int64),
+                    chunk["noise"].astype(numpy.int64),
+                )
+
+        return cls(0, chunks)
+
+
+def _size(path):
+    with open(path, "rb") as log:
+        log.seek(0, 2)
+        return log.tell() // TICK_RECORD.size
+
+
+class ReplayResult:
+    """Readings after each replayed period (or every few periods), as NumPy
+    arrays: times (ms), count and duration (ms) of the history, and
+    windows, a dictionary of name -> (count, time) arrays.
+
+    status(index) gives the Status RadiationWatch would have published."""
+
+    def __init__(self, times, count, duration, windows, calibration, max_cpm_time):
+        self.times = times
+        self.count = count
+        self.duration = duration
+        self.windows = windows
+        self.calibration = calibration
+        self.max_cpm_time = max_cpm_time
+
+    def __len__(self):
+        return len(self.times)
+
+    def status(self, index, window=None):
+        """Return the readings after the index-th sample, over the history
+        or over the given window (see RadiationWatch.status())."""
+        if window is None:
+            return Status.from_counts(
+                int(self.count[index]), int(self.duration[index]),
+                self.calibration, self.max_cpm_time,
+            )
+        count, duration = self.windows[window]
+        return Status.from_counts(int(count[index]), int(duration[index]), self.calibration)
+
+    def cpm(self, window=None):
+        """Return the count rates of all the samples, as an array
+        (without dead-time correction nor rounding)."""
+        numpy = _numpy()
+        if window is None:
+            count, duration = self.count, numpy.minimum(self.duration, self.max_cpm_time)
+        else:
+            count, duration = self.windows[window]
+        minutes = duration / 1000 / 60.0
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            return numpy.where(minutes > 0, count / minutes, 0.0)
+
+
+class _Ring:
+    """Vectorized counterpart of a bucket ring (the history or a
+    SlidingWindow), over the cumulative counts and times.
+
+    shifts are the number of ring shifts after each period: the counts of
+    a period go to the bucket opened by the previous shift, and after the
+    period the ring holds the buckets above shifts - size."""
+
+    def __init__(self, numpy, size):
+        self.numpy = numpy
+        self.size = size
+        # Cumulative count and time at the first period of each bucket,
+        # from the bucket offset on (the older ones are out of the ring).
+        self.count_starts = numpy.zeros(1, dtype=numpy.int64)
+        self.time_starts = numpy.zeros(1, dtype=numpy.int64)
+        self.offset = 0
+        self.shifts = 0
+
+    def totals(self, shifts, cumulative_counts, cumulative_times, sampled):
+        """Return the counts and times in the ring after the sampled periods
+        of a chunk, given the cumulative counts and times before each period
+        and after the last one."""
+        numpy = self.numpy
+        buckets = numpy.concatenate(([self.shifts], shifts))
+        first = self.offset + len(self.count_starts)
+        if buckets[-1] >= first:
+            new = numpy.arange(first, buckets[-1] + 1)
+            periods = numpy.searchsorted(buckets, new, side="left")
+            self.count_starts = numpy.concatenate(
+                (self.count_starts, cumulative_counts[periods])
+            )
+            self.time_starts = numpy.concatenate((self.time_starts, cumulative_times[periods]))
+        self.shifts = int(buckets[-1])
+        oldest = numpy.maximum(shifts[sampled] - self.size + 1, self.offset) - self.offset
+        totals = (
+            cumulative_counts[sampled + 1] - self.count_starts[oldest],
+            cumulative_times[sampled + 1] - self.time_starts[oldest],
+        )
+        # Forget the buckets out of the ring.
+        offset = max(self.shifts - self.size + 1, self.offset)
+        self.count_starts = self.count_starts[offset - self.offset:]
+        self.time_starts = self.time_starts[offset - self.offset:]
+        self.offset = offset
+        return totals
+
+
+def replay(recording, history_length=HISTORY_LENGTH, history_unit=HISTORY_UNIT,
+           windows=None, calibration=None, every=1, chunk=CHUNK):
+    """Replay a Recording through the statistics, vectorized with NumPy,
+    with the given history and windows (see RadiationWatch).
+    Return a ReplayResult sampled every every periods.
+
+    The readings are identical to the live ones (see replay_core()).
+    The detector and the noise gate, which need to run period by period,
+    are not supported: use replay_core() for them."""
+    numpy = _numpy()
+    windows = DEFAULT_WINDOWS if windows is None else windows
+    calibration = Calibration() if calibration is None else calibration
+    if not float(history_unit * 1000).is_integer():
+        raise ValueError("The history unit must be a whole number of milliseconds")
+    history_ms = int(history_unit * 1000)
+    start = recording.start
+    history = _Ring(numpy, history_length)
+    rings = {name: _Ring(numpy, WINDOW_BUCKETS) for name in windows}
+    units = {name: duration * 1000.0 / WINDOW_BUCKETS for name, duration in windows.items()}
+    # Previous shift time of each window, see SlidingWindow.advance().
+    shift_times = {name: numpy.array([float(start)]) for name in windows}
+    previous_time, total_count, total_time, periods = start, 0, 0, 0
+    samples = collections.defaultdict(list)
+    for ticks in recording.chunks(chunk):
+        times = ticks.times
+        size = len(times)
+        if not size:
+            continue
+        indexes = numpy.arange(size)
+        # Counts and time kept: periods without noise.
+        elapsed = numpy.abs(numpy.diff(times, prepend=previous_time))
+        kept = ticks.noise == 0
+        counts = numpy.where(kept, ticks.radiation, 0)
+        cumulative_counts = numpy.concatenate(
+            ([total_count], total_count + numpy.cumsum(counts))
+        )
+        cumulative_times = numpy.concatenate(
+            ([total_time], total_time + numpy.cumsum(numpy.where(kept, elapsed, 0)))
+        )
+        # History: at most one shift per period, when a unit elapsed since
+        # the previous shift. shifts = min(due, previous shifts + 1), i.e.
+        # the running minimum of due - index, plus index.
+        due = (times - start) // history_ms
+        lag = numpy.minimum.accumulate(due - indexes)
+        shifts = indexes + numpy.minimum(lag, history.shifts + 1)
+        sampled = indexes[(periods + indexes + 1) % every == 0]
+        history_counts, _ = history.totals(
+            shifts, cumulative_counts, cumulative_times, sampled
+        )
+        window_totals = {}
+        for name, ring in rings.items():
+            unit = units[name]
+            if unit.is_integer():
+                # Exact shift times: start + shifts * unit.
+                shifts = (times - start) // int(unit)
+            else:
+                shifts = ring.shifts + _float_shifts(shift_times, name, times, unit)
+            window_totals[name] = ring.totals(
+                shifts, cumulative_counts, cumulative_times, sampled
+            )
+        samples["times"].append(times[sampled])
+        samples["count"].append(history_counts)
+        samples["duration"].append(cumulative_times[sampled + 1])
+        for name, (window_counts, window_times) in window_totals.items():
+            samples[name, "count"].append(window_counts)
+            samples[name, "time"].append(window_times)
+        previous_time = int(times[-1])
+        total_count = int(cumulative_counts[-1])
+        total_time = int(cumulative_times[-1])
+        periods += size
+
+    def concatenate(key):
+        return numpy.concatenate(samples[key]) if samples[key] else numpy.zeros(0, numpy.int64)
+
+    return ReplayResult(
+        concatenate("times"),
+        concatenate("count"),
+        concatenate("duration"),
+        {name: (concatenate((name, "count")), concatenate((name, "time"))) for name in windows},
+        calibration,
+        history_length * history_ms,
+    )
+
+
+def _float_shifts(shift_times, name, times, unit):
+    """Return the window shifts after each period, from the current one,
+    for a window whose shift times are not integers."""
+    numpy = _numpy()
+    # Previous shift times from the current one on, extended past the
+    # chunk by repeated additions, as SlidingWindow.advance().
+    starts = shift_times[name]
+    needed = int((times[-1] - starts[-1]) // unit) + 2
+    if needed > 0:
+        starts = numpy.concatenate((starts[:-1], numpy.add.accumulate(
+            numpy.concatenate((starts[-1:], numpy.full(needed, unit)))
+        )))
+    # Shifts while current_time - previous_shift_time >= unit,
+    # fixing the rounding of the subtraction if any.
+    shifts = numpy.searchsorted(starts, times - unit, side="right")
+    shifts -= (shifts > 0) & (times - starts[numpy.maximum(shifts - 1, 0)] < unit)
+    shifts += times - starts[shifts] >= unit
+    shift_times[name] = starts[shifts[-1]:]
+    return shifts
+
+
+def replay_core(recording, core=None, every=1, chunk=CHUNK):
+    """Replay a Recording period by period through a StatisticsCore
+    (the one RadiationWatch uses), a new one by default.
+
+    This is the reference for replay(), much slower, but it supports the
+    detector (alarms are raised as live) and the noise gate (when the
+    recording has the pulse timestamps)."""
+    numpy = _numpy()
+    core = StatisticsCore() if core is None else core
+    core.reset(recording.start)
+    gate = core.noise_gate
+    if gate is not None and recording.radiation is None:
+        raise ValueError("The noise gate needs a recording of the pulse timestamps")
+    window_names = list(core.windows)
+    samples = collections.defaultdict(list)
+    periods = 0
+    edges = {"radiation": 0, "noise": 0}
+    for ticks in recording.chunks(chunk):
+        for time, radiation, noise in zip(
+            ticks.times.tolist(), ticks.radiation.tolist(), ticks.noise.tolist()
+        ):
+            if gate is not None:
+                for kind, timestamps in (("radiation", recording.radiation),
+                                         ("noise", recording.noise)):
+                    end = int(numpy.searchsorted(timestamps, time * 1000000, side="right"))
+                    for timestamp in timestamps[edges[kind]:end].tolist():
+                        gate.push(kind, timestamp)
+                    edges[kind] = end
+            core.process(time, radiation, noise)
+            periods += 1
+            if periods % every == 0:
+                samples["times"].append(time)
+                samples["count"].append(core.count)
+                samples["duration"].append(core.duration)
+                for name in window_names:
+                    sliding_window = core.windows[name]
+                    samples[name, "count"].append(sliding_window.count)
+                    samples[name, "time"].append(sliding_window.time)
+
+    def array(key):
+        return numpy.array(samples[key], dtype=numpy.int64)
+
+    return ReplayResult(
+        array("times"),
+        array("count"),
+        array("duration"),
+        {name: (array((name, "count")), array((name, "time"))) for name in window_names},
+        core.calibration,
+        core.max_cpm_time,
+    )
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Periodic scheduler running on a single long-lived thread.
+
+Released under MIT License. See LICENSE file.
+"""
+import threading
+import time
+
+__all__ = ["PeriodicScheduler", "AdaptiveScheduler"]
+
+
+class PeriodicScheduler:
+    """Call a function periodically from one persistent thread.
+
+    Ticks are scheduled at absolute deadlines on the monotonic clock
+    (start + n * period), so the processing time of a tick never delays
+    the following ones and no drift accumulates over time.
+    If a tick is so late that whole periods have been skipped, the
+    scheduler resynchronizes on the next deadline in the future and
+    accounts for the skipped ones as missed ticks.
+
+    Usage:
+    ```
+    scheduler = PeriodicScheduler(0.16, process)
+    scheduler.start()
+    # ...
+    scheduler.stop()
+    ```
+    """
+
+    def __init__(self, period, function, late_threshold=None, name=None, histogram=None):
+        """Create a scheduler calling function every period seconds.
+        A tick starting more than late_threshold seconds after its deadline
+        is accounted as late (by default a tenth of the period).
+        If a Histogram is given, the lateness of each tick is recorded in it."""
+        if period <= 0:
+            raise ValueError("The scheduler period must be positive")
+        self.period = period
+        self.function = function
+        self.late_threshold = period / 10.0 if late_threshold is None else late_threshold
+        self.name = name or "PeriodicScheduler"
+        self.histogram = histogram
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.late_ticks = 0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+        self.wakeups = 0
+        self._started_at = time.monotonic()
+
+    @property
+    def running(self):
+        """Whether the scheduler thread is alive."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start the scheduler thread. The first tick happens one period
+        after the call."""
+        if self.running:
+            raise RuntimeError("The scheduler is already running")
+        self._reset_stats()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the scheduler and wait for its thread to terminate.
+        A tick in progress is allowed to complete."""
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def stats(self):
+        """Return the scheduling statistics, as a dictionary with:
+            ticks -- the number of ticks run;
+            missed -- the number of ticks skipped because we were too late;
+            late -- the number of ticks run later than the late threshold;
+            lastLateness -- the lateness of the last tick, in seconds;
+            maxLateness -- the maximum lateness observed, in seconds;
+            wakeupsPerHour -- the number of times the thread woke up,
+            by hour since the start."""
+        elapsed = time.monotonic() - self._started_at
+        return dict(
+            ticks=self.ticks,
+            missed=self.missed_ticks,
+            late=self.late_ticks,
+            lastLateness=self.last_lateness,
+            maxLateness=self.max_lateness,
+            wakeupsPerHour=round(self.wakeups * 3600 / elapsed, 1) if elapsed > 0 else 0,
+        )
+
+    def _run(self):
+        deadline = time.monotonic() + self.period
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout > 0 and self._stop_event.wait(timeout):
+                return
+            if self._stop_event.is_set():
+                return
+            self.wakeups += 1
+            lateness = time.monotonic() - deadline
+            if lateness >= self.period:
+                # We overslept whole periods: skip them instead of
+                # running a burst of ticks to catch up.
+                skipped = int(lateness // self.period)
+                self.missed_ticks += skipped
+                deadline += skipped * self.period
+                lateness -= skipped * self.period
+            self.last_lateness = lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            if lateness > self.late_threshold:
+                self.late_ticks += 1
+            if self.histogram is not None:
+                self.histogram.record(lateness)
+            self.ticks += 1
+            self.function()
+            deadline += self.period
+
+
+class AdaptiveScheduler(PeriodicScheduler):
+    """Periodic scheduler sleeping through the idle periods.
+
+    The ticks keep their absolute deadlines (origin + n * period), but
+    while idle the thread does not wake up for each of them: it sleeps
+    until the deadline of the idle_ticks()-th next tick, or until wake()
+    is called, whichever comes first. The ticks slept through are then
+    accounted lazily, with skip(n) for each of them. Once woken by an
+    event, the tick it belongs to is run with function(n) at its deadline.
+    wake() is cheap enough to be called on each event.
+
+    Usage:
+    ```
+    scheduler = AdaptiveScheduler(0.16, process, skip, idle_ticks=lambda: 37)
+    scheduler.start()
+    # On each event:
+    scheduler.wake()
+    ```
+    """
+
+    def __init__(self, period, function, skip, idle_ticks, late_threshold=None, name=None,
+                 histogram=None):
+        """Create a scheduler running function(n) for the ticks n to run,
+        and skip(n) for the idle ticks slept through. idle_ticks() returns in
+        how many ticks the next one to run is due: 1 for the next tick (for
+        instance if an event came since the last tick), more to sleep."""
+        super().__init__(period, function, late_threshold, name, histogram)
+        self.skip = skip
+        self.idle_ticks = idle_ticks
+        self._wake_event = threading.Event()
+        self._idle = False
+
+    def _reset_stats(self):
+        super()._reset_stats()
+        self.skipped_ticks = 0
+
+    def start(self, origin=None):
+        """Start the scheduler thread, with the tick n due at origin + n * period
+        (monotonic clock, in seconds, now by default)."""
+        self._origin = time.monotonic() if origin is None else origin
+        super().start()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        self._wake_event.set()
+        super().stop(timeout)
+
+    def wake(self):
+        """Run the next tick on time, instead of sleeping through it."""
+        if self._idle:
+            self._idle = False
+            self._wake_event.set()
+
+    def stats(self):
+        """Return the scheduling statistics, see PeriodicScheduler.stats(),
+        with also skipped, the number of idle ticks slept through."""
+        stats = super().stats()
+        stats["skipped"] = self.skipped_ticks
+        return stats
+
+    def _run(self):
+        tick = 1
+        while True:
+            self._wake_event.clear()
+            self._idle = True
+            # After _idle is set: idle_ticks() sees the events wake() misses.
+            last = tick + self.idle_ticks() - 1
+            if last == tick:
+                # Busy: no need to be woken before the next deadline.
+                self._idle = False
+            woken = self._wait(last, self._wake_event if last > tick else None)
+            self._idle = False
+            if self._stop_event.is_set():
+                return
+            if woken:
+                # The ticks already due were idle: the event came after them.
+                due = min(last, int((time.monotonic() - self._origin) // self.period))
+                self._skip(tick, due + 1)
+                tick = max(tick, due + 1)
+                self._wait(tick)
+                if self._stop_event.is_set():
+                    return
+            else:
+                self._skip(tick, last)
+                tick = last
+            self.wakeups += 1
+            lateness = time.monotonic() - (self._origin + tick * self.period)
+            if lateness >= self.period:
+                # We overslept whole periods: skip them instead of
+                # running a burst of ticks to catch up.
+                skipped = int(lateness // self.period)
+                self.missed_ticks += skipped
+                tick += skipped
+                lateness -= skipped * self.period
+            self.last_lateness = lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            if lateness > self.late_threshold:
+                self.late_ticks += 1
+            if self.histogram is not None:
+                self.histogram.record(lateness)
+            self.ticks += 1
+            self.function(tick)
+            tick += 1
+
+    def _skip(self, first, end):
+        for tick in range(first, end):
+            self.skip(tick)
+            self.skipped_ticks += 1
+
+    def _wait(self, tick, event=None):
+        """Wait for the deadline of tick, or for event. Return whether
+        the event was set."""
+        timeout = self._origin + tick * self.period - time.monotonic()
+        if timeout <= 0:
+            return False
+        if event is None:
+            self._stop_event.wait(timeout)
+            return False
+        if event.wait(timeout):
+            self.wakeups += 1
+            return True
+        return False
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""
+Reliable upload of the readings: spool them on disk, then upload them in
+batches to a sink (an HTTP endpoint, the Safecast API, ...), retrying
+with an exponential backoff until it succeeds. Readings rejected by the
+sink are set aside in a dead-letter file of the spool, and logged.
+
+Released under MIT License. See LICENSE file.
+"""
+import datetime
+import http.client
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+from PiPocketGeiger.scheduler import PeriodicScheduler
+
+__all__ = [
+    "Spool",
+    "HTTPSink",
+    "SafecastSink",
+    "Uploader",
+    "SinkPipeline",
+    "UploadError",
+    "RejectedError",
+]
+
+SAFECAST_API_URL = "https://api.safecast.org"
+SAFECAST_DEVELOPMENT_API_URL = "https://dev.safecast.org"
+# Client errors worth retrying: timeout, rate limited.
+RETRIED_STATUSES = (408, 429)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class UploadError(OSError):
+    """Failed upload of a batch of readings. Its sent first readings were
+    uploaded though."""
+
+    def __init__(self, message, sent=0):
+        super().__init__(message)
+        self.sent = sent
+
+
+class RejectedError(UploadError):
+    """The sink rejected the readings after the sent first ones (HTTP 4xx):
+    sending them again would fail again."""
+
+
+class Spool:
+    """Persistent FIFO queue of readings, as JSON lines in segment files
+    of a directory.
+
+    The read position is only committed once the readings are uploaded, and
+    the segment files are removed once fully uploaded: after a crash or a
+    restart, the upload resumes from the last committed position.
+    """
+
+    SUFFIX = ".spool"
+    DEAD_LETTER = "rejected.jsonl"
+
+    def __init__(self, directory, segment_size=256 * 1024, fsync=False):
+        """Open (or create) the spool in directory. A new segment file is
+        started once the current one exceeds segment_size bytes."""
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._position_path = os.path.join(directory, "position")
+        self.segments = sorted(
+            int(name[: -len(self.SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(self.SUFFIX)
+        )
+        self.position = self._read_position()
+        self.pending = sum(1 for _ in self._iter_lines(self.position))
+        self._file = None
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, "{0:010d}{1}".format(segment, self.SUFFIX))
+
+    def _read_position(self):
+        try:
+            with open(self._position_path, encoding="utf-8") as position_file:
+                segment, offset = json.load(position_file)
+        except (OSError, ValueError):
+            segment, offset = (self.segments[0] if self.segments else 0), 0
+        return segment, offset
+
+    def _iter_lines(self, position):
+        """Yield (line, position after the line) from position."""
+        segment, offset = position
+        for current in self.segments:
+            if current < segment:
+                continue
+            with open(self._segment_path(current), "rb") as segment_file:
+                segment_file.seek(offset if current == segment else 0)
+                offset_in_file = segment_file.tell()
+                for line in segment_file:
+                    offset_in_file += len(line)
+                    # Ignore a truncated last line (crash while writing).
+                    if line.endswith(b"\n"):
+                        yield line, (current, offset_in_file)
+
+    def put(self, reading):
+        """Append a reading (a JSON-serializable dictionary)."""
+        line = (json.dumps(reading, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None or self._file.tell() >= self.segment_size:
+                self._rotate()
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.pending += 1
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        segment = self.segments[-1] + 1 if self.segments else self.position[0]
+        self.segments.append(segment)
+        self._file = open(self._segment_path(segment), "ab")
+
+    def peek(self, size):
+        """Return up to size of the oldest readings, with the positions
+        after each of them, to commit once they are uploaded."""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            readings, positions = [], []
+            for line, position in self._iter_lines(self.position):
+                readings.append(json.loads(line))
+                positions.append(position)
+                if len(readings) >= size:
+                    break
+            return readings, positions
+
+    def commit(self, position, count):
+        """Mark the count readings before position as uploaded."""
+        with self._lock:
+            temporary_path = self._position_path + ".tmp"
+            with open(temporary_path, "w", encoding="utf-8") as position_file:
+                json.dump(list(position), position_file)
+                position_file.flush()
+                if self.fsync:
+                    os.fsync(position_file.fileno())
+            os.replace(temporary_path, self._position_path)
+            self.position = tuple(position)
+            self.pending -= count
+            # Remove the segments fully uploaded.
+            while len(self.segments) > 1 and self.segments[0] < self.position[0]:
+                os.remove(self._segment_path(self.segments.pop(0)))
+
+    def dead_letter(self, reading, reason):
+        """Append a reading rejected by the sink, and the reason why, to the
+        dead-letter file (DEAD_LETTER, JSON lines) of the spool directory."""
+        line = json.dumps(dict(reading=reading, reason=reason), separators=(",", ":"))
+        with self._lock:
+            path = os.path.join(self.directory, self.DEAD_LETTER)
+            with open(path, "a", encoding="utf-8") as dead_letter:
+                dead_letter.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class HTTPSink:
+    """Post batches of readings as a JSON array to an HTTP(S) endpoint,
+    over a persistent (keep-alive) connection."""
+
+    def __init__(self, url, headers=None, timeout=30):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.path = (parsed.path or "/") + ("?" + parsed.query if parsed.query else "")
+        self.headers = {"Content-Type": "application/json"}
+        self.headers.update(headers or {})
+        self.timeout = timeout
+        self._connection = None
+
+    def _connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+
+    def request(self, method, path, payload):
+        """Send a JSON payload and return the response body. Raise
+        RejectedError on a client error that retrying would not fix,
+        OSError (or http.client.HTTPException) on other failures."""
+        body = json.dumps(payload).encode("utf-8")
+        # Retry once on a new connection if the kept-alive one was closed.
+        for attempt in range(2):
+            reused = self._connection is not None
+            if not reused:
+                self._connection = self._connect()
+            try:
+                self._connection.request(method, path, body, self.headers)
+                response = self._connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                self.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            break
+        if response.will_close:
+            self.close()
+        if 400 <= response.status < 500 and response.status not in RETRIED_STATUSES:
+            raise RejectedError(
+                "Upload rejected: HTTP {0} {1}".format(response.status, response.reason)
+            )
+        if response.status >= 300:
+            raise OSError(
+                "Upload failed: HTTP {0} {1}".format(response.status, response.reason)
+            )
+        return data
+
+    def send(self, readings):
+        """Upload a batch of readings."""
+        self.request("POST", self.path, readings)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class SafecastSink(HTTPSink):
+    """Publish the readings to the Safecast API (https://api.safecast.org),
+    over a persistent connection. You need a Safecast API key, and the id
+    of your device (see examples/safecast.py)."""
+
+    def __init__(self, api_key, device_id, latitude, longitude, location_name=None,
+                 height=None, api_url=SAFECAST_DEVELOPMENT_API_URL, timeout=30):
+        super().__init__(
+            "{0}/measurements.json?{1}".format(
+                api_url, urllib.parse.urlencode({"api_key": api_key})
+            ),
+            timeout=timeout,
+        )
+        self.measurement = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "unit": "usv",
+            "device_id": device_id,
+        }
+        if location_name:
+            self.measurement["location_name"] = location_name
+        if height:
+            self.measurement["height"] = height
+
+    def send(self, readings):
+        # The API takes one measurement per request: at least reuse the
+        # connection, and report the measurements published before a failure.
+        for index, reading in enumerate(readings):
+            measurement = dict(self.measurement)
+            measurement["value"] = reading["uSvh"]
+            measurement["captured_at"] = (
+                datetime.datetime.fromtimestamp(reading["time"], datetime.timezone.utc)
+                .isoformat()
+            )
+            try:
+                self.request("POST", self.path, measurement)
+            except RejectedError as error:
+                raise RejectedError(str(error), sent=index) from error
+            except (http.client.HTTPException, OSError) as error:
+                raise UploadError(str(error), sent=index) from error
+
+
+class Uploader:
+    """Upload the spooled readings to a sink, in batches of up to batch_size,
+    from a background thread. Failed uploads are retried with an exponential
+    backoff (from min_backoff up to max_backoff seconds, with jitter).
+
+    When the sink raises UploadError, the readings it did upload are
+    committed. When it raises RejectedError, the rejected readings are sent
+    one by one, and the ones rejected alone are moved to the dead-letter
+    file of the spool, so they do not block the others.
+
+    The readings are expected to carry their capture time (epoch seconds)
+    in their "time" field, to report the upload lag."""
+
+    def __init__(self, spool, sink, batch_size=100, min_backoff=1, max_backoff=600,
+                 poll_period=60):
+        self.spool = spool
+        self.sink = sink
+        self.batch_size = batch_size
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.poll_period = poll_period
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.uploaded = 0
+        self.rejected = 0
+        self.failures = 0
+        # Readings to send one by one, to find the rejected ones.
+        self._isolating = 0
+        self.last_error = None
+        self.last_upload_time = None
+        self.oldest_pending_time = None
+
+    def start(self):
+        """Start the upload thread."""
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="Uploader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the upload thread (the pending readings stay spooled)."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.sink.close()
+
+    def notify(self):
+        """Signal new readings are spooled."""
+        self._wakeup.set()
+
+    def stats(self):
+        """Return the upload counters, as a dictionary with:
+            uploaded -- the number of readings uploaded;
+            rejected -- the number of readings rejected by the sink;
+            backlog -- the number of readings waiting for upload;
+            lag -- the age of the oldest reading waiting for upload, in seconds;
+            failures -- the number of failed uploads;
+            lastError -- the error of the last failed upload, if any."""
+        oldest = self.oldest_pending_time
+        return dict(
+            uploaded=self.uploaded,
+            rejected=self.rejected,
+            backlog=self.spool.pending,
+            lag=round(time.time() - oldest, 3) if oldest and self.spool.pending else 0,
+            failures=self.failures,
+            lastError=self.last_error,
+        )
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stopping:
+            readings, positions = self.spool.peek(1 if self._isolating else self.batch_size)
+            if not readings:
+                self.oldest_pending_time = None
+                self._wakeup.wait(self.poll_period)
+                self._wakeup.clear()
+                continue
+            self.oldest_pending_time = readings[0].get("time")
+            sent, failure = len(readings), None
+            try:
+                self.sink.send(readings)
+            except Exception as error:  # pylint: disable=broad-except
+                sent, failure = getattr(error, "sent", 0), error
+            if sent:
+                self._commit(positions, sent)
+            if failure is None:
+                backoff = self.min_backoff
+            elif isinstance(failure, RejectedError):
+                self._reject(readings[sent:], positions[sent:], failure)
+            else:
+                # Keep the rest spooled and retry later.
+                self.failures += 1
+                self.last_error = repr(failure)
+                if self._stopping:
+                    return
+                self._wait(backoff * random.uniform(0.5, 1.0))
+                backoff = min(self.max_backoff, backoff * 2)
+
+    def _commit(self, positions, count):
+        self.spool.commit(positions[count - 1], count)
+        self.uploaded += count
+        self.last_upload_time = time.time()
+        self._isolating = max(0, self._isolating - count)
+
+    def _reject(self, readings, positions, error):
+        self.last_error = repr(error)
+        if len(readings) > 1:
+            # Which ones were rejected? Send them one by one.
+            self._isolating = len(readings)
+            return
+        LOGGER.warning("Dropping a reading rejected by the sink (%s): %s", error, readings[0])
+        self.spool.dead_letter(readings[0], str(error))
+        self.spool.commit(positions[0], 1)
+        self.rejected += 1
+        self._isolating = max(0, self._isolating - 1)
+
+    def _wait(self, delay):
+        deadline = time.monotonic() + delay
+        while not self._stopping and time.monotonic() < deadline:
+            self._wakeup.wait(deadline - time.monotonic())
+            self._wakeup.clear()
+
+
+class SinkPipeline:
+    """Take a RadiationWatch reading every period seconds, spool it,
+    and upload the spooled readings to a sink.
+
+    Usage:
+    ```
+    sink = HTTPSink("https://example.org/readings")
+    with RadiationWatch(24, 23) as radiationWatch:
+        pipeline = SinkPipeline(radiationWatch, Spool("/var/spool/geiger"), sink, period=300)
+        pipeline.start()
+        # ...
+        pipeline.stop()
+    ```
+    """
+
+    def __init__(self, radiation_watch, spool, sink, period=300, batch_size=100, **kwargs):
+        """Extra keyword arguments are given to the Uploader."""
+        self.radiation_watch = radiation_watch
+        self.spool = spool
+        self.uploader = Uploader(spool, sink, batch_size=batch_size, **kwargs)
+        self.scheduler = PeriodicScheduler(period, self._sample, name="SinkPipeline")
+
+    def start(self):
+        self.uploader.start()
+        self.scheduler.start()
+
+    def stop(self):
+        self.scheduler.stop()
+        self.uploader.stop()
+        self.spool.close()
+
+    def stats(self):
+        """Return the upload counters, see Uploader.stats()."""
+        return self.uploader.stats()
+
+    def _sample(self):
+        reading = dict(self.radiation_watch.status())
+        reading["time"] = round(time.time(), 3)
+        reading["radiationTotal"] = self.radiation_watch.radiation_total
+        reading["noiseTotal"] = self.radiation_watch.noise_total
+        self.spool.put(reading)
+        self.uploader.notify()
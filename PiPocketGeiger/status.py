@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Readings snapshots, and lock-free edge counting.
+
+Released under MIT License. See LICENSE file.
+"""
+import itertools
+import math
+
+__all__ = ["Status", "EdgeCounter"]
+
+
+class Status(dict):
+    """Immutable readings snapshot.
+
+    It is a dictionary (so existing code indexing, printing or serializing
+    the readings keeps working) which can not be modified, and has no
+    per-instance attribute dictionary. The readings are also available
+    as attributes: status.cpm, status.uSvh, etc. The exact count and
+    duration (ms) the readings were computed from, when known, are the
+    count and duration_ms attributes (they are not part of the dictionary).
+    """
+
+    __slots__ = ("count", "duration_ms")
+
+    def __init__(self, duration, cpm, uSvh, uSvhError,  # pylint: disable=invalid-name
+                 count=None, duration_ms=None):
+        super().__init__(duration=duration, cpm=cpm, uSvh=uSvh, uSvhError=uSvhError)
+        object.__setattr__(self, "count", count)
+        object.__setattr__(self, "duration_ms", duration_ms)
+
+    @classmethod
+    def from_counts(cls, count, duration, calibration, max_duration=None):
+        """Compute the readings of count radiation counts over duration
+        milliseconds, averaged over max_duration milliseconds at most,
+        with the given Calibration (dead-time correction and k_alpha)."""
+        averaged = duration if max_duration is None else min(duration, max_duration)
+        minutes = averaged / 1000 / 60.0
+        cpm = count / minutes if minutes > 0 else 0
+        cpm_error = math.sqrt(count) / minutes if minutes > 0 else 0
+        cpm, cpm_error = calibration.correct(cpm, cpm_error)
+        k_alpha = calibration.k_alpha
+        return cls(
+            duration=round(duration / 1000.0, 2),
+            cpm=round(cpm, 2),
+            uSvh=round(cpm / k_alpha, 3),
+            uSvhError=round(cpm_error / k_alpha, 3) if minutes > 0 else 0,
+            count=count,
+            duration_ms=duration,
+        )
+
+    duration = property(lambda self: self["duration"])
+    cpm = property(lambda self: self["cpm"])
+    uSvh = property(lambda self: self["uSvh"])  # pylint: disable=invalid-name
+    uSvhError = property(lambda self: self["uSvhError"])  # pylint: disable=invalid-name
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Status snapshots are immutable")
+
+    __setitem__ = __delitem__ = __setattr__ = __delattr__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __reduce__(self):
+        return (self.__class__, tuple(self.values()) + (self.count, self.duration_ms))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class EdgeCounter:
+    """Count edges without taking any lock.
+
+    increment() is the __next__ method of an itertools.count: a single
+    C call, atomic under the GIL, that never blocks the edge thread.
+    value() must only be called from one thread (the processing one),
+    and add() from one thread (the one feeding batches of edges).
+    """
+
+    def __init__(self):
+        self._counter = itertools.count()
+        self.increment = self._counter.__next__
+        # Each value() call consumes one count, which we subtract.
+        self._reads = 0
+        self._added = 0
+
+    def add(self, count):
+        """Count a batch of count edges at once."""
+        self._added += count
+
+    def value(self):
+        """Return the number of edges counted so far."""
+        value = next(self._counter) - self._reads + self._added
+        self._reads += 1
+        return value
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Sliding windows over the radiation counts, at several time resolutions.
+
+Released under MIT License. See LICENSE file.
+"""
+from PiPocketGeiger.status import Status
+
+__all__ = ["SlidingWindow", "DEFAULT_WINDOWS", "WINDOW_BUCKETS"]
+
+# Windows maintained by default: name -> duration (seconds).
+DEFAULT_WINDOWS = {"1m": 60, "10m": 600, "1h": 3600, "24h": 86400}
+# Number of buckets of each window. The window slides by steps of
+# one bucket, i.e. its duration divided by WINDOW_BUCKETS.
+WINDOW_BUCKETS = 60
+
+
+class SlidingWindow:
+    """Radiation counts and measurement time over the last duration seconds.
+
+    The window is a ring of buckets, each one holding the counts and the
+    (noise free) measurement time of a slice of the window, along with
+    running sums: adding counts and sliding the window are O(1),
+    whatever the window duration.
+    """
+
+    def __init__(self, duration, buckets=WINDOW_BUCKETS):
+        """Create a window of duration seconds, split into buckets slices."""
+        if duration <= 0 or buckets <= 0:
+            raise ValueError("The window duration and buckets must be positive")
+        self.duration = duration
+        self.buckets = buckets
+        # Duration of a bucket (milliseconds).
+        self.unit = duration * 1000.0 / buckets
+        self.reset(0)
+
+    def reset(self, current_time):
+        """Empty the window, starting its first bucket at current_time
+        (milliseconds)."""
+        self.counts = [0] * self.buckets
+        self.times = [0] * self.buckets
+        self.index = 0
+        self.count = 0
+        self.time = 0
+        self.previous_shift_time = current_time
+
+    def add(self, count, elapsed):
+        """Add count radiation counts measured during elapsed milliseconds
+        to the current bucket."""
+        self.counts[self.index] += count
+        self.times[self.index] += elapsed
+        self.count += count
+        self.time += elapsed
+
+    def advance(self, current_time):
+        """Slide the window up to current_time (milliseconds), forgetting the
+        buckets which got out of it."""
+        while current_time - self.previous_shift_time >= self.unit:
+            self.previous_shift_time += self.unit
+            self.index = (self.index + 1) % self.buckets
+            self.count -= self.counts[self.index]
+            self.time -= self.times[self.index]
+            self.counts[self.index] = 0
+            self.times[self.index] = 0
+
+    def status(self, calibration):
+        """Return the readings over the window with the given Calibration,
+        as a Status with duration the measurement time in the window
+        (see RadiationWatch.status())."""
+        return Status.from_counts(self.count, self.time, calibration)
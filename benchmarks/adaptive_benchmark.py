@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the wakeups of the fixed and adaptive processing modes, and check
+the adaptive readings against a replay of the same pulses processed
+every 160 ms.
+
+No hardware is needed: edges come from the SimulatedBackend. The replay
+needs NumPy.
+
+    python benchmarks/adaptive_benchmark.py [duration_seconds]
+
+Released under MIT License. See LICENSE file.
+"""
+import sys
+import time
+
+from PiPocketGeiger import PROCESS_PERIOD, RadiationWatch, SimulatedBackend
+from PiPocketGeiger.replay import Recording, replay
+
+# Simulated radiation rates, in counts per minute.
+RATES_CPM = [10, 60, 300, 600, 6000]
+NOISE_CPM = 1
+SEED = 42
+
+
+def run(cpm, duration, adaptive):
+    backend = SimulatedBackend(radiation_cpm=cpm, noise_cpm=NOISE_CPM, seed=SEED)
+    radiation_watch = RadiationWatch(
+        24, 23, backend=backend, event_capacity=1 << 20, adaptive=adaptive
+    )
+    with radiation_watch:
+        time.sleep(duration)
+    # Replay the recorded edges up to the last period processed.
+    recording = Recording.from_timestamps(
+        radiation_watch.radiation_events()[0],
+        radiation_watch.noise_events()[0],
+        start=radiation_watch._origin,
+        end=radiation_watch.previous_time,
+    )
+    result = replay(recording, windows={"1m": 60})
+    last = len(result) - 1
+    identical = (
+        (radiation_watch.previous_time - radiation_watch._origin) // PROCESS_PERIOD == len(result)
+        and radiation_watch.status() == result.status(last)
+        and radiation_watch.status("1m") == result.status(last, "1m")
+    )
+    return dict(
+        cpm=radiation_watch.status()["cpm"],
+        wakeupsPerHour=radiation_watch.scheduler_stats()["wakeupsPerHour"],
+        identicalToReplay=identical,
+    )
+
+
+if __name__ == "__main__":
+    DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 30.0
+    print("Running each rate for {0} seconds in both modes.".format(DURATION))
+    for rate in RATES_CPM:
+        fixed = run(rate, DURATION, adaptive=False)
+        adaptive = run(rate, DURATION, adaptive=True)
+        print("{0:>6} CPM: fixed {1}".format(rate, fixed))
+        print("{0:>6} CPM: adaptive {1}".format(rate, adaptive))
+        print("{0:>6} CPM: adaptive wakeups {1:+.1%}".format(
+            rate, adaptive["wakeupsPerHour"] / fixed["wakeupsPerHour"] - 1))
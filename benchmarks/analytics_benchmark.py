@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time the analytics over the histories of many simulated sensors in one
+batch, and compare the coverage of the exact Poisson intervals with the
+one of the count +/- 1.96 sqrt(count) interval at background counts.
+Also checks that analyze() always gives an interval containing the
+readings, before and after the history is full, up to the dead-time
+saturation.
+
+Needs NumPy.
+
+    python benchmarks/analytics_benchmark.py [sensors]
+
+Released under MIT License. See LICENSE file.
+"""
+import sys
+import time
+
+import numpy
+
+from PiPocketGeiger import PROCESS_PERIOD, Calibration, StatisticsCore
+from PiPocketGeiger.analytics import (
+    allan_deviation,
+    analyze,
+    dispersion_index,
+    interarrival_fit,
+    poisson_interval,
+)
+
+# Complete buckets of a default history (200 buckets of 6 seconds).
+BUCKETS = 199
+SEED = 42
+# Mean counts of the coverage check: the first minutes at background level.
+MEANS = [0.5, 1, 2, 5, 10, 30]
+PULSES = 1000
+# Rates of the interval check, in counts per minute, up to the saturation
+# of a 200 us dead time.
+RATES_CPM = [1, 10, 100, 1e3, 1e4, 1e5, 1e6]
+# Periods of the interval check: 40 minutes, twice the history.
+PERIODS = 15000
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def outside_interval(generator, cpm):
+    """Return the number of analyze() intervals not containing uSvh."""
+    core = StatisticsCore(calibration=Calibration(dead_time=200e-6))
+    core.reset(0)
+    outside = 0
+    counts = generator.poisson(cpm * PROCESS_PERIOD / 60000.0, size=PERIODS)
+    for period, count in enumerate(counts, 1):
+        core.process(period * PROCESS_PERIOD, int(count), 0)
+        if period % 500 == 0:
+            result = analyze(core)
+            if not result["uSvhLower"] <= core.status().uSvh <= result["uSvhUpper"]:
+                outside += 1
+    return outside
+
+
+def coverage(generator, mean, draws=100000):
+    counts = generator.poisson(mean, size=draws)
+    lower, upper = poisson_interval(counts)
+    exact = ((lower <= mean) & (mean <= upper)).mean()
+    error = 1.96 * numpy.sqrt(counts)
+    normal = ((counts - error <= mean) & (mean <= counts + error)).mean()
+    return exact, normal
+
+
+if __name__ == "__main__":
+    SENSORS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    generator = numpy.random.default_rng(SEED)
+    histories = generator.poisson(generator.uniform(0.5, 50, size=(SENSORS, 1)),
+                                  size=(SENSORS, BUCKETS))
+    totals = histories.sum(axis=1)
+    print("{0} sensors of {1} buckets:".format(SENSORS, BUCKETS))
+    print("  poisson_interval: {0:.1f} ms".format(timed(poisson_interval, totals)))
+    print("  poisson_interval (first bucket): {0:.1f} ms".format(
+        timed(poisson_interval, histories[:, 0])))
+    print("  dispersion_index: {0:.1f} ms".format(timed(dispersion_index, histories)))
+    print("  allan_deviation: {0:.1f} ms".format(timed(allan_deviation, histories)))
+    sequences = [
+        numpy.cumsum(generator.exponential(1e9, size=PULSES)).astype(numpy.int64)
+        for _ in range(SENSORS // 10)
+    ]
+    print("  interarrival_fit ({0} sensors of {1} pulses): {2:.1f} ms".format(
+        len(sequences), PULSES, timed(interarrival_fit, sequences)))
+    _, p_values = dispersion_index(histories)
+    print("  Poisson histories rejected at 5%: {0:.1%}".format((p_values < 0.05).mean()))
+    print("95% interval coverage (exact, normal):")
+    for mean_count in MEANS:
+        print("  mean of {0:>4} counts: {1:.1%}, {2:.1%}".format(
+            mean_count, *coverage(generator, mean_count)))
+    print("Readings outside their analyze() interval:")
+    for rate in RATES_CPM:
+        print("  {0:>9.0f} CPM: {1} of {2}".format(
+            rate, outside_interval(generator, rate), PERIODS // 500))
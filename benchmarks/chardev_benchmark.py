@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the per-edge cost of the one-callback-per-edge ingestion with the
+batched ingestion of the GPIO character device events.
+
+No hardware is needed: the line events are written to a pipe standing
+in for the line request file descriptor. Both paths record the edges
+timestamps (event_capacity).
+
+    python benchmarks/chardev_benchmark.py [edges]
+
+Released under MIT License. See LICENSE file.
+"""
+import os
+import sys
+import threading
+import time
+
+from PiPocketGeiger import GPIOBackend, RadiationWatch, SimulatedBackend
+from PiPocketGeiger.chardev import FALLING_EDGE, LINE_EVENT, LineEventReader
+
+RADIATION_PIN = 24
+NOISE_PIN = 23
+
+
+class PipeBackend(GPIOBackend):
+    """Batched backend reading the line events from a pipe."""
+
+    batched = True
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.reader = None
+        self.read_fd, self.write_fd = os.pipe()
+
+    def start_batched(self, radiation_pin, noise_pin, on_edges, bouncetime=None):
+        self.reader = LineEventReader(
+            self.read_fd, on_edges, radiation_pin, noise_pin, batch=self.batch
+        )
+        self.reader.start()
+
+    def close(self):
+        self.reader.close()
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def per_edge(edges):
+    backend = SimulatedBackend(radiation_cpm=0)
+    with RadiationWatch(RADIATION_PIN, NOISE_PIN, backend=backend,
+                        event_capacity=edges) as radiation_watch:
+        start = time.perf_counter()
+        for _ in range(edges):
+            radiation_watch._on_radiation(RADIATION_PIN)
+        return (time.perf_counter() - start) / edges * 1e9
+
+
+def batched(edges, batch):
+    backend = PipeBackend(batch)
+    origin = time.monotonic_ns()
+    data = b"".join(
+        LINE_EVENT.pack(origin + index * 1000, FALLING_EDGE, RADIATION_PIN, index + 1, index + 1)
+        for index in range(edges)
+    )
+    with RadiationWatch(RADIATION_PIN, NOISE_PIN, backend=backend,
+                        event_capacity=edges) as radiation_watch:
+        start = time.perf_counter()
+        writer = threading.Thread(target=os.write, args=(backend.write_fd, data))
+        writer.start()
+        while radiation_watch.radiation_buffer.total < edges:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        writer.join()
+        stats = backend.reader.stats()
+    return elapsed / edges * 1e9, stats
+
+
+if __name__ == "__main__":
+    EDGES = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print("One callback by edge:  {0:.0f} ns/edge".format(per_edge(EDGES)))
+    for size in (1, 16, 256):
+        cost, reader = batched(EDGES, size)
+        print("Batches of {0:>3} events: {1:.0f} ns/edge, {2} events/read, {3} lost".format(
+            size, cost, reader["eventsPerRead"], reader["lostEvents"]))
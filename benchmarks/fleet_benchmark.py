@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Feed a FleetAggregator with the readings of many simulated nodes, sent
+through gateways over a Unix socket, then time the fleet-wide queries.
+
+No hardware is needed. Needs NumPy.
+
+    python benchmarks/fleet_benchmark.py [nodes]
+
+Released under MIT License. See LICENSE file.
+"""
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from PiPocketGeiger.fleet import FleetAggregator, hello_frame, readings_frame
+
+GATEWAYS = 16
+# An hour of readings by node, sent in two batches.
+READINGS = 60
+BATCHES = 2
+# Nodes not reporting: their second batch is not sent.
+STALE_FRACTION = 0.01
+SEED = 42
+REPEAT = 20
+
+
+def simulate(address, nodes, now, barrier):
+    """Send the readings of the nodes from a gateway, wait for their acks."""
+    generator = random.Random(SEED + nodes[0])
+    gateway = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    gateway.connect(address)
+    frames, received = 0, 0
+    for batch in range(BATCHES):
+        data = []
+        for node in nodes:
+            if batch and generator.random() < STALE_FRACTION:
+                continue
+            dose = 0.05 + generator.expovariate(10)
+            data.append(hello_frame("node-{0}".format(node), generator.uniform(30, 46),
+                                    generator.uniform(129, 146),
+                                    "region-{0}".format(node % 47)))
+            readings = [
+                dict(time=now - 60 * (READINGS - index), duration=60.0,
+                     cpm=dose * 53.032, uSvh=dose, uSvhError=0.01,
+                     radiationTotal=index, noiseTotal=0)
+                for index in range(batch * READINGS // BATCHES,
+                                   (batch + 1) * READINGS // BATCHES)
+            ]
+            data.append(readings_frame(readings))
+            frames += 1
+        gateway.sendall(b"".join(data))
+        # One 7-byte acknowledgement by readings frame.
+        while received < 7 * frames:
+            received += len(gateway.recv(1 << 16))
+        # The batches of all the gateways are received one after the other.
+        barrier.wait()
+        barrier.wait()
+    gateway.close()
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        function(*args, **kwargs)
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+if __name__ == "__main__":
+    NODES = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    ADDRESS = os.path.join(tempfile.mkdtemp(), "fleet.sock")
+    aggregator = FleetAggregator(ADDRESS)
+    aggregator.start()
+    NOW = time.time()
+    BARRIER = threading.Barrier(GATEWAYS + 1)
+    start = time.perf_counter()
+    gateways = [
+        threading.Thread(target=simulate,
+                         args=(ADDRESS, list(range(gateway, NODES, GATEWAYS)), NOW, BARRIER))
+        for gateway in range(GATEWAYS)
+    ]
+    for thread in gateways:
+        thread.start()
+    BARRIER.wait()
+    first_batch = time.time()
+    elapsed = time.perf_counter() - start
+    time.sleep(0.1)
+    BARRIER.wait()
+    start = time.perf_counter()
+    BARRIER.wait()
+    BARRIER.wait()
+    elapsed += time.perf_counter() - start
+    for thread in gateways:
+        thread.join()
+    # The nodes not heard from since the first batch.
+    MAX_AGE = time.time() - first_batch - 0.05
+    stats = aggregator.stats()
+    print("{0} nodes through {1} gateways: {2} readings in {3:.2f} s".format(
+        stats["nodes"], GATEWAYS, stats["readings"], elapsed))
+    print("Hottest: {0}".format(aggregator.top(1)[0]))
+    print("Stale: {0} nodes".format(len(aggregator.stale(MAX_AGE))))
+    print("top(10): {0:.2f} ms".format(timed(aggregator.top, 10)))
+    print("top(10, window=600): {0:.2f} ms".format(timed(aggregator.top, 10, window=600)))
+    print("regions(): {0:.2f} ms".format(timed(aggregator.regions)))
+    print("regions(cell=1.0): {0:.2f} ms".format(timed(aggregator.regions, cell=1.0)))
+    print("stale(): {0:.2f} ms".format(timed(aggregator.stale, MAX_AGE)))
+    aggregator.stop()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stress the edge counting hot path and the readings snapshots.
+
+Measures the per-edge overhead of RadiationWatch._on_radiation (lock-free
+counting) against the former locked counting, while the statistics are
+processed, and checks the consistency of the status() snapshots read
+concurrently at a high rate. The per-edge time is the software dead time
+to give to Calibration (see measure_software_dead_time()). Also measures
+the per-edge overhead of the diagnostics.
+
+    python benchmarks/hot_path_benchmark.py [edges]
+
+Released under MIT License. See LICENSE file.
+"""
+import sys
+import threading
+import time
+
+from PiPocketGeiger import (
+    Calibration,
+    MAX_CPM_TIME,
+    RadiationWatch,
+    SimulatedBackend,
+    Status,
+)
+
+
+class LockedCounter:
+    """The former edge counting: a counter behind the driver mutex."""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.radiation_count = 0
+
+    def on_radiation(self, _channel):
+        with self.mutex:
+            self.radiation_count += 1
+
+
+def time_edges(on_edge, edges):
+    start = time.perf_counter()
+    for _ in range(edges):
+        on_edge(24)
+    return (time.perf_counter() - start) / edges * 1e9
+
+
+def consistent(status, calibration):
+    """Whether all the readings derive from the exact (count, duration)
+    pair the snapshot was published with."""
+    return status == Status.from_counts(
+        status.count, status.duration_ms, calibration, MAX_CPM_TIME
+    )
+
+
+def read_snapshots(radiation_watch, stop, results):
+    reads = inconsistent = 0
+    while not stop.is_set():
+        if not consistent(radiation_watch.status(), radiation_watch.calibration):
+            inconsistent += 1
+        reads += 1
+    results.update(reads=reads, inconsistent=inconsistent)
+
+
+if __name__ == "__main__":
+    EDGES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    locked = LockedCounter()
+    print("Locked counting:    {0:.0f} ns/edge".format(time_edges(locked.on_radiation, EDGES)))
+    # No simulated edges: we inject them ourselves, as fast as possible.
+    with RadiationWatch(24, 23, backend=SimulatedBackend(radiation_cpm=0)) as radiation_watch:
+        stop = threading.Event()
+        results = {}
+        reader = threading.Thread(target=read_snapshots, args=(radiation_watch, stop, results))
+        reader.start()
+        overhead = time_edges(radiation_watch._on_radiation, EDGES)
+        stop.set()
+        reader.join()
+        # Let a processing period account for the last edges.
+        time.sleep(0.2)
+        counted = radiation_watch.radiation_total
+    print("Lock-free counting: {0:.0f} ns/edge (with a concurrent status() reader)".format(
+        overhead))
+    print("Edges injected: {0}, counted: {1}".format(EDGES, counted))
+    print("Snapshots read: {reads}, inconsistent: {inconsistent}".format(**results))
+    instrumented_watch = RadiationWatch(
+        24, 23, backend=SimulatedBackend(radiation_cpm=0), diagnostics=True
+    )
+    with instrumented_watch:
+        on_radiation = instrumented_watch._timed(
+            instrumented_watch._on_radiation,
+            instrumented_watch._histograms["radiationCallback"],
+        )
+        print("With diagnostics:   {0:.0f} ns/edge".format(time_edges(on_radiation, EDGES)))
+        callback = instrumented_watch.diagnostics()["radiationCallback"]
+    print("Edge callback p50: {0} s, p99: {1} s, max: {2:.6f} s".format(
+        callback["p50"], callback["p99"], callback["max"]))
+    calibration = Calibration(software_dead_time=overhead / 1e9)
+    for cpm in (1e3, 1e5, 1e6):
+        print("Software dead-time correction at {0:.0f} CPM: {1:+.3%}".format(
+            cpm, calibration.correct(cpm)[0] / cpm - 1))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure the throughput and the write amplification of MeasurementLogger.
+
+Logs synthetic readings as fast as possible in each format, then logs a
+simulated day of readings (one every 30 s) with several flush policies,
+reporting the disk pages rewritten by payload byte: one flush per
+reading (as the former example did) against buffered flushes.
+
+    python benchmarks/logger_benchmark.py [records]
+
+Released under MIT License. See LICENSE file.
+"""
+import sys
+import tempfile
+import time
+
+from PiPocketGeiger import Status
+from PiPocketGeiger.logger import BINARY, CSV, MeasurementLogger
+
+PERIOD = 30
+DAY = 86400 // PERIOD
+
+
+def readings(count):
+    for index in range(count):
+        cpm = 10 + index % 7
+        yield Status(duration=1200.0, cpm=cpm, uSvh=round(cpm / 53.032, 3), uSvhError=0.025)
+
+
+def throughput(records, format, compression):
+    # pylint: disable=redefined-builtin
+    with tempfile.TemporaryDirectory() as directory:
+        logger = MeasurementLogger(None, directory, format=format, compression=compression,
+                                   max_bytes=4 * 1024 * 1024, flush_period=60)
+        start = time.perf_counter()
+        timestamp = 1.7e9
+        for status in readings(records):
+            logger.log(status, timestamp)
+            timestamp += PERIOD
+        logger.close()
+        elapsed = time.perf_counter() - start
+        stats = logger.stats()
+    print("{0:>4} {1:>5}: {2:>8.0f} records/s, {3:.1f} bytes/record, "
+          "{4} segments, {5} compressed bytes".format(
+              format, str(compression), records / elapsed,
+              stats["payloadBytes"] / records, stats["segments"], stats["compressedBytes"]))
+
+
+def amplification(format, flush_every, fsync):
+    # pylint: disable=redefined-builtin
+    with tempfile.TemporaryDirectory() as directory:
+        # Flushes are driven below, as if flush_period were flush_every readings.
+        logger = MeasurementLogger(None, directory, format=format, compression=None,
+                                   flush_period=float("inf"), fsync=fsync)
+        timestamp = 1.7e9
+        for index, status in enumerate(readings(DAY)):
+            logger.log(status, timestamp)
+            timestamp += PERIOD
+            if (index + 1) % flush_every == 0:
+                logger.flush()
+        logger.close()
+        stats = logger.stats()
+    print("{0:>4}, flush every {1:>4} readings: {2:>5} writes, {3:>5} pages, "
+          "write amplification {4}".format(
+              format, flush_every, stats["flushes"], stats["pagesWritten"],
+              stats["writeAmplification"]))
+
+
+if __name__ == "__main__":
+    RECORDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    for log_format in (CSV, BINARY):
+        for log_compression in (None, "gzip"):
+            throughput(RECORDS, log_format, log_compression)
+    print("A day of readings, one every {0} s:".format(PERIOD))
+    for log_format in (CSV, BINARY):
+        for every in (1, 10, 120):
+            amplification(log_format, every, fsync=False)
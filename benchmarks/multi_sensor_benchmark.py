@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Run an increasing number of simulated sensors with a SensorManager, and
+report the processing time of the shared ticks, the threads used, and the
+coincidences counted against the accidental coincidences expected.
+
+No hardware is needed: edges come from SimulatedBackend instances.
+
+    python benchmarks/multi_sensor_benchmark.py [duration_seconds]
+
+Released under MIT License. See LICENSE file.
+"""
+import sys
+import threading
+import time
+
+from PiPocketGeiger import SimulatedBackend
+from PiPocketGeiger.dispatch import CallbackDispatcher
+from PiPocketGeiger.manager import SensorManager
+
+SENSORS = [1, 4, 16, 64, 256]
+# Simulated radiation rate of each sensor, in counts per minute.
+CPM = 600
+COINCIDENCE_WINDOW = 0.001
+SEED = 42
+
+
+def run(sensors, duration):
+    manager = SensorManager(
+        dispatcher=CallbackDispatcher(), coincidence_window=COINCIDENCE_WINDOW
+    )
+    for index in range(sensors):
+        backend = SimulatedBackend(radiation_cpm=CPM, seed=SEED + index)
+        manager.add_sensor("s{0}".format(index), 24, 23, backend=backend)
+    callbacks = []
+    manager.register_radiation_callback(callbacks.append)
+    with manager:
+        threads = threading.active_count()
+        time.sleep(duration)
+        fused = manager.fused_status("1m")
+        coincidences = manager.coincidences()
+        scheduler = manager.scheduler_stats()
+    expected = sum(coincidences["expectedAccidental"].values())
+    return dict(
+        cpm=fused["cpm"],
+        pValue=fused["pValue"],
+        threads=threads,
+        callbacks=len(callbacks),
+        lateTicks=scheduler["late"],
+        maxLatenessMs=round(scheduler["maxLateness"] * 1000, 3),
+        pairCoincidences=sum(coincidences["pairs"].values()),
+        expectedAccidental=round(expected, 1),
+    )
+
+
+if __name__ == "__main__":
+    DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    print("Running each sensor count for {0} seconds.".format(DURATION))
+    for count in SENSORS:
+        print("{0:>4} sensors: {1}".format(count, run(count, DURATION)))
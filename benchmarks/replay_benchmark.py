@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay a simulated recording of pulse timestamps through the statistics.
+
+Generates days of Poisson radiation and noise pulses, times the vectorized
+replay, and checks its readings against the period by period replay
+through the StatisticsCore used by RadiationWatch, on the first day.
+
+    python benchmarks/replay_benchmark.py [days] [cpm]
+
+Released under MIT License. See LICENSE file.
+"""
+import sys
+import time
+
+import numpy
+
+from PiPocketGeiger.replay import Recording, replay, replay_core
+
+NOISE_CPM = 0.5
+START = 10 ** 12
+
+
+def poisson_timestamps(generator, cpm, seconds):
+    """Sorted timestamps (ns) of a Poisson process of cpm pulses per minute."""
+    count = generator.poisson(cpm / 60.0 * seconds)
+    return numpy.sort(generator.integers(START, START + int(seconds * 1e9), count))
+
+
+if __name__ == "__main__":
+    DAYS = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+    CPM = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    generator = numpy.random.default_rng(42)
+    seconds = DAYS * 86400
+    radiation = poisson_timestamps(generator, CPM, seconds)
+    noise = poisson_timestamps(generator, NOISE_CPM, seconds)
+    recording = Recording.from_timestamps(radiation, noise)
+    start = time.perf_counter()
+    # One reading per minute.
+    result = replay(recording, every=375)
+    elapsed = time.perf_counter() - start
+    print("Replayed {0:g} days ({1} pulses) in {2:.2f} s: {3}".format(
+        DAYS, len(radiation), elapsed, result.status(len(result) - 1)))
+    day = Recording.from_timestamps(
+        radiation[radiation < START + 86400 * 10 ** 9],
+        noise[noise < START + 86400 * 10 ** 9],
+        start=START // 1000000,
+        end=START // 1000000 + 86400 * 1000,
+    )
+    start = time.perf_counter()
+    reference = replay_core(day, every=375)
+    elapsed = time.perf_counter() - start
+    vectorized = replay(day, every=375)
+    identical = all(
+        numpy.array_equal(getattr(vectorized, name), getattr(reference, name))
+        for name in ("times", "count", "duration")
+    ) and all(
+        numpy.array_equal(vectorized.windows[name][index], reference.windows[name][index])
+        for name in reference.windows
+        for index in (0, 1)
+    )
+    print("Period by period replay of a day: {0:.2f} s, identical readings: {1}".format(
+        elapsed, identical))
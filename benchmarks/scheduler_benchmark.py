@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the per-tick threading.Timer processing loop used up to now
+with the single-thread PeriodicScheduler.
+
+Reports, for each implementation, the number of threads created and the
+tick jitter relative to the ideal schedule (start + n * period).
+
+    python benchmarks/scheduler_benchmark.py [duration_seconds]
+
+Released under MIT License. See LICENSE file.
+"""
+import statistics
+import sys
+import threading
+import time
+
+from PiPocketGeiger.scheduler import PeriodicScheduler
+
+# Same period as the statistics processing of RadiationWatch (seconds).
+PERIOD = 0.16
+# Simulated processing work per tick (seconds).
+WORK = 0.002
+
+
+class ThreadCounter:
+    """Count the threads started while active."""
+
+    def __init__(self):
+        self.count = 0
+        self._original_start = None
+
+    def __enter__(self):
+        self._original_start = threading.Thread.start
+        counter = self
+
+        def start(thread):
+            counter.count += 1
+            return counter._original_start(thread)
+
+        threading.Thread.start = start
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        threading.Thread.start = self._original_start
+
+
+def busy_work():
+    end = time.monotonic() + WORK
+    while time.monotonic() < end:
+        pass
+
+
+class LegacyTimerLoop:
+    """The former RadiationWatch processing loop: a new Timer each tick."""
+
+    def __init__(self, period, function):
+        self.period = period
+        self.function = function
+        self.mutex = threading.Lock()
+        self.timer = None
+
+    def start(self):
+        self._enable_timer()
+
+    def stop(self):
+        with self.mutex:
+            self.timer.cancel()
+            timer, self.timer = self.timer, None
+        timer.join()
+
+    def _enable_timer(self):
+        self.timer = threading.Timer(self.period, self._tick)
+        self.timer.start()
+
+    def _tick(self):
+        self.function()
+        with self.mutex:
+            if self.timer:
+                self._enable_timer()
+
+
+def run(factory, duration):
+    ticks = []
+
+    def tick():
+        ticks.append(time.monotonic())
+        busy_work()
+
+    with ThreadCounter() as counter:
+        start = time.monotonic()
+        runner = factory(PERIOD, tick)
+        runner.start()
+        time.sleep(duration)
+        runner.stop()
+    lateness = [t - (start + (n + 1) * PERIOD) for n, t in enumerate(ticks)]
+    intervals = [b - a for a, b in zip(ticks, ticks[1:])]
+    return dict(
+        threads=counter.count,
+        ticks=len(ticks),
+        finalDriftMs=round(lateness[-1] * 1000, 3) if lateness else 0,
+        meanIntervalMs=round(statistics.mean(intervals) * 1000, 3) if intervals else 0,
+        jitterMs=round(statistics.pstdev(intervals) * 1000, 3) if intervals else 0,
+    )
+
+
+if __name__ == "__main__":
+    DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    print("Running each implementation for {0} seconds.".format(DURATION))
+    print("threading.Timer per tick: {0}".format(run(LegacyTimerLoop, DURATION)))
+    print("PeriodicScheduler:        {0}".format(run(PeriodicScheduler, DURATION)))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load-test the statistics pipeline with simulated radiation edges,
+at increasing rates, and report the edges dropped by the delivery.
+
+No hardware is needed: edges come from the SimulatedBackend.
+
+    python benchmarks/simulated_load_benchmark.py [duration_seconds]
+
+Released under MIT License. See LICENSE file.
+"""
+import sys
+import time
+
+from PiPocketGeiger import RadiationWatch, SimulatedBackend
+
+# Simulated radiation rates, in counts per minute.
+RATES_CPM = [0.1, 10, 1000, 60000, 600000, 1800000]
+# Delay after which a late edge is considered lost (seconds).
+MAX_LAG = 0.01
+SEED = 42
+
+
+def run(cpm, duration):
+    backend = SimulatedBackend(radiation_cpm=cpm, noise_cpm=1, seed=SEED, max_lag=MAX_LAG)
+    with RadiationWatch(24, 23, backend=backend) as radiation_watch:
+        time.sleep(duration)
+        status = radiation_watch.status()
+        scheduler = radiation_watch.scheduler_stats()
+    edges = backend.stats()
+    total = edges["radiationEdges"] + edges["noiseEdges"] + edges["droppedEdges"]
+    return dict(
+        cpm=status["cpm"],
+        delivered=edges["radiationEdges"],
+        dropped=edges["droppedEdges"],
+        droppedRatio=round(edges["droppedEdges"] / total, 4) if total else 0,
+        lateTicks=scheduler["late"],
+        maxLatenessMs=round(scheduler["maxLateness"] * 1000, 3),
+    )
+
+
+if __name__ == "__main__":
+    DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    print("Running each rate for {0} seconds.".format(DURATION))
+    for rate in RATES_CPM:
+        print("{0:>10} CPM: {1}".format(rate, run(rate, DURATION)))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure how fast a backlog of spooled readings drains once the
+connectivity comes back, against a local HTTP stand-in server.
+
+Spools a week of readings (one per minute), lets the first uploads fail,
+then times the upload of the whole backlog.
+
+    python benchmarks/spool_drain_benchmark.py [batch_size]
+
+Released under MIT License. See LICENSE file.
+"""
+import http.server
+import json
+import sys
+import tempfile
+import threading
+import time
+
+from PiPocketGeiger.sinks import HTTPSink, Spool, Uploader
+
+READINGS = 7 * 24 * 60
+FAILURES = 3
+# Give up on the drain after this many seconds.
+TIMEOUT = 120
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    received = 0
+    requests = 0
+    connections = set()
+
+    def do_POST(self):
+        cls = StandInHandler
+        cls.requests += 1
+        cls.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        status = 503 if cls.requests <= FAILURES else 200
+        if status == 200:
+            cls.received += len(json.loads(body))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    BATCH_SIZE = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as directory:
+        spool = Spool(directory)
+        start = time.time() - READINGS * 60
+        for index in range(READINGS):
+            spool.put(dict(time=start + index * 60, duration=1200.0, cpm=5.2, uSvh=0.098,
+                           uSvhError=0.01))
+        print("Spooled {0} readings.".format(spool.pending))
+        sink = HTTPSink("http://127.0.0.1:{0}/readings".format(server.server_port))
+        uploader = Uploader(spool, sink, batch_size=BATCH_SIZE, min_backoff=0.05)
+        began = time.monotonic()
+        uploader.start()
+        while StandInHandler.received < READINGS and time.monotonic() - began < TIMEOUT:
+            time.sleep(0.01)
+        elapsed = time.monotonic() - began
+        uploader.stop()
+        spool.close()
+        if StandInHandler.received < READINGS:
+            server.shutdown()
+            raise SystemExit("Not drained after {0} s: {1}".format(TIMEOUT, uploader.stats()))
+        print("Drained in {0:.3f} s ({1} requests, {2} connections): {3}".format(
+            elapsed, StandInHandler.requests, len(StandInHandler.connections),
+            uploader.stats()))
+    server.shutdown()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Log radiation hits and readings to the console, from an asyncio application.
+
+Released under MIT License. See LICENSE file.
+"""
+import asyncio
+from PiPocketGeiger import RadiationWatch
+
+
+async def log_pulses(radiation_watch):
+    async for pulse in radiation_watch.pulses(noise=True):
+        if pulse.kind == "radiation":
+            print("Ray appeared!")
+        else:
+            print("Noisy and moving around here!")
+
+
+async def log_status(radiation_watch):
+    async for status in radiation_watch.status_stream(5):
+        print(status)
+
+
+async def main():
+    # Create the RadiationWatch object, specifying the used GPIO pins ...
+    async with RadiationWatch(24, 23) as radiation_watch:
+        # ... and print hits as they come, and readings each 5 seconds.
+        await asyncio.gather(log_pulses(radiation_watch), log_status(radiation_watch))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,43 +1,35 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Log radiation levels to a CSV file.
+Log radiation levels to rotating CSV files.
+
+A new file is started every day (or every MiB), and the previous ones
+are compressed with gzip. The readings are written every 5 minutes
+to spare the SD card.
 
 Released under MIT License. See LICENSE file.
 
 By Yoan Tournade <yoan@ytotech.com>
 """
 from PiPocketGeiger import RadiationWatch
-import datetime
+from PiPocketGeiger.logger import MeasurementLogger
 import time
-import csv
 
-FILENAME = "radiation.csv"
+DIRECTORY = "radiation"
 LOGGING_PERIOD = 30
 
 if __name__ == "__main__":
-    try:
-        radiationWatch = RadiationWatch(24, 23)
-        radiationWatch.setup()
+    with RadiationWatch(24, 23) as radiationWatch:
         print(
-            "Logging to the file {0} each {1} seconds.".format(FILENAME, LOGGING_PERIOD)
+            "Logging to the directory {0} each {1} seconds.".format(DIRECTORY, LOGGING_PERIOD)
+        )
+        logger = MeasurementLogger(
+            radiationWatch, DIRECTORY, period=LOGGING_PERIOD, max_age=86400, flush_period=300
         )
-        with open(FILENAME, "w") as myfile:
-            writer = csv.writer(myfile, quoting=csv.QUOTE_ALL)
-            writer.writerow(["date", "duration", "CPM", "uSv/h", "uSv/h error"])
+        logger.start()
+        try:
             while 1:
-                readings = radiationWatch.status()
-                print("Logging... {0}.".format(readings))
-                writer.writerow(
-                    [
-                        datetime.datetime.now().strftime("%d/%m/%Y %H:%M:00"),
-                        readings["duration"],
-                        readings["cpm"],
-                        readings["uSvh"],
-                        readings["uSvhError"],
-                    ]
-                )
                 time.sleep(LOGGING_PERIOD)
-                myfile.flush()
-    finally:
-        radiationWatch.close()
+                print("Logging... {0}.".format(radiationWatch.status()))
+        finally:
+            logger.stop()
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 """
-Play a typical Geiger counter sound on radiation, using callbacks.
+Play a typical Geiger counter sound on radiation.
 
-Use the aplay command. You'll need a speaker connected to your Raspberry Pi:
+The clicks are mixed in-process and played with a single aplay stream.
+You'll need a speaker connected to your Raspberry Pi:
     http://www.raspberrypi-spy.co.uk/2013/06/raspberry-pi-command-line-audio/
 
 Released under MIT License. See LICENSE file.
@@ -11,19 +12,17 @@ Released under MIT License. See LICENSE file.
 By Yoan Tournade <yoan@ytotech.com>
 """
 from PiPocketGeiger import RadiationWatch
-import subprocess
+from PiPocketGeiger.audio import ClickPlayer
 import time
 
 if __name__ == "__main__":
-
-    def onRadiation():
-        print("Ray appeared!")
-        # Play a classic geiger click sound.
-        subprocess.Popen(["aplay", "click.wav"])
-
-    with RadiationWatch(24, 23) as radiationWatch:
+    # Above 50 clicks per second, the clicks get higher pitched.
+    with RadiationWatch(24, 23) as radiationWatch, ClickPlayer(
+        "click.wav", max_rate=50
+    ) as player:
         print("Waiting for gamma rays to hit the Pocket Geiger.")
-        radiationWatch.register_radiation_callback(onRadiation)
+        radiationWatch.add_pulse_listener(player)
         while 1:
             # Do not keep the CPU busy for nothing: sleep.
             time.sleep(30)
+            print(player.stats())
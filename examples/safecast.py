@@ -13,8 +13,8 @@ Released under MIT License. See LICENSE file.
 By Yoan Tournade <yoan@ytotech.com>
 """
 from PiPocketGeiger import RadiationWatch
+from PiPocketGeiger.sinks import SafecastSink, SinkPipeline, Spool
 import time
-import datetime
 import SafecastPy
 
 # Safecast API key.
@@ -32,6 +32,8 @@ HEIGHT = 100
 # Period for publishing on Safecast API, in minutes.
 # Five minutes is fine for background monitoring.
 LOGGING_PERIOD = 5
+# Where to keep the readings until they are published.
+SPOOL_DIRECTORY = "safecast-spool"
 
 if __name__ == "__main__":
     print("Logging each {0} minutes.".format(LOGGING_PERIOD))
@@ -45,28 +47,25 @@ if __name__ == "__main__":
             "sensor": "FirstSensor X100-7 SMD",
         }
     ).get("id")
+    sink = SafecastSink(
+        API_KEY,
+        device_id,
+        MY_LOCATION["latitude"],
+        MY_LOCATION["longitude"],
+        location_name=MY_LOCATION_NAME,
+        height=HEIGHT,
+        api_url=SAFECAST_INSTANCE.rstrip("/"),
+    )
     with RadiationWatch(24, 23) as radiationWatch:
-        while 1:
-            # Sleep first so we can sample enough data to stabilize results.
-            time.sleep(LOGGING_PERIOD * 60)
-            try:
-                readings = radiationWatch.status()
-                print("Logging... {0}.".format(readings))
-                payload = {
-                    "latitude": MY_LOCATION["latitude"],
-                    "longitude": MY_LOCATION["longitude"],
-                    "value": readings["uSvh"],
-                    "unit": SafecastPy.UNIT_USV,
-                    "captured_at": datetime.datetime.utcnow().isoformat() + "+00:00",
-                    "device_id": device_id,
-                }
-                if MY_LOCATION_NAME:
-                    payload["location_name"] = MY_LOCATION_NAME
-                if HEIGHT:
-                    payload["height"] = HEIGHT
-                measurement = safecast.add_measurement(json=payload)
-                print("Ok. Measurement published with id {0}".format(measurement["id"]))
-            except Exception as e:
-                # A catch-all to keep the thing alive even if we have transient
-                # network or service errors.
-                print(e)
+        # Readings are spooled on disk and published in the background:
+        # they are kept (and retried) during network or service outages.
+        pipeline = SinkPipeline(
+            radiationWatch, Spool(SPOOL_DIRECTORY), sink, period=LOGGING_PERIOD * 60
+        )
+        pipeline.start()
+        try:
+            while 1:
+                time.sleep(LOGGING_PERIOD * 60)
+                print("Publishing... {0}.".format(pipeline.stats()))
+        finally:
+            pipeline.stop()
@@ -23,5 +23,10 @@ setup(
     zip_safe=True,
     platforms="any",
     install_requires=["rpi-lgpio>=0.6"],
-    extras_require={"dev": ["flake8", "pylint"]},
+    extras_require={
+        "dev": ["flake8", "pylint", "pytest"], "gpiozero": ["gpiozero"],
+        "replay": ["numpy"], "analytics": ["numpy"],
+        "fleet": ["numpy"],
+    },
+    entry_points={"console_scripts": ["pipocketgeiger = PiPocketGeiger.cli:main"]},
 )
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the pipocketgeiger command.
+
+Released under MIT License. See LICENSE file.
+"""
+import json
+import os
+
+import pytest
+
+from PiPocketGeiger import cli
+from PiPocketGeiger.replay import Recording, replay
+
+numpy = pytest.importorskip("numpy")
+
+
+def test_replay_fractional_history_unit(tmp_path, capsys):
+    # A pulse every 100 ms, for 2 minutes.
+    timestamps = numpy.arange(1, 1200, dtype=numpy.int64) * 100000000
+    path = os.path.join(str(tmp_path), "radiation.npy")
+    numpy.save(path, timestamps)
+    cli.main(["replay", "--radiation", path, "--history-unit", "0.5",
+              "--history-length", "40", "--every", "375"])
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    expected = replay(Recording.from_timestamps(timestamps), history_length=40,
+                      history_unit=0.5, every=375)
+    assert len(lines) == len(expected) > 0
+    assert lines[-1]["cpm"] == expected.status(len(expected) - 1)["cpm"]
+
+
+def test_replay_rejects_sub_millisecond_history_unit(tmp_path):
+    path = os.path.join(str(tmp_path), "radiation.npy")
+    numpy.save(path, numpy.arange(1, 10, dtype=numpy.int64) * 100000000)
+    with pytest.raises(ValueError):
+        cli.main(["replay", "--radiation", path, "--history-unit", "0.0005"])
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the callback dispatcher.
+
+Released under MIT License. See LICENSE file.
+"""
+import functools
+import threading
+import time
+
+from PiPocketGeiger.dispatch import COALESCE, CallbackDispatcher
+
+TIMEOUT = 5
+
+
+def wait_for(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def test_coalesced_call_delivered_under_continuous_submission():
+    dispatcher = CallbackDispatcher(maxsize=4, overflow=COALESCE)
+    dispatcher.start()
+    stopped = threading.Event()
+
+    def flood():
+        # The queue keeps refilling, and overflowing.
+        while not stopped.is_set():
+            dispatcher.submit(functools.partial(time.sleep, 0.001), key="flood")
+
+    flooder = threading.Thread(target=flood)
+    flooder.start()
+    try:
+        assert wait_for(lambda: dispatcher.stats()["queueDepth"] == dispatcher.maxsize)
+        readings = []
+        for value in range(10):
+            dispatcher.submit(functools.partial(readings.append, value), key="reading")
+        # The latest value of the key is delivered while the flood goes on.
+        assert wait_for(lambda: 9 in readings)
+        assert flooder.is_alive()
+    finally:
+        stopped.set()
+        flooder.join()
+        dispatcher.stop()
+    assert readings[-1] == 9
+    assert dispatcher.stats()["coalesced"] > 0
+
+
+def test_coalesce_keeps_the_last_call_by_key():
+    dispatcher = CallbackDispatcher(maxsize=1, overflow=COALESCE)
+    readings = []
+    # Not started: the queue fills up, then the calls overflow.
+    for value in range(5):
+        dispatcher.submit(functools.partial(readings.append, value), key="reading")
+    assert dispatcher.stats()["coalesced"] == 3
+    dispatcher.start()
+    dispatcher.stop()
+    assert readings == [0, 4]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the fleet aggregation.
+
+Released under MIT License. See LICENSE file.
+"""
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+from PiPocketGeiger.daemon import FRAME_HEADER, read_frames
+from PiPocketGeiger.fleet import (
+    ACK_PAYLOAD,
+    FRAME_ACK,
+    FRAME_READINGS,
+    READING_PAYLOAD,
+    FleetAggregator,
+    FleetSink,
+)
+from PiPocketGeiger.sinks import Spool, Uploader
+
+pytest.importorskip("numpy")
+
+TIMEOUT = 10
+
+
+def readings(count):
+    return [dict(time=1700000000 + index * 60, duration=60.0, cpm=5.3, uSvh=0.1,
+                 uSvhError=0.01, radiationTotal=index, noiseTotal=0)
+            for index in range(count)]
+
+
+class FlakyAggregator:
+    """Stand-in aggregator acknowledging only the first partial readings
+    of its first connection, before closing it, then all the readings."""
+
+    def __init__(self, path, partial):
+        self.partial = partial
+        self.stored = []
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        first = True
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return
+            with connection:
+                self._receive(connection, self.partial if first else None)
+            first = False
+
+    def _receive(self, connection, partial):
+        buffer = bytearray()
+        while True:
+            data = connection.recv(1 << 16)
+            if not data:
+                return
+            buffer += data
+            for frame_type, start, end in read_frames(buffer):
+                if frame_type != FRAME_READINGS:
+                    continue
+                times = [record[0] for record in
+                         READING_PAYLOAD.iter_unpack(bytes(buffer[start:end]))]
+                if partial is not None:
+                    times = times[:partial]
+                self.stored.extend(times)
+                connection.sendall(FRAME_HEADER.pack(FRAME_ACK, ACK_PAYLOAD.size)
+                                   + ACK_PAYLOAD.pack(len(times)))
+                if partial is not None:
+                    return
+
+    def close(self):
+        self._server.close()
+
+
+def test_partial_acknowledgement_not_sent_again(tmp_path):
+    path = os.path.join(str(tmp_path), "fleet.sock")
+    aggregator = FlakyAggregator(path, partial=3)
+    spool = Spool(os.path.join(str(tmp_path), "spool"))
+    sent = readings(5)
+    for reading in sent:
+        spool.put(reading)
+    uploader = Uploader(spool, FleetSink(path, "rooftop", timeout=TIMEOUT), batch_size=5,
+                        min_backoff=0.05)
+    uploader.start()
+    deadline = time.monotonic() + TIMEOUT
+    while spool.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    uploader.stop()
+    spool.close()
+    aggregator.close()
+    assert not spool.pending
+    # Each reading stored once: the acknowledged ones were committed.
+    assert aggregator.stored == [reading["time"] for reading in sent]
+    assert uploader.stats()["uploaded"] == 5
+
+
+def test_sink_to_aggregator(tmp_path):
+    path = os.path.join(str(tmp_path), "fleet.sock")
+    aggregator = FleetAggregator(path, depth=4)
+    aggregator.start()
+    sink = FleetSink(path, "rooftop", latitude=35.68, longitude=139.69, region="Tokyo")
+    try:
+        sink.send(readings(6))
+    finally:
+        sink.close()
+        aggregator.stop()
+    assert [reading["time"] for reading in aggregator.node("rooftop")] == [
+        reading["time"] for reading in readings(6)[2:]
+    ]
+    assert aggregator.totals("rooftop") == dict(radiationTotal=5, noiseTotal=0)
+    assert aggregator.top(1)[0]["region"] == "Tokyo"
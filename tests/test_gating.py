@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the noise gate.
+
+Released under MIT License. See LICENSE file.
+"""
+import os
+import time
+
+from PiPocketGeiger import HistoryStore, NoiseGate, RadiationWatch, SimulatedBackend
+
+
+def test_live_time_in_whole_milliseconds():
+    gate = NoiseGate(dead_window=0.001)
+    gate.reset(0)
+    gate.push("noise", 2000000)
+    total = 0
+    # Settle up to 10 s, by steps of 0.3 ms: no time is lost to rounding.
+    for step in range(1, 33334):
+        accepted, live_time = gate.process(step * 300000)
+        assert accepted == 0
+        assert isinstance(live_time, int)
+        total += live_time
+    settled_ns = 33333 * 300000 - 1000000 - gate.vetoed_time
+    assert total == settled_ns // 1000000
+
+
+def test_gate_with_history_store(tmp_path):
+    path = os.path.join(str(tmp_path), "history.ring")
+    backend = SimulatedBackend(radiation_cpm=6000, noise_cpm=600, seed=42)
+    store = HistoryStore(path, flush_period=0.1)
+    radiation_watch = RadiationWatch(24, 23, backend=backend, noise_gate=NoiseGate(),
+                                     history_store=store)
+    with radiation_watch:
+        time.sleep(1)
+        # The periodic saves did not stop the processing.
+        assert radiation_watch.scheduler.running
+        assert isinstance(radiation_watch.duration, int)
+        assert radiation_watch.noise_gate.stats()["vetoed"] > 0
+    with RadiationWatch(24, 23, backend=SimulatedBackend(radiation_cpm=0),
+                        history_store=HistoryStore(path)) as resumed:
+        assert resumed.count >= radiation_watch.count > 0
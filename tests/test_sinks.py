@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the reliable uploads, against a local HTTP stand-in server.
+
+Released under MIT License. See LICENSE file.
+"""
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from PiPocketGeiger.sinks import HTTPSink, SafecastSink, Spool, Uploader
+
+TIMEOUT = 10
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    """Answer each POST with the status returned by respond(payload), and
+    keep the payloads accepted (status 200)."""
+
+    def __init__(self, respond):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.respond = respond
+        self.accepted = []
+        self.requests = []
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{0}".format(self.server_port)
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        server = self.server
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server.requests.append(time.monotonic())
+        status = server.respond(payload)
+        if status == 200:
+            server.accepted.append(payload)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    servers = []
+
+    def start(respond):
+        server = StandInServer(respond)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def statuses(*scripted):
+    """Answer the scripted statuses to the first requests, then 200."""
+    remaining = list(scripted)
+    return lambda payload: remaining.pop(0) if remaining else 200
+
+
+def readings(count):
+    return [dict(time=1700000000 + index * 60, uSvh=0.1, index=index)
+            for index in range(count)]
+
+
+def upload(directory, sink, spooled, **options):
+    """Spool the readings, and upload them until none is left."""
+    spool = Spool(directory)
+    for reading in spooled:
+        spool.put(reading)
+    uploader = Uploader(spool, sink, min_backoff=0.05, **options)
+    uploader.start()
+    deadline = time.monotonic() + TIMEOUT
+    while spool.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    uploader.stop()
+    spool.close()
+    assert not spool.pending, "The upload did not complete: {0}".format(uploader.stats())
+    return uploader
+
+
+def accepted_indexes(server):
+    return sorted(
+        reading["index"] for payload in server.accepted for reading in payload
+    )
+
+
+def test_retry_with_backoff(stand_in, tmp_path):
+    server = stand_in(statuses(503, 503))
+    uploader = upload(str(tmp_path), HTTPSink(server.url + "/readings"), readings(10),
+                      batch_size=10)
+    assert accepted_indexes(server) == list(range(10))
+    assert uploader.stats()["failures"] == 2
+    first, second, third = server.requests
+    # Jittered between half and the whole backoff, which doubles.
+    assert second - first >= 0.025
+    assert third - second >= 0.05
+
+
+def test_partial_batch_committed(stand_in, tmp_path):
+    # Safecast takes one measurement per request: the third one fails.
+    server = stand_in(statuses(200, 200, 503))
+    sink = SafecastSink("key", 1, 35.68, 139.69, api_url=server.url)
+    uploader = upload(str(tmp_path), sink, readings(5), batch_size=5)
+    # The first two are not sent again.
+    assert len(server.accepted) == 5
+    assert uploader.stats()["uploaded"] == 5
+    assert uploader.stats()["failures"] == 1
+
+
+def test_rejected_reading_dead_lettered(stand_in, tmp_path):
+    server = stand_in(
+        lambda payload: 400 if any(reading["index"] == 3 for reading in payload) else 200
+    )
+    uploader = upload(str(tmp_path), HTTPSink(server.url + "/readings"), readings(8),
+                      batch_size=8)
+    assert accepted_indexes(server) == [0, 1, 2, 4, 5, 6, 7]
+    assert uploader.stats()["rejected"] == 1
+    with open(os.path.join(str(tmp_path), Spool.DEAD_LETTER), encoding="utf-8") as dead_letter:
+        rejected = [json.loads(line) for line in dead_letter]
+    assert [entry["reading"]["index"] for entry in rejected] == [3]
+    assert "HTTP 400" in rejected[0]["reason"]
+
+
+@pytest.mark.parametrize("status", [408, 429])
+def test_timeout_and_rate_limit_retried(stand_in, tmp_path, status):
+    server = stand_in(statuses(status, status))
+    uploader = upload(str(tmp_path), HTTPSink(server.url + "/readings"), readings(4),
+                      batch_size=4)
+    assert accepted_indexes(server) == [0, 1, 2, 3]
+    assert uploader.stats()["rejected"] == 0
+    assert uploader.stats()["failures"] == 2
+    assert not os.path.exists(os.path.join(str(tmp_path), Spool.DEAD_LETTER))